@@ -0,0 +1,271 @@
+"""
+Site-wide Wrapped statistics, computed for every user at once.
+
+All favorites are loaded into NumPy columns (user, runtime, rating,
+decade and genre codes) and the per-user numbers are worked out with
+vectorized group-bys instead of calling calculate_wrapped_stats in a
+loop. wrapped_stats_for_all() gives exactly the same result as
+calculate_wrapped_stats for every user, including how ties are broken.
+The columns are filled a whole column at a time, and decade and genre
+codes are worked out once per distinct value rather than once per row.
+
+Usage:
+    python analytics.py report [--top 10]
+    python analytics.py verify [--favorites 1000000]
+"""
+import argparse
+import json
+import random
+import time
+from functools import partial
+from itertools import chain
+from operator import is_not, itemgetter
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from models import Codes, Movie, decade_label, rating_total
+from services import GENRE_MAP, calculate_wrapped_stats
+
+# Users are split into cohorts by how many favorites they have
+COHORTS = [(1, "1-9"), (10, "10-49"), (50, "50-199"), (200, "200+")]
+
+class FavoriteColumns:
+    """Favorites of every user as NumPy arrays, one entry per favorite (or per genre of a favorite)"""
+
+    def __init__(self, rows: Iterable[tuple]):
+        """rows as returned by UserStore.favorite_rows()"""
+        self.genres = Codes(GENRE_MAP)
+        self.decades = Codes()
+
+        rows = rows if isinstance(rows, list) else list(rows)
+        n = len(rows)
+        names, movie_ids, release_dates, ratings, runtimes, genres = (
+            list(map(itemgetter(i), rows)) for i in range(6)
+        )
+
+        # Users in the order they first show up, then one dict lookup per row at C speed
+        self.usernames: List[str] = list(dict.fromkeys(names))
+        user_index = {username: i for i, username in enumerate(self.usernames)}
+        user = np.fromiter(map(user_index.__getitem__, names), dtype=np.int64, count=n)
+        has_movie = np.fromiter(map(partial(is_not, None), movie_ids), dtype=bool, count=n)
+
+        # Labels are worked out once per distinct release date and genre, not once per row
+        decade_of = {}
+        for release_date in dict.fromkeys(release_dates):
+            label = decade_label(release_date)
+            decade_of[release_date] = self.decades.code(label) if label else -1
+        decade = np.fromiter(map(decade_of.__getitem__, release_dates), dtype=np.int64, count=n)
+
+        genre_counts = np.fromiter(map(len, genres), dtype=np.int64, count=n)
+        flat_genres = list(chain.from_iterable(genres))
+        genre_of = {genre: self.genres.code(genre) for genre in dict.fromkeys(flat_genres)}
+
+        self.user = user[has_movie]
+        self.runtime = np.array(runtimes, dtype=np.int64)[has_movie]
+        self.rating = np.array(ratings, dtype=np.float64)[has_movie]
+        self.decade = decade[has_movie]
+        # Rows without a movie have no genres, so they drop out of the repeat on their own
+        self.genre_user = np.repeat(user, genre_counts)
+        self.genre_code = np.fromiter(map(genre_of.__getitem__, flat_genres), dtype=np.int64, count=len(flat_genres))
+
+    @property
+    def n_users(self) -> int:
+        return len(self.usernames)
+
+    def counts(self) -> np.ndarray:
+        return np.bincount(self.user, minlength=self.n_users)
+
+    def total_minutes(self) -> np.ndarray:
+        return np.bincount(self.user, weights=self.runtime, minlength=self.n_users).astype(np.int64)
+
+    def rating_sums(self) -> np.ndarray:
+        # bincount adds the values of each bin in array order, same as sum() over the list
+        return np.bincount(self.user, weights=self.rating, minlength=self.n_users)
+
+def count_per_user(users: np.ndarray, codes: np.ndarray, n_codes: int):
+    """
+    Count every (user, code) pair. Returns the pairs as arrays
+    (user, code, count, first) where first is the index of the pair's first occurrence.
+    """
+    keys = users * n_codes + codes
+    if len(keys) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, empty
+    # Bins instead of np.unique: there are few users times codes, and no sort is needed
+    all_counts = np.bincount(keys)
+    first = np.full(len(all_counts), len(keys), dtype=np.int64)
+    np.minimum.at(first, keys, np.arange(len(keys)))
+    unique = np.flatnonzero(all_counts)
+    return unique // n_codes, unique % n_codes, all_counts[unique], first[unique]
+
+def top_per_user(pairs, labels: List[str], n_users: int) -> np.ndarray:
+    """
+    Most common code per user (-1 if none). Ties go to the code whose label
+    sorts first, like models.most_common.
+    """
+    users, codes, counts, _ = pairs
+    top = np.full(n_users, -1, dtype=np.int64)
+    if len(users) == 0:
+        return top
+    rank = {label: i for i, label in enumerate(sorted(labels))}
+    label_rank = np.array([rank[label] for label in labels], dtype=np.int64)
+    order = np.lexsort((label_rank[codes], -counts, users))
+    sorted_users = users[order]
+    is_first = np.concatenate(([True], sorted_users[1:] != sorted_users[:-1]))
+    top[sorted_users[is_first]] = codes[order][is_first]
+    return top
+
+def wrapped_stats_for_all(cols: FavoriteColumns) -> Dict[str, dict]:
+    """calculate_wrapped_stats for every user, keyed by username"""
+    counts = cols.counts()
+    minutes = cols.total_minutes()
+    rating_sums = cols.rating_sums()
+
+    valid = cols.decade >= 0
+    decade_pairs = count_per_user(cols.user[valid], cols.decade[valid], max(len(cols.decades), 1))
+    genre_pairs = count_per_user(cols.genre_user, cols.genre_code, len(cols.genres))
+    top_genre = top_per_user(genre_pairs, cols.genres.labels, cols.n_users)
+    top_decade = top_per_user(decade_pairs, cols.decades.labels, cols.n_users)
+
+    # Decade breakdown per user, in the order each decade first shows up
+    breakdowns: List[Dict[str, int]] = [{} for _ in range(cols.n_users)]
+    users, codes, decade_counts, first = decade_pairs
+    order = np.lexsort((first, users))
+    decade_labels = cols.decades.labels
+    for user, code, count in zip(users[order].tolist(), codes[order].tolist(), decade_counts[order].tolist()):
+        breakdowns[user][decade_labels[code]] = count
+
+    # Plain Python values from here on, indexing NumPy arrays one element at a time is slow
+    genre_names = [cols.genres.labels[code] if code >= 0 else "Unknown" for code in top_genre.tolist()]
+    decade_names = [decade_labels[code] if code >= 0 else None for code in top_decade.tolist()]
+    result = {}
+    for i, (username, count, total, rating_sum) in enumerate(
+        zip(cols.usernames, counts.tolist(), minutes.tolist(), rating_sums.tolist())
+    ):
+        if not count:
+            result[username] = calculate_wrapped_stats([])
+            continue
+        result[username] = {
+            "hours": total // 60,
+            "minutes": total % 60,
+            "total_movies": count,
+            "most_common_genre": genre_names[i],
+            "average_rating": round(rating_total(rating_sum) / count, 1),
+            "rated_movies": count,
+            "top_decade": decade_names[i],
+            "decade_breakdown": breakdowns[i],
+        }
+    return result
+
+def watch_time_leaderboard(cols: FavoriteColumns, top: int = 10) -> List[dict]:
+    minutes = cols.total_minutes()
+    order = np.argsort(-minutes, kind="stable")[:top]
+    return [{"username": cols.usernames[i], "minutes": int(minutes[i])} for i in order]
+
+def cohort_of_users(cols: FavoriteColumns) -> np.ndarray:
+    """Index into COHORTS for every user, -1 for users without favorites"""
+    bounds = np.array([low for low, _ in COHORTS])
+    return np.searchsorted(bounds, cols.counts(), side="right") - 1
+
+def genre_share_by_cohort(cols: FavoriteColumns) -> Dict[str, Dict[str, float]]:
+    """Share of each genre among all genre tags, per cohort"""
+    cohort = cohort_of_users(cols)[cols.genre_user]
+    n_genres = len(cols.genres)
+    table = np.bincount(
+        cohort[cohort >= 0] * n_genres + cols.genre_code[cohort >= 0],
+        minlength=len(COHORTS) * n_genres,
+    ).reshape(len(COHORTS), n_genres)
+
+    shares = {}
+    for (_, label), row in zip(COHORTS, table):
+        total = row.sum()
+        if total:
+            shares[label] = {
+                cols.genres.labels[g]: round(float(row[g] / total), 4)
+                for g in np.argsort(-row, kind="stable") if row[g]
+            }
+    return shares
+
+def decade_distribution(cols: FavoriteColumns) -> Dict[str, int]:
+    counts = np.bincount(cols.decade[cols.decade >= 0], minlength=len(cols.decades))
+    return {label: int(counts[code]) for code, label in sorted(enumerate(cols.decades.labels), key=lambda x: x[1])}
+
+def report(cols: FavoriteColumns, top: int) -> dict:
+    return {
+        "users": cols.n_users,
+        "favorites": int(len(cols.user)),
+        "watch_time_leaderboard": watch_time_leaderboard(cols, top),
+        "genre_share_by_cohort": genre_share_by_cohort(cols),
+        "decade_distribution": decade_distribution(cols),
+    }
+
+def random_movie(rng: random.Random, movie_id: int) -> Movie:
+    genre_names = list(GENRE_MAP) + ["Unlisted"]
+    release_date: Optional[str] = f"{rng.randint(1920, 2025)}-0{rng.randint(1, 9)}-15"
+    if rng.random() < 0.05:
+        release_date = rng.choice([None, "", "Unknown"])
+    return Movie.model_construct(
+        id=movie_id,
+        title=f"Movie {movie_id}",
+        release_date=release_date,
+        rating=rng.choice([0.0, round(rng.uniform(1, 10), 1), round(rng.uniform(1, 10), 3)]),
+        runtime=rng.randint(0, 240),
+        genres=rng.sample(genre_names, rng.randint(0, 3)),
+    )
+
+def verify(total_favorites: int, seed: int = 1) -> bool:
+    """Compare wrapped_stats_for_all with calculate_wrapped_stats on generated data"""
+    rng = random.Random(seed)
+    rows, expected = [], {}
+    per_user_time = 0.0
+    user = favorites = 0
+    while favorites < total_favorites:
+        username = f"user{user}"
+        user += 1
+        size = min(int(rng.expovariate(1 / 50)), 2000, total_favorites - favorites)
+        movies = [random_movie(rng, favorites + i) for i in range(size)]
+        favorites += size
+
+        start = time.perf_counter()
+        expected[username] = calculate_wrapped_stats(movies)
+        per_user_time += time.perf_counter() - start
+
+        if not movies:
+            rows.append((username, None, None, 0.0, 0, []))
+        rows.extend((username, m.id, m.release_date, m.rating, m.runtime, m.genres) for m in movies)
+
+    start = time.perf_counter()
+    cols = FavoriteColumns(rows)
+    load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = wrapped_stats_for_all(cols)
+    batch_time = time.perf_counter() - start
+
+    mismatches = [name for name in expected if expected[name] != actual.get(name)]
+    print(f"{len(expected)} users, {len(cols.user)} favorites")
+    print(f"calculate_wrapped_stats loop: {per_user_time:.2f}s")
+    print(f"columns load: {load_time:.2f}s, vectorized stats: {batch_time:.2f}s, "
+          f"total: {load_time + batch_time:.2f}s ({per_user_time / max(load_time + batch_time, 1e-9):.1f}x)")
+    print(f"mismatches: {len(mismatches)}")
+    for name in mismatches[:5]:
+        print(name, expected[name], actual.get(name))
+    return not mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Site-wide Wrapped analytics")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report_cmd = sub.add_parser("report", help="leaderboard, genre share per cohort and decades for all users")
+    report_cmd.add_argument("--top", type=int, default=10)
+    verify_cmd = sub.add_parser("verify", help="check the batch stats against calculate_wrapped_stats")
+    verify_cmd.add_argument("--favorites", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    if args.command == "report":
+        from services import get_store
+        print(json.dumps(report(FavoriteColumns(get_store().favorite_rows()), args.top), indent=2, ensure_ascii=False))
+    else:
+        raise SystemExit(0 if verify(args.favorites) else 1)
+
+if __name__ == "__main__":
+    main()
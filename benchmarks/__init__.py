@@ -0,0 +1,61 @@
+"""
+Setup shared by the benchmark scripts.
+
+Most of them run the app in this process against benchmarks.mock_upstream.
+They call use_mock_upstream() first thing, before any of the app's modules
+is imported (those read their settings on import).
+"""
+import os
+import tempfile
+from typing import Dict, Optional
+
+MOCK_URL = "http://tmdb.mock"
+
+# Files that would carry caches over from an earlier run (or a real instance)
+STATE_FILES = ("CACHE_DB_FILE", "CATALOG_DB_FILE", "WARMUP_SNAPSHOT_FILE")
+
+def mock_env(directory: Optional[str] = None, environ: Optional[Dict[str, str]] = None,
+             **settings: Optional[str]) -> Dict[str, str]:
+    """
+    A copy of environ (os.environ by default) for an app talking to the mock:
+    users in a fresh users.db in directory (a new temporary one if not given),
+    no warm-up prefetch and no cache, catalog or snapshot files. settings are
+    set on top, None removes a variable so the app's default applies.
+    """
+    env = dict(os.environ if environ is None else environ)
+    for key in STATE_FILES:
+        env.pop(key, None)
+    env.update({
+        "USERS_DB_FILE": os.path.join(directory or tempfile.mkdtemp(), "users.db"),
+        "TMDB_BASE_URL": MOCK_URL,
+        "OMDB_URL": MOCK_URL + "/",
+        "OMDB_API_KEY": env.get("OMDB_API_KEY") or "bench",
+        "WARMUP_PREFETCH": "0",
+    })
+    for key, value in settings.items():
+        if value is None:
+            env.pop(key, None)
+        else:
+            env[key] = value
+    return env
+
+def mock_transport():
+    """Transport that sends upstream requests to the mock app in this process"""
+    import httpx
+    from benchmarks import mock_upstream
+    return httpx.ASGITransport(app=mock_upstream.app)
+
+def mock_clients():
+    """Every upstream client opened from now on, the one the lifespan starts included, talks to the mock"""
+    import upstream
+    create_client = upstream.create_client
+    upstream.create_client = lambda transport=None: create_client(transport or mock_transport())
+
+def use_mock_upstream(directory: Optional[str] = None, **settings: Optional[str]) -> str:
+    """mock_env() and mock_clients() for this process, returns the directory of users.db"""
+    env = mock_env(directory, **settings)
+    for key in set(os.environ) - set(env):
+        del os.environ[key]
+    os.environ.update(env)
+    mock_clients()
+    return os.path.dirname(env["USERS_DB_FILE"])
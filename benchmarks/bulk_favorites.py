@@ -0,0 +1,55 @@
+"""
+Add N favorites one POST at a time, with one bulk request and with a JSONL import.
+
+Run from the project root:  python -m benchmarks.bulk_favorites [sqlite|json] [movies]
+"""
+import asyncio
+import importlib
+import json
+import os
+import sys
+import time
+
+from benchmarks import use_mock_upstream
+
+async def run(count: int):
+    import httpx
+    import main
+    from services import get_user
+
+    def movie(i):
+        return {"id": i, "title": f"Movie {i}", "runtime": 100, "genres": ["Drama"], "release_date": "1999-01-01"}
+
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            for name in ("single", "bulk", "import"):
+                await client.post("/api/register", data={"username": name, "password": "pw"})
+                await client.post("/api/login", data={"username": name, "password": "pw"})
+                start = time.perf_counter()
+                if name == "single":
+                    for i in range(count):
+                        form = {**movie(i), "genres": "Drama"}
+                        (await client.post("/api/favorites", data=form)).raise_for_status()
+                elif name == "bulk":
+                    r = await client.post("/api/favorites/bulk", json={"add": [movie(i) for i in range(count)]})
+                    r.raise_for_status()
+                else:
+                    body = "".join(json.dumps(movie(i)) + "\n" for i in range(count)).encode()
+                    r = await client.post("/api/favorites/import?format=jsonl", content=body)
+                    r.raise_for_status()
+                elapsed = time.perf_counter() - start
+                stored = len((await get_user(name)).favorites)
+                print(f"{name:7} {count} movies in {elapsed:.2f}s ({elapsed / count * 1000:.3f} ms/movie), {stored} stored")
+
+def main():
+    backend = sys.argv[1] if len(sys.argv) > 1 else "sqlite"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    directory = use_mock_upstream(STORAGE_BACKEND=backend, GENRE_POOL_REFRESH="0")
+    # Import the app while still in the project root (static/ and templates/ are relative)
+    importlib.import_module("main")
+    os.chdir(directory)  # users.json is relative, keep it out of the project
+    print(f"backend: {backend}")
+    asyncio.run(run(count))
+
+if __name__ == "__main__":
+    main()
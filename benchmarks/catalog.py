@@ -0,0 +1,118 @@
+"""
+Offline check and timing of the local movie catalog.
+
+Seeds the catalog with generated movies, times type-ahead (suggest) and
+local search, and checks that search_movies() answers from the catalog
+without a single upstream request. The upstream client refuses every
+connection, so a fallback to TMDB shows up as a counted (failed) call.
+
+Run from the project root:  python -m benchmarks.catalog [movies]
+"""
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+WORDS = (
+    "the a of night day dark star war love last return king queen city lost black white red blue house "
+    "man woman girl boy dead life time world story dream secret shadow fire ice blood moon sun river road "
+    "ghost empire rise fall journey hunter killer island summer winter golden silent wild young old"
+).split()
+
+def make_movies(count: int, rng: random.Random):
+    from models import Movie
+    for i in range(count):
+        title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title() + f" {rng.choice(['', 'II', 'Returns', str(i)])}"
+        yield Movie(
+            id=i, title=title.strip(), release_date=f"{rng.randint(1950, 2025)}-01-01",
+            rating=round(rng.uniform(1, 10), 1), director=f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}",
+            runtime=rng.randint(70, 200), genres=["Drama"],
+        )
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+
+async def run(count: int) -> bool:
+    import httpx
+    import services
+    import upstream
+    from catalog import catalog
+
+    def offline(request):
+        raise httpx.ConnectError("offline", request=request)
+
+    await upstream.start_client(httpx.MockTransport(offline))
+    rng = random.Random(1)
+
+    start = time.perf_counter()
+    movies = list(make_movies(count, rng))
+    catalog.add_many(movies, enriched=True)
+    print(f"seeded {count} movies in {time.perf_counter() - start:.2f}s, {catalog.stats()['words']} words")
+
+    prefixes = []
+    for movie in rng.sample(movies, 2000):
+        text = movie.title.lower()
+        prefixes.append(text[:rng.randint(1, len(text))])
+    samples = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        catalog.suggest(prefix)
+        samples.append((time.perf_counter() - start) * 1e6)
+    p50, p99 = percentiles(samples)
+    print(f"suggest: p50 {p50:.0f} us, p99 {p99:.0f} us")
+    ok = p99 < 1000
+
+    ok_local = True
+    samples = []
+    for movie in rng.sample(movies, 200):
+        with upstream.count_calls() as calls:
+            start = time.perf_counter()
+            result = await services.search_movies(" ".join(movie.title.split()[:2]))
+            elapsed = time.perf_counter() - start
+        if sum(calls.values()) == 0:
+            samples.append(elapsed * 1e6)
+    local = len(samples)
+    p50, p99 = percentiles(samples) if samples else (0, 0)
+    print(f"search_movies: {local}/200 answered locally, p50 {p50:.0f} us, p99 {p99:.0f} us")
+
+    # A search TMDB answered before comes back from the catalog, as long as its movies are there
+    catalog.remember("film", "Some Unseen Title", movies[:3], enriched=True)
+    with upstream.count_calls() as calls:
+        remembered = await services.search_movies("  some unseen TITLE ")
+    ok_local &= [m.id for m in remembered] == [0, 1, 2] and sum(calls.values()) == 0
+
+    # Nothing matches: falls back to TMDB (offline here, and its breaker may be open by now)
+    fallbacks = catalog.fallbacks
+    missing = await services.search_movies("zzzz qqqq")
+    ok_local &= missing == [] and catalog.fallbacks == fallbacks + 1
+    print(f"remembered search served locally, unknown search fell back to TMDB: {ok_local}")
+
+    # Favorites come from the client: they must never change what other users' searches return
+    from models import Movie
+    fake = dict(title="<img src=x onerror=alert(1)>", poster_url="https://evil.example/x.png", runtime=90, genres=["Drama"])
+    await services.add_favorite("nobody", Movie(id=0, **fake))
+    await services.update_favorites("nobody", add=[Movie(id=1, **fake), Movie(id=count + 1, **fake)])
+    untouched = (catalog.movies[0].title == movies[0].title and catalog.movies[1].poster_url == movies[1].poster_url
+                 and count + 1 not in catalog.movies)
+    print(f"favorites left the catalog alone: {untouched}")
+    ok_local &= untouched
+    print(catalog.stats())
+
+    await upstream.close_client()
+    ok &= ok_local and local > 0
+    print("OK" if ok else "FAILED")
+    return ok
+
+def main():
+    os.environ["UPSTREAM_MAX_RETRIES"] = "0"
+    os.environ.pop("CATALOG_DB_FILE", None)
+    os.environ["USERS_DB_FILE"] = os.path.join(tempfile.mkdtemp(), "users.db")
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    raise SystemExit(0 if asyncio.run(run(count)) else 1)
+
+if __name__ == "__main__":
+    main()
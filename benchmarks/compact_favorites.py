@@ -0,0 +1,96 @@
+"""
+Memory use, load time and /api/favorites serialization of a user with 10k
+favorites: pydantic Movie objects (the old representation) against
+FavoriteMovie records.
+
+Run from the project root:  python -m benchmarks.compact_favorites [favorites]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import List
+
+from pydantic import TypeAdapter
+
+import services  # loads GENRE_MAP into the genre codes first
+from models import Favorites, FavoriteStats, Movie, User
+from responses import render
+from storage import USERS_JSON, JsonUserStore, SqliteUserStore
+
+def make_favorites(count: int) -> List[dict]:
+    rng = random.Random(1)
+    genres = list(services.GENRE_MAP)
+    return [
+        {
+            "id": i, "title": f"Movie {i}", "poster_url": f"https://image.tmdb.org/t/p/w342/poster{i}.jpg",
+            "release_date": f"{rng.randint(1920, 2025)}-0{rng.randint(1, 9)}-{rng.randint(10, 28)}",
+            "rating": round(rng.uniform(1, 10), 1), "director": f"Director {rng.randrange(500)}",
+            "runtime": rng.randint(70, 200), "genres": rng.sample(genres, rng.randint(1, 3)),
+            "imdbRating": round(rng.uniform(1, 10), 1),
+        }
+        for i in range(count)
+    ]
+
+def timed(load, rounds: int = 5) -> float:
+    """Best of a few runs, in seconds"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        load()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def allocated(load) -> int:
+    """Bytes still allocated by what load() returns"""
+    tracemalloc.start()
+    result = load()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    favorites = make_favorites(count)
+    stats = FavoriteStats.from_movies([Movie(**f) for f in favorites])
+    user = {"username": "power", "password": "pw", "favorites": favorites, "stats": stats.model_dump()}
+    indented = json.dumps([user], indent=2, ensure_ascii=False).encode()
+    compact = USERS_JSON.dump_json(USERS_JSON.validate_json(indented))
+    movies = TypeAdapter(List[Movie])
+
+    def old_load():
+        # json.load + User(**u) with favorites as pydantic Movies
+        data = json.loads(indented)
+        return [(movies.validate_python(u["favorites"]), FavoriteStats(**u["stats"])) for u in data]
+
+    print(f"{count} favorites, users.json {len(indented) / 1e6:.1f} MB with indent=2, {len(compact) / 1e6:.1f} MB compact")
+    for name, load in (
+        ("Movie objects (json.load)", old_load),
+        ("FavoriteMovie (validate_json)", lambda: USERS_JSON.validate_json(compact)),
+    ):
+        size = allocated(load)
+        print(f"{name:30} load {timed(load) * 1000:6.1f} ms, memory {size / 1e6:5.2f} MB ({size / count:.0f} bytes/favorite)")
+
+    directory = tempfile.mkdtemp()
+    json_store = JsonUserStore(os.path.join(directory, "users.json"))
+    sqlite_store = SqliteUserStore(os.path.join(directory, "users.db"))
+    stored = User.model_validate(user)
+    json_store.save_users([stored])
+    sqlite_store.add_user(stored)
+    for name, store in (("JsonUserStore.get_user", json_store), ("SqliteUserStore.get_user", sqlite_store)):
+        print(f"{name:30} load {timed(lambda: store.get_user('power')) * 1000:6.1f} ms")
+    sqlite_store.close()
+
+    # What /api/favorites serializes: before, the Movie list; now the records themselves
+    old_movies = movies.validate_python(favorites)
+    print(f"serialize, Movie objects:      {timed(lambda: render({'favorites': old_movies})) * 1000:6.1f} ms")
+    body = Favorites.model_construct(favorites=stored.favorites)
+    print(f"serialize, FavoriteMovie:      {timed(lambda: render(body)) * 1000:6.1f} ms")
+    assert render(body) == render({"favorites": old_movies})
+
+if __name__ == "__main__":
+    main()
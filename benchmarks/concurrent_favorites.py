@@ -0,0 +1,154 @@
+"""
+Stress check for concurrent favorite writes: no update may be lost.
+
+Part 1 fires hundreds of concurrent add/remove requests at main:app.
+Part 2 has several processes write to the same store at once.
+Part 3 commits a write while another storage thread is loading the same
+user, which must not leave the identity map with the copy from before it.
+
+Run from the project root:  python -m benchmarks.concurrent_favorites [sqlite|json]
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+
+from benchmarks import use_mock_upstream
+
+USERS = 5
+MOVIES_PER_USER = 100
+PROCESSES = 4
+
+async def stress_app():
+    import httpx
+    import main
+    from models import Movie
+    from services import add_favorite, favorite_writer, get_user
+
+    async with main.app.router.lifespan_context(main.app):
+        clients = []
+        for i in range(USERS):
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+            await client.post("/api/register", data={"username": f"stress{i}", "password": "pw"})
+            clients.append(client)
+
+        async def add(client, movie_id):
+            r = await client.post("/api/favorites", data={"id": movie_id, "title": f"Movie {movie_id}"})
+            r.raise_for_status()
+
+        async def remove(client, movie_id):
+            (await client.delete(f"/api/favorites/{movie_id}")).raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(add(c, m) for c in clients for m in range(MOVIES_PER_USER)))
+        # Remove every odd movie while adding a second batch
+        await asyncio.gather(
+            *(remove(c, m) for c in clients for m in range(1, MOVIES_PER_USER, 2)),
+            *(add(c, m) for c in clients for m in range(MOVIES_PER_USER, 2 * MOVIES_PER_USER)),
+        )
+        elapsed = time.perf_counter() - start
+
+        expected = set(range(0, MOVIES_PER_USER, 2)) | set(range(MOVIES_PER_USER, 2 * MOVIES_PER_USER))
+        requests = USERS * (MOVIES_PER_USER * 2 + MOVIES_PER_USER // 2)
+        lost = 0
+        for i, client in enumerate(clients):
+            ids = {m.id for m in (await get_user(f"stress{i}")).favorites}
+            lost += len(expected ^ ids)
+            await client.aclose()
+        print(f"app: {requests} concurrent requests in {elapsed:.2f}s, {lost} lost/extra updates")
+
+        # A request cancelled during the write (client gone) must not leave the rest of its batch waiting
+        movie_id = 2 * MOVIES_PER_USER
+        running = asyncio.create_task(add_favorite("stress0", Movie(id=movie_id, title="Running")))
+        await asyncio.sleep(0)
+        # These two queue behind the running write and go into the next one together
+        first = asyncio.create_task(add_favorite("stress1", Movie(id=movie_id, title="Cancelled")))
+        second = asyncio.create_task(add_favorite("stress2", Movie(id=movie_id, title="Waiting")))
+        await asyncio.sleep(0)
+        await running
+        while favorite_writer._pending:
+            await asyncio.sleep(0)
+        first.cancel()
+        try:
+            added = await asyncio.wait_for(second, 2)
+        except asyncio.TimeoutError:
+            added = False
+        print(f"cancelled request in a batch: the other one {'finished' if added else 'HUNG'}")
+        return lost == 0 and added
+
+def process_worker(worker: int):
+    from models import Movie
+    from services import get_store
+    store = get_store()
+    for m in range(MOVIES_PER_USER):
+        store.apply_changes([("add", "shared", Movie(id=worker * 1000 + m, title="x"))])
+
+def stress_processes():
+    from models import User
+    from services import get_store
+    store = get_store()
+    store.add_user(User(username="shared", password="pw"))
+
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=process_worker, args=(w,)) for w in range(PROCESSES)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    count = len(store.get_user("shared").favorites)
+    expected = PROCESSES * MOVIES_PER_USER
+    print(f"processes: {PROCESSES} writers, {count}/{expected} favorites stored")
+    return count == expected
+
+def stale_load():
+    import threading
+    from models import Movie, User
+    from services import get_store
+    store = get_store()
+    from storage import CachedUserStore, TimedUserStore
+
+    loaded, written = threading.Event(), threading.Event()
+
+    class SlowLoads(TimedUserStore):
+        """Holds a loaded user back until the write is done"""
+        def get_user(self, username):
+            user = super().get_user(username)
+            if username == "race":
+                loaded.set()
+                written.wait(5)
+            return user
+
+    cached = CachedUserStore(SlowLoads(store.backend, "bench"))
+    cached.add_user(User(username="race", password="pw"))
+    cached.invalidate()
+    reader = threading.Thread(target=cached.get_user, args=("race",))
+    reader.start()
+    loaded.wait(5)
+    cached.apply_changes([("add", "race", Movie(id=1, title="Movie 1"))])
+    written.set()
+    reader.join()
+
+    user = cached.get_user("race")
+    again = cached.apply_changes([("add", "race", Movie(id=1, title="Movie 1"))])[0]
+    ok = ([m.id for m in user.favorites] == [1] and not again
+          and cached.favorites_version("race") == store.backend.favorites_version("race"))
+    print(f"write during a load: cached favorites {[m.id for m in user.favorites]}, "
+          f"version {user.stats.version}, {'current' if ok else 'STALE'}")
+    return ok
+
+def main():
+    backend = sys.argv[1] if len(sys.argv) > 1 else "sqlite"
+    # The storage settings are read on import, so set them before importing the app
+    tmp = use_mock_upstream(STORAGE_BACKEND=backend, GENRE_POOL_REFRESH="0")
+    os.chdir(tmp)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.symlink(os.path.join(sys.path[0], "static"), os.path.join(tmp, "static"))
+
+    ok = asyncio.run(stress_app()) and stress_processes() and stale_load()
+    print("OK" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Upstream requests and latency of a director search against the mock server.
+
+The mock credits make every third movie match, so the search has to look
+at a second discover page to find 10 hits. Also streams the same search
+(/api/search/stream), full and summary, from a cold cache: the first movie
+has to arrive well before the whole list would, and the streamed movies
+have to match the list.
+
+Run from the project root:  python -m benchmarks.director_search
+"""
+import asyncio
+import time
+
+from benchmarks import use_mock_upstream
+
+use_mock_upstream()
+
+import services
+import upstream
+from cache import movie_cache
+from catalog import catalog
+
+async def streamed(summary: bool) -> tuple:
+    """(seconds to the first movie, seconds to the end, streamed movies with their patches applied)"""
+    start = time.perf_counter()
+    first, movies = None, {}
+    async for event in services.stream_search_movies("Director 1", "director", summary):
+        if event["event"] == "movie":
+            first = first or time.perf_counter() - start
+            movies[event["movie"]["id"]] = event["movie"]
+        elif event["event"] == "patch":
+            movies[event["id"]].update(event["changes"])
+    return first, time.perf_counter() - start, list(movies.values())
+
+async def main():
+    await upstream.start_client()
+    for up in upstream.UPSTREAMS.values():
+        up.limiter.rate = 0
+
+    for label in ("cold cache", "warm cache"):
+        start = time.perf_counter()
+        with upstream.count_calls() as calls:
+            movies = await services.search_movies_by_director_async("Director 1")
+        print(f"{label}: {len(movies)} movies, {sum(calls.values())} upstream calls {calls}, "
+              f"{time.perf_counter() - start:.2f}s")
+    # Before: person + discover + 20 x (details, credits, OMDb), one page only
+    print("previous version: 62 upstream calls for at most 20 candidates")
+
+    ok = True
+    for summary in (False, True):
+        search = services.search_movies_summary if summary else services.search_movies
+        movie_cache.clear()
+        catalog.clear()
+        start = time.perf_counter()
+        listed = [m.model_dump() for m in await search("Director 1", "director")]
+        whole = time.perf_counter() - start
+        movie_cache.clear()
+        catalog.clear()
+        first, total, movies = await streamed(summary)
+        same = movies == listed
+        print(f"streamed {'summary' if summary else 'full'}: first movie after {first:.2f}s, "
+              f"{len(movies)} movies in {total:.2f}s (list: {whole:.2f}s), same as the list: {same}")
+        ok &= same and first < whole / 2
+
+    movie_cache.clear()
+    catalog.clear()
+    await upstream.close_client()
+    print("OK" if ok else "FAILED")
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+"""
+Compare sequential and concurrent movie enrichment against the mock server.
+
+Run from the project root:  python -m benchmarks.enrichment
+"""
+import asyncio
+import time
+
+from benchmarks import mock_transport, use_mock_upstream
+
+use_mock_upstream()
+
+import httpx
+
+import services
+import upstream
+from cache import movie_cache
+from benchmarks import mock_upstream
+
+async def run(limit: int, count: int) -> float:
+    items = [mock_upstream.fake_movie(i) for i in range(1, count + 1)]
+    movie_cache.clear()  # measure cold lookups
+    async with httpx.AsyncClient(transport=mock_transport()) as client:
+        start = time.perf_counter()
+        await services.enrich_movies(client, items, limit=limit)
+        return time.perf_counter() - start
+
+async def main():
+    # Measure the fan-out itself, not the client-side rate limit
+    for up in upstream.UPSTREAMS.values():
+        up.limiter.rate = 0
+
+    for count in (10, 20):
+        sequential = await run(1, count)
+        concurrent = await run(services.MAX_CONCURRENT_REQUESTS, count)
+        print(f"{count} movies: sequential {sequential:.2f}s, "
+              f"concurrent (limit {services.MAX_CONCURRENT_REQUESTS}) {concurrent:.2f}s, "
+              f"{sequential / concurrent:.1f}x faster")
+
+if __name__ == "__main__":
+    asyncio.run(main())
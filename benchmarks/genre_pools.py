@@ -0,0 +1,79 @@
+"""
+Check that /api/duel and /api/surprise never wait on TMDB once the genre
+pools are loaded, and that loading the pools doesn't ask OMDb.
+
+Loads the pools from the mock TMDB/OMDb (benchmarks.mock_upstream), then
+makes the mock answer only after STALL seconds and lets every pool go
+stale. Requests must still be answered from memory while the background
+refreshes wait on the mock.
+
+Run from the project root:  python -m benchmarks.genre_pools
+"""
+import asyncio
+import time
+
+from benchmarks import use_mock_upstream
+
+STALL = 5.0
+REQUESTS = 100
+# A request that waited on the mock would take at least STALL
+MAX_MS = 250
+
+async def run() -> bool:
+    import httpx
+    import main
+    from benchmarks import mock_upstream
+    from pools import genre_pools
+
+    mock_upstream.LATENCY = 0.0
+
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            start = time.perf_counter()
+            while (await client.get("/api/ready")).status_code != 200:
+                await asyncio.sleep(0.05)
+            loaded = time.perf_counter() - start
+            omdb_calls = mock_upstream.CALLS["/"]
+            print(f"{len(genre_pools.stats())} pools loaded in {loaded:.1f}s, "
+                  f"{sum(mock_upstream.CALLS.values())} upstream requests, {omdb_calls} to OMDb")
+
+            await client.post("/api/register", data={"username": "pools", "password": "pw"})
+            for movie_id in range(1, 6):
+                await client.post("/api/favorites", data={
+                    "id": 10_000 + movie_id, "title": f"Favorite {movie_id}", "runtime": 100,
+                    "rating": 7, "genres": "Drama", "release_date": "1999-01-01",
+                })
+
+            # Every pool is stale now and TMDB hangs: requests must still be served from memory
+            mock_upstream.LATENCY = STALL
+            mock_upstream.CALLS.clear()
+            genre_pools.refresh_interval = 0.001
+            await asyncio.sleep(0.01)
+            timings = []
+            for i in range(REQUESTS):
+                path = "/api/duel" if i % 2 else "/api/surprise"
+                t = time.perf_counter()
+                r = await client.get(path)
+                timings.append((time.perf_counter() - t) * 1000)
+                if r.status_code != 200 or r.json().get("status") != "ok":
+                    print(f"{path}: {r.status_code} {r.text[:100]}")
+                    timings[-1] = float("inf")
+                # In-process requests never wait themselves, give the background refreshes their turn
+                await asyncio.sleep(0.005)
+            refreshing = sum(mock_upstream.CALLS.values())
+            timings.sort()
+            print(f"stale pools, upstream stalled {STALL:.0f}s: {REQUESTS} duel/surprise requests, "
+                  f"p50 {timings[len(timings) // 2]:.1f} ms, max {timings[-1]:.1f} ms, "
+                  f"{refreshing} refresh requests sent in the background")
+
+    ok = omdb_calls == 0 and timings[-1] < MAX_MS and refreshing > 0
+    print("OK" if ok else "FAILED")
+    return ok
+
+def main():
+    # The warm-up loads the pools as soon as the lifespan starts (and nothing else)
+    use_mock_upstream(WARMUP_PREFETCH=None, GENRE_POOL_PAGES="1", WARMUP_POPULAR_PAGES="0")
+    raise SystemExit(0 if asyncio.run(run()) else 1)
+
+if __name__ == "__main__":
+    main()
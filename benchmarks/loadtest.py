@@ -0,0 +1,310 @@
+"""
+Load test: virtual users running scripted scenarios against main:app.
+
+Every virtual user registers (logs in), saves a few movies and then loops
+through the weighted steps of its scenario (search, favorite, wrapped,
+duel, ...) until the run is over. TMDB and OMDb are served by
+benchmarks.mock_upstream with the given latency and error rates, so runs
+are repeatable and need no API key. Like a browser, users send
+If-None-Match for responses they already have.
+
+Latency is reported per step (p50/p95/p99) with overall throughput. A run
+can be saved as JSON and compared with an earlier one, e.g. from the
+previous commit; --compare exits with 1 when a step's p95 got more than
+--threshold slower or it fails more often.
+
+By default the app and the mock run in this process over ASGI transports.
+With --url the requests go to a running server instead, started like:
+    MOCK_LATENCY=0.05 python -m benchmarks.mock_upstream 9000
+    TMDB_BASE_URL=http://127.0.0.1:9000 OMDB_URL=http://127.0.0.1:9000/ uvicorn main:app
+
+Run from the project root:
+    python -m benchmarks.loadtest --users 50 --duration 20 --save before.json
+    python -m benchmarks.loadtest --users 50 --duration 20 --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks import use_mock_upstream
+
+# Relative weights of the steps every virtual user loops through
+SCENARIOS = {
+    # Mostly searching, now and then a movie gets saved
+    "browse": {"search": 6, "suggest": 4, "details": 2, "favorite": 1, "favorites": 1},
+    # Coming back to look at the list and the Wrapped page
+    "wrapped": {"favorites": 3, "wrapped": 3, "favorite": 1},
+    "duel": {"duel": 3, "surprise": 1, "favorite": 1},
+    "mixed": {"search": 4, "suggest": 3, "details": 1, "favorite": 2, "favorites": 2,
+              "wrapped": 2, "duel": 1, "surprise": 1},
+}
+QUERIES = [
+    "matrix", "star wars", "godfather", "alien", "the dark knight", "inception", "heat", "jaws",
+    "casablanca", "vertigo", "amelie", "parasite", "fargo", "se7en", "the thing", "blade runner",
+    "rocky", "titanic", "memento", "psycho", "toy story", "up", "her", "drive",
+]
+# Favorites every user starts with, so wrapped and duel have something to work with
+START_FAVORITES = 5
+# p95 changes smaller than this are noise, not regressions
+NOISE_MS = 1.0
+# A step whose share of errors went up by more than this fails the comparison
+ERROR_SHARE = 0.01
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, name: str, rng: random.Random):
+        self.client = client
+        self.name = name
+        self.rng = rng
+        self.seen: List[dict] = []  # movies from the last searches
+        self.etags: Dict[str, str] = {}
+
+    async def revalidate(self, path: str) -> httpx.Response:
+        """GET with the ETag of the last response, like a browser"""
+        headers = {"If-None-Match": self.etags[path]} if path in self.etags else {}
+        response = await self.client.get(path, headers=headers)
+        if "etag" in response.headers:
+            self.etags[path] = response.headers["etag"]
+        return response
+
+    def some_movie(self) -> dict:
+        if self.seen:
+            return self.rng.choice(self.seen)
+        movie_id = self.rng.randint(1, 20)
+        return {"id": movie_id, "title": f"Movie {movie_id}", "rating": 7.0, "runtime": 100,
+                "genres": ["Drama"], "release_date": f"{1970 + movie_id}-01-01"}
+
+async def register(user: VirtualUser) -> httpx.Response:
+    return await user.client.post("/api/register", data={"username": user.name, "password": "load"})
+
+async def login(user: VirtualUser) -> httpx.Response:
+    return await user.client.post("/api/login", data={"username": user.name, "password": "load"})
+
+async def search(user: VirtualUser) -> httpx.Response:
+    response = await user.client.get("/api/search", params={"q": user.rng.choice(QUERIES)})
+    if response.status_code == 200:
+        user.seen = (response.json()["movies"] + user.seen)[:50]
+    return response
+
+async def suggest(user: VirtualUser) -> httpx.Response:
+    query = user.rng.choice(QUERIES)
+    return await user.client.get("/api/search/suggest", params={"q": query[:user.rng.randint(1, len(query))]})
+
+async def details(user: VirtualUser) -> httpx.Response:
+    return await user.client.get(f"/api/movies/{user.some_movie()['id']}")
+
+async def favorite(user: VirtualUser) -> httpx.Response:
+    movie = user.some_movie()
+    form = {key: movie.get(key) for key in ("id", "title", "poster_url", "release_date", "rating", "director", "runtime")}
+    form["genres"] = ",".join(movie.get("genres") or [])
+    return await user.client.post("/api/favorites", data={k: v for k, v in form.items() if v is not None})
+
+async def favorites(user: VirtualUser) -> httpx.Response:
+    return await user.revalidate("/api/favorites")
+
+async def wrapped(user: VirtualUser) -> httpx.Response:
+    return await user.revalidate("/api/wrapped")
+
+async def duel(user: VirtualUser) -> httpx.Response:
+    return await user.client.get("/api/duel")
+
+async def surprise(user: VirtualUser) -> httpx.Response:
+    return await user.client.get("/api/surprise")
+
+STEPS = {fn.__name__: fn for fn in (search, suggest, details, favorite, favorites, wrapped, duel, surprise)}
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors = Counter()
+
+    async def timed(self, name: str, step, user: VirtualUser):
+        start = time.perf_counter()
+        try:
+            response = await step(user)
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            failed = True
+        self.samples[name].append(time.perf_counter() - start)
+        if failed:
+            self.errors[name] += 1
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of a sorted list"""
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    steps = {}
+    for name, samples in sorted(recorder.samples.items()):
+        ordered = sorted(samples)
+        steps[name] = {
+            "count": len(ordered),
+            "errors": recorder.errors[name],
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3),
+            **{f"p{q}": round(percentile(ordered, q) * 1000, 3) for q in (50, 95, 99)},
+            "max": round(ordered[-1] * 1000, 3),
+        }
+    total = sum(step["count"] for step in steps.values())
+    return {
+        "elapsed": round(elapsed, 3),
+        "requests": total,
+        "errors": sum(recorder.errors.values()),
+        "throughput": round(total / elapsed, 1) if elapsed else 0.0,
+        "steps": steps,
+    }
+
+async def virtual_user(index: int, client: httpx.AsyncClient, args, recorder: Recorder, deadline: float):
+    rng = random.Random(args.seed * 100_003 + index)
+    user = VirtualUser(client, f"load-{args.seed}-{index}-{int(time.time())}", rng)
+    await asyncio.sleep(args.ramp * index / max(args.users, 1))
+    await recorder.timed("register", register, user)
+    await recorder.timed("login", login, user)
+    await recorder.timed("search", search, user)
+    for _ in range(START_FAVORITES):
+        await recorder.timed("favorite", favorite, user)
+
+    names = list(SCENARIOS[args.scenario])
+    weights = list(SCENARIOS[args.scenario].values())
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        await recorder.timed(name, STEPS[name], user)
+        if args.think:
+            await asyncio.sleep(rng.uniform(0, 2 * args.think))
+
+async def run(args) -> dict:
+    recorder = Recorder()
+    upstream_calls = None
+    if args.url:
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=args.users))
+        base_url = args.url
+        app = None
+    else:
+        import main
+        from benchmarks import mock_upstream
+        mock_upstream.LATENCY = args.latency
+        mock_upstream.LATENCY_JITTER = args.jitter
+        mock_upstream.ERROR_RATE = args.error_rate
+        mock_upstream.RATE_LIMIT_RATE = args.rate_limit_rate
+        transport = httpx.ASGITransport(app=main.app)
+        base_url = "http://test"
+        app = main.app
+
+    async def load():
+        deadline = time.perf_counter() + args.ramp + args.duration
+        clients = [httpx.AsyncClient(transport=transport, base_url=base_url, timeout=60) for _ in range(args.users)]
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(virtual_user(i, client, args, recorder, deadline) for i, client in enumerate(clients)))
+        finally:
+            for client in clients:
+                await client.aclose()
+        return time.perf_counter() - start
+
+    if app is None:
+        elapsed = await load()
+    else:
+        async with app.router.lifespan_context(app):
+            mock_upstream.CALLS.clear()
+            elapsed = await load()
+            upstream_calls = dict(mock_upstream.CALLS)
+
+    return {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {key: getattr(args, key) for key in (
+            "scenario", "users", "duration", "ramp", "think", "seed", "url",
+            "latency", "jitter", "error_rate", "rate_limit_rate")},
+        **summarize(recorder, elapsed),
+        "upstream_calls": upstream_calls,
+    }
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True)
+    return out.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "") if out.returncode == 0 else None
+
+def print_report(result: dict):
+    config = result["config"]
+    print(f"scenario {config['scenario']}, {config['users']} users, {result['elapsed']:.1f}s, "
+          f"upstream latency {config['latency'] * 1000:.0f} ms, commit {result['commit']}")
+    print(f"{'step':10} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, step in result["steps"].items():
+        print(f"{name:10} {step['count']:7} {step['errors']:7} {step['p50']:9.1f} {step['p95']:9.1f} "
+              f"{step['p99']:9.1f} {step['max']:9.1f}")
+    print(f"{result['requests']} requests, {result['errors']} errors, {result['throughput']:.1f} requests/s")
+    if result["upstream_calls"] is not None:
+        print(f"upstream calls: {sum(result['upstream_calls'].values())} {result['upstream_calls']}")
+
+def compare(old: dict, new: dict, threshold: float) -> bool:
+    """Print old -> new per step, False if a step's p95 regressed by more than threshold"""
+    def change(a, b):
+        return f"{(b - a) / a * 100:+.0f}%" if a else "n/a"
+
+    print(f"\ncompared with {old['commit']} ({old['date']})")
+    print(f"{'step':10} {'p50 ms':>21} {'p95 ms':>21} {'p99 ms':>21}")
+    ok = True
+    for name in sorted(set(old["steps"]) & set(new["steps"])):
+        a, b = old["steps"][name], new["steps"][name]
+        cells = [f"{a[p]:7.1f} -> {b[p]:7.1f} {change(a[p], b[p]):>5}" for p in ("p50", "p95", "p99")]
+        regressed = b["p95"] > a["p95"] * (1 + threshold) and b["p95"] - a["p95"] > NOISE_MS
+        # Failing fast is not getting faster
+        more_errors = b["errors"] / b["count"] > a["errors"] / a["count"] + ERROR_SHARE
+        ok &= not (regressed or more_errors)
+        flags = ("  REGRESSION" if regressed else "") + ("  MORE ERRORS" if more_errors else "")
+        print(f"{name:10} {'  '.join(cells)}{flags}")
+    print(f"throughput {old['throughput']:.1f} -> {new['throughput']:.1f} requests/s "
+          f"({change(old['throughput'], new['throughput'])})")
+    changed = {key: (old["config"].get(key), value) for key, value in new["config"].items() if old["config"].get(key) != value}
+    if changed:
+        print(f"note: runs used different settings (old, new): {changed}")
+    return ok
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load after ramp-up")
+    parser.add_argument("--ramp", type=float, default=1, help="seconds over which the users start")
+    parser.add_argument("--think", type=float, default=0, help="mean seconds between a user's steps")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock upstream latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="extra random mock latency, up to this")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of mock requests failing with 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of mock requests getting 429")
+    parser.add_argument("--url", help="load a running server instead of main:app in this process")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed p95 slowdown with --compare")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.url:
+        # A throwaway user store, cold caches like earlier runs and the app talking to the mock
+        use_mock_upstream()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    ok = True
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            ok = compare(json.load(f), result, args.threshold)
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,190 @@
+"""
+Event loop lag while favorites are written under load.
+
+Writers post bulk favorite changes while readers load their favorites
+and log in. Meanwhile a ticker task sleeps 1 ms at a time and records
+how late it wakes up, and every call into the storage backend made on
+the event loop thread is timed. That is done twice:
+  - before: the store called like it used to be, reads and sign-ups
+    right on the event loop (favorite writes already went to to_thread)
+  - async:  AsyncUserStore, everything that may touch the disk or wait
+    for a write runs on the storage threads
+Fails if the async run calls the backend on the loop for anything but
+peek_version (never waits, see storage.py). Loop lag is also shaped by
+the CPU the storage threads use, so it is reported but not checked.
+Automatic garbage collection is off while measuring: its pauses are
+the same with either store and would hide what the store does.
+
+Run from the project root:  python -m benchmarks.loop_lag [sqlite|json] [seconds]
+"""
+import asyncio
+import gc
+import importlib
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from benchmarks import use_mock_upstream
+
+TICK = 0.001
+WRITERS = 4
+READERS = 8
+MOVIES_PER_WRITE = 100
+# Pause of every client between its requests. The clients run on the same
+# loop as the app, without a pause the lag would mostly be their own work
+THINK_TIME = 0.005
+# Backend calls the event loop may make itself
+NON_BLOCKING = {"peek_version"}
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+class LoopWatch:
+    """Stands in for the CachedUserStore's backend and times the calls made on the event loop thread"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.calls = Counter()
+        self.seconds = 0.0
+        self.longest = 0.0
+
+    def __getattr__(self, name):
+        attr = getattr(self.backend, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            if threading.current_thread() is not threading.main_thread():
+                return attr(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.calls[name] += 1
+                self.seconds += elapsed
+                self.longest = max(self.longest, elapsed)
+        return call
+
+async def run(duration: float, mode: str) -> dict:
+    import httpx
+    import main
+    import services
+
+    store = services.get_async_store()
+    store.store.save_users([])  # same start for both runs, users.json is rewritten whole on every change
+    if mode == "before":
+        async def run_on_loop(fn, *args):
+            if fn == store.store.apply_changes:
+                return await asyncio.to_thread(fn, *args)
+            return fn(*args)
+        store.run = run_on_loop
+        store.store.cached_user = lambda username: None
+    else:
+        store.run = type(store).run.__get__(store)
+        store.store.cached_user = type(store.store).cached_user.__get__(store.store)
+    backend = store.store.backend
+    watch = store.store.backend = LoopWatch(backend)
+
+    lags = []
+    stop = asyncio.Event()
+    counts = {"writes": 0, "reads": 0, "logins": 0, "errors": 0}
+
+    async def ticker():
+        while not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - start - TICK)
+
+    async def writer(client, i):
+        movie_id = 0
+        while not stop.is_set():
+            add = [{"id": movie_id + m, "title": f"Movie {movie_id + m}", "runtime": 100, "rating": 7,
+                    "genres": ["Drama"], "release_date": "1999-01-01"} for m in range(MOVIES_PER_WRITE)]
+            remove = list(range(movie_id - MOVIES_PER_WRITE, movie_id, 2)) if movie_id else []
+            r = await client.post("/api/favorites/bulk", json={"add": add, "remove": remove})
+            counts["writes" if r.status_code == 200 else "errors"] += 1
+            movie_id += MOVIES_PER_WRITE
+            await asyncio.sleep(THINK_TIME)
+
+    async def reader(client, i):
+        n = 0
+        while not stop.is_set():
+            n += 1
+            if n % 10 == 0:
+                r = await client.post("/api/login", data={"username": f"{mode}-reader{i}", "password": "pw"})
+                counts["logins"] += 1
+            else:
+                r = await client.get("/api/favorites")
+                counts["reads"] += 1
+            if r.status_code != 200:
+                counts["errors"] += 1
+            await asyncio.sleep(THINK_TIME)
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        clients = []
+        for i in range(WRITERS + READERS):
+            name = f"{mode}-{'writer' if i < WRITERS else 'reader'}{i if i < WRITERS else i - WRITERS}"
+            client = httpx.AsyncClient(transport=transport, base_url="http://test")
+            (await client.post("/api/register", data={"username": name, "password": "pw"})).raise_for_status()
+            clients.append(client)
+
+        tasks = [asyncio.create_task(ticker())]
+        tasks += [asyncio.create_task(writer(c, i)) for i, c in enumerate(clients[:WRITERS])]
+        tasks += [asyncio.create_task(reader(c, i)) for i, c in enumerate(clients[WRITERS:])]
+        await asyncio.sleep(duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+        for client in clients:
+            await client.aclose()
+    store.store.backend = backend
+
+    lags_ms = [lag * 1000 for lag in lags]
+    return {
+        **counts,
+        "p50": percentile(lags_ms, 0.5),
+        "p99": percentile(lags_ms, 0.99),
+        "max": max(lags_ms, default=0.0),
+        "loop_calls": watch.calls,
+        "loop_ms": watch.seconds * 1000,
+        "longest_ms": watch.longest * 1000,
+    }
+
+async def run_both(duration: float) -> dict:
+    # One loop for both, the app's asyncio locks belong to the loop they were first used on
+    results = {}
+    for mode in ("before", "async"):
+        gc.collect()
+        gc.disable()
+        try:
+            results[mode] = await run(duration, mode)
+        finally:
+            gc.enable()
+    return results
+
+def main():
+    backend = sys.argv[1] if len(sys.argv) > 1 else "sqlite"
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    directory = use_mock_upstream(STORAGE_BACKEND=backend, GENRE_POOL_REFRESH="0", METRICS_ENABLED="0")
+    # Import the app while still in the project root (static/ and templates/ are relative)
+    importlib.import_module("main")
+    os.chdir(directory)  # users.json is relative, keep it out of the project
+
+    print(f"backend: {backend}, {WRITERS} writers ({MOVIES_PER_WRITE} movies per write), {READERS} readers, {duration:.0f}s each")
+    results = asyncio.run(run_both(duration))
+    for mode, r in results.items():
+        print(f"{mode:7} loop lag p50 {r['p50']:6.2f} ms  p99 {r['p99']:6.2f} ms  max {r['max']:7.2f} ms  "
+              f"({r['writes']} writes, {r['reads']} reads, {r['logins']} logins, {r['errors']} errors)")
+        calls = ", ".join(f"{name} {count}" for name, count in r["loop_calls"].most_common()) or "none"
+        print(f"        backend calls on the loop: {calls}; {r['loop_ms']:.1f} ms in total, longest {r['longest_ms']:.2f} ms")
+    blocking = set(results["async"]["loop_calls"]) - NON_BLOCKING
+    ok = not blocking and results["async"]["errors"] == 0
+    print("OK" if ok else "FAILED")
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
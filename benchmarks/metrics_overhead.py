@@ -0,0 +1,87 @@
+"""
+Overhead of the metrics: the same requests with the metrics middleware and
+every counter/histogram turned on and off. Every request is sent twice in a
+row, once each way (in alternating order), so a noisy neighbour slows both
+of a pair. The overhead is the mean difference of the pairs over the mean
+time with metrics off; pairs where a request took over SPIKE times the
+median (a scheduler or GC pause) are left out. Requests hit cheap endpoints
+(cached search, suggest, favorites, wrapped, duel), where the overhead
+shows the most.
+
+Run from the project root:  python -m benchmarks.metrics_overhead [rounds]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from benchmarks import use_mock_upstream
+
+PATHS = ["/api/search?q=Movie", "/api/search/suggest?q=mov", "/api/favorites", "/api/wrapped", "/api/duel"]
+BLOCK = 10  # requests per path per round
+SPIKE = 3
+
+async def run(rounds: int) -> bool:
+    import httpx
+    import main
+    import metrics
+    from benchmarks import mock_upstream
+
+    mock_upstream.LATENCY = 0
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            await client.post("/api/register", data={"username": "metrics", "password": "pw"})
+            for movie_id in range(30):
+                await client.post("/api/favorites", data={
+                    "id": movie_id, "title": f"Movie {movie_id}", "runtime": 100,
+                    "rating": 7, "genres": "Drama", "release_date": "1999-01-01",
+                })
+            for path in PATHS:
+                await client.get(path)  # warm caches and the genre pool
+
+            # ServerErrorMiddleware -> MetricsMiddleware -> the rest
+            outer = main.app.middleware_stack
+            instrumented = outer.app
+            assert isinstance(instrumented, metrics.MetricsMiddleware)
+
+            def switch(on: bool):
+                metrics.METRICS_ENABLED = on
+                outer.app = instrumented if on else instrumented.app
+
+            async def timed(path: str, on: bool) -> float:
+                switch(on)
+                start = time.perf_counter()
+                await client.get(path)
+                return time.perf_counter() - start
+
+            pairs = []  # (on, off) seconds
+            for i in range(rounds * BLOCK):
+                for j, path in enumerate(PATHS):
+                    if (i + j) % 2:
+                        on = await timed(path, True)
+                        off = await timed(path, False)
+                    else:
+                        off = await timed(path, False)
+                        on = await timed(path, True)
+                    pairs.append((on, off))
+            switch(True)
+
+    limit = SPIKE * statistics.median(t for pair in pairs for t in pair)
+    kept = [(on, off) for on, off in pairs if on < limit and off < limit]
+    on = statistics.fmean(p[0] for p in kept)
+    off = statistics.fmean(p[1] for p in kept)
+    overhead = (on / off - 1) * 100
+    print(f"{rounds} rounds of {BLOCK * len(PATHS)} request pairs, {len(pairs) - len(kept)} pairs with a pause left out")
+    print(f"metrics off: {off * 1e6:7.1f} us/request")
+    print(f"metrics on:  {on * 1e6:7.1f} us/request ({overhead:+.1f}%)")
+    ok = overhead < 2
+    print("OK" if ok else "FAILED")
+    return ok
+
+def main():
+    use_mock_upstream(TRACE_SAMPLE_RATE="0")
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    raise SystemExit(0 if asyncio.run(run(rounds)) else 1)
+
+if __name__ == "__main__":
+    main()
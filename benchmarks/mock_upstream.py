@@ -0,0 +1,105 @@
+"""
+Local stand-in for the TMDB and OMDb APIs, used by the benchmarks.
+
+Every endpoint sleeps for LATENCY seconds (plus up to LATENCY_JITTER more)
+before answering so the numbers look like a real network round-trip. Point
+the app at it with BASE_URL = "http://tmdb.mock" (OMDb is served on "/").
+
+RATE_LIMIT_RATE and ERROR_RATE make that share of requests fail with
+429 (with a Retry-After of RETRY_AFTER seconds) or 503.
+
+The defaults can be set with MOCK_* env variables. To run it as a server
+for a load test against a real app process:
+    python -m benchmarks.mock_upstream [port]
+"""
+import asyncio
+import os
+import random
+import re
+import sys
+from collections import Counter
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY = float(os.getenv("MOCK_LATENCY", "0.05"))
+LATENCY_JITTER = float(os.getenv("MOCK_LATENCY_JITTER", "0"))
+RATE_LIMIT_RATE = float(os.getenv("MOCK_RATE_LIMIT_RATE", "0"))
+ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))
+RETRY_AFTER = float(os.getenv("MOCK_RETRY_AFTER", "0.1"))
+
+# Requests served per endpoint ("/movie/{id}", ...), faults included
+CALLS = Counter()
+
+app = FastAPI()
+
+async def delay():
+    await asyncio.sleep(LATENCY + random.uniform(0, LATENCY_JITTER))
+
+@app.middleware("http")
+async def inject_faults(request: Request, call_next):
+    CALLS[re.sub(r"/\d+", "/{id}", request.url.path)] += 1
+    roll = random.random()
+    if roll < RATE_LIMIT_RATE:
+        await delay()
+        return JSONResponse({"status_message": "Too many requests"}, status_code=429,
+                            headers={"Retry-After": str(RETRY_AFTER)})
+    if roll < RATE_LIMIT_RATE + ERROR_RATE:
+        await delay()
+        return JSONResponse({"status_message": "Unavailable"}, status_code=503)
+    return await call_next(request)
+
+def fake_movie(movie_id: int) -> dict:
+    return {
+        "id": movie_id,
+        "title": f"Movie {movie_id}",
+        "release_date": f"{1970 + movie_id % 50}-01-01",
+        "vote_average": 5 + movie_id % 5,
+        "poster_path": f"/poster{movie_id}.jpg",
+    }
+
+@app.get("/search/movie")
+async def search_movie(query: str = ""):
+    await delay()
+    return {"results": [fake_movie(i) for i in range(1, 21)]}
+
+@app.get("/search/person")
+async def search_person(query: str = ""):
+    await delay()
+    return {"results": [{"id": 1, "name": query}]}
+
+@app.get("/discover/movie")
+async def discover_movie(page: int = 1):
+    await delay()
+    start = (page - 1) * 20 + 1
+    return {"page": page, "total_pages": 5, "results": [fake_movie(i) for i in range(start, start + 20)]}
+
+# Before /movie/{movie_id}, which would take "popular" for an id
+@app.get("/movie/popular")
+async def popular_movies(page: int = 1):
+    await delay()
+    start = 500 + (page - 1) * 20
+    return {"page": page, "total_pages": 5, "results": [fake_movie(i) for i in range(start, start + 20)]}
+
+@app.get("/movie/{movie_id}")
+async def movie_details(movie_id: int):
+    await delay()
+    return {
+        **fake_movie(movie_id),
+        "runtime": 90 + movie_id % 60,
+        "genres": [{"id": 18, "name": "Drama"}],
+        "imdb_id": f"tt{movie_id:07d}",
+    }
+
+@app.get("/movie/{movie_id}/credits")
+async def movie_credits(movie_id: int):
+    await delay()
+    return {"crew": [{"name": f"Director {movie_id % 3}", "job": "Director"}]}
+
+@app.get("/")
+async def omdb(i: str = ""):
+    await delay()
+    return {"imdbRating": "7.5"}
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, port=int(sys.argv[1]) if len(sys.argv) > 1 else 9000, log_level="warning")
@@ -0,0 +1,96 @@
+"""
+Duel picks: the old random.sample from the top genre pool (with a list
+membership test against the favorites) against Recommender.recommend().
+
+Times both per request and compares how well the picks fit the user,
+as the mean affinity score of the picked movies (same score for both).
+
+Run from the project root:  python -m benchmarks.recommendations [favorites]
+"""
+import random
+import sys
+import time
+
+import numpy as np
+
+from models import FavoriteStats, Movie, User
+from pools import GenrePools
+from recommend import Recommender
+from services import GENRE_MAP
+
+POOL_SIZE = 60  # three TMDB discover pages
+ROUNDS = 200
+
+def make_pools(rng: random.Random):
+    genres = list(GENRE_MAP)
+    pools, next_id = {}, 1_000_000
+    for genre in genres:
+        pool = []
+        for _ in range(POOL_SIZE):
+            others = rng.sample(genres, rng.randint(0, 2))
+            pool.append(Movie(
+                id=next_id, title=f"Movie {next_id}", release_date=f"{rng.randint(1960, 2025)}-05-01",
+                rating=round(rng.uniform(4, 9), 1), runtime=100, genres=list(dict.fromkeys([genre, *others])),
+            ))
+            next_id += 1
+        pools[genre] = pool
+    return pools
+
+def make_user(count: int, pools, rng: random.Random) -> User:
+    # Mostly 90s thrillers and crime, with some of the pool movies already saved
+    favorites = [
+        Movie(id=i, title=f"Fav {i}", release_date=f"{rng.randint(1990, 1999)}-01-01", rating=7.0, runtime=110,
+              genres=rng.sample(["Thriller", "Crime", "Drama"], 2) if rng.random() < 0.8 else [rng.choice(list(GENRE_MAP))])
+        for i in range(count)
+    ]
+    favorites += rng.sample(pools["Thriller"], 20)
+    return User(username="bench", password="pw", favorites=favorites, stats=FavoriteStats.from_movies(favorites))
+
+def old_duel(user: User, pools, top_genre: str):
+    movies = pools[top_genre]
+    favorite_ids = [movie.id for movie in user.favorites]
+    movies = [movie for movie in movies if movie.id not in favorite_ids]
+    return random.sample(movies, 6)
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn()
+    return (time.perf_counter() - start) / ROUNDS * 1e6
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = random.Random(1)
+    pools = make_pools(rng)
+    recommender = Recommender(GenrePools(None, list(GENRE_MAP), refresh_interval=0), list(GENRE_MAP))
+    start = time.perf_counter()
+    for genre, pool in pools.items():
+        recommender.update_pool(genre, pool)
+    rebuild = (time.perf_counter() - start) / len(pools) * 1000
+    user = make_user(count, pools, rng)
+    top_genre = max(user.stats.genre_counts, key=user.stats.genre_counts.get)
+
+    affinity = recommender.affinity(user.stats)
+    index = {movie.id: i for i, movie in enumerate(recommender.movies)}
+    def fit(movies):
+        return float(np.mean([recommender.features[index[m.id]] @ affinity for m in movies]))
+
+    favorite_ids = {m.id for m in user.favorites}
+    old_picks = [old_duel(user, pools, top_genre) for _ in range(ROUNDS)]
+    new_picks = [recommender.recommend(user, 6) for _ in range(ROUNDS)]
+    saved = sum(m.id in favorite_ids for picks in old_picks + new_picks for m in picks)
+
+    print(f"{count} favorites, {len(recommender.movies)} pool movies, rebuild after a pool refresh {rebuild:.1f} ms")
+    print(f"old random.sample:     {timed(lambda: old_duel(user, pools, top_genre)):8.0f} us/request, "
+          f"fit {np.mean([fit(p) for p in old_picks]):.3f}")
+    recommender.rankings.clear()
+    print(f"recommend, first call: {timed(lambda: (recommender.rankings.clear(), recommender.recommend(user, 6))):8.0f} us/request")
+    print(f"recommend, cached:     {timed(lambda: recommender.recommend(user, 6)):8.0f} us/request, "
+          f"fit {np.mean([fit(p) for p in new_picks]):.3f}")
+    ok = saved == 0 and fit(new_picks[0]) > np.mean([fit(p) for p in old_picks])
+    print(f"saved movies picked: {saved}")
+    print("OK" if ok else "FAILED")
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Searches against the mock upstream while it injects 429s and errors.
+
+Shows how many searches come back empty with and without retries, and
+that cached details are still served once the circuit breaker opens.
+Fails if the injected faults don't empty any search without retries, if
+a search is still empty with retries, or if the open breaker doesn't
+serve the expired details. The run with retries allows 5 of them, so a
+search failing every attempt (0.25^6) practically never happens.
+
+Run from the project root:  python -m benchmarks.resilience
+"""
+import asyncio
+import time
+
+from benchmarks import use_mock_upstream
+
+use_mock_upstream()
+
+import services
+import upstream
+from benchmarks import mock_upstream
+from cache import movie_cache
+from catalog import catalog
+
+SEARCHES = 30
+
+def reset():
+    # Each run asks the mock again, not the cache or the catalog the last one filled
+    movie_cache.clear()
+    catalog.clear()
+    for up in upstream.UPSTREAMS.values():
+        up.breaker.record_success()
+        up.limiter.paused_until = 0
+        for key in up.counters:
+            up.counters[key] = 0
+
+async def run_searches(label: str):
+    reset()
+    start = time.perf_counter()
+    results = await asyncio.gather(*(services.search_movies(f"query {i}") for i in range(SEARCHES)))
+    elapsed = time.perf_counter() - start
+    empty = sum(1 for movies in results if not movies)
+    missing_details = sum(1 for movies in results for m in movies if not m.runtime)
+    print(f"{label}: {empty}/{SEARCHES} empty searches, {missing_details} movies without details, "
+          f"{elapsed:.2f}s, tmdb {upstream.UPSTREAMS['tmdb'].counters}")
+    return empty, missing_details
+
+async def main() -> bool:
+    await upstream.start_client()
+    mock_upstream.RATE_LIMIT_RATE = 0.2
+    mock_upstream.ERROR_RATE = 0.05
+
+    retries = upstream.MAX_RETRIES
+    upstream.MAX_RETRIES = 0
+    empty_before, missing_before = await run_searches("no retries  ")
+    upstream.MAX_RETRIES = max(retries, 5)
+    empty_after, missing_after = await run_searches("with retries")
+
+    # Upstream goes down completely: the breaker opens and cached details are served
+    upstream.MAX_RETRIES = retries
+    mock_upstream.RATE_LIMIT_RATE = 0.0
+    mock_upstream.ERROR_RATE = 0.0
+    reset()
+    warm = await services.fetch_movie_details(upstream.get_client(), 1)
+    for part in movie_cache.parts.values():
+        part.ttl = 0  # everything cached is now expired
+        for key, (_, value) in part._data.items():
+            part._data[key] = (0, value)
+    mock_upstream.ERROR_RATE = 1.0
+    for i in range(upstream.BREAKER_FAILURES):
+        await services.fetch_movie_details(upstream.get_client(), 100 + i)
+        await services.fetch_omdb_rating(upstream.get_client(), 100 + i, f"tt{100 + i}")
+    start = time.perf_counter()
+    served = await services.fetch_movie_details(upstream.get_client(), 1)
+    states = (upstream.stats()["tmdb"]["state"], upstream.stats()["omdb"]["state"])
+    print(f"upstream down: breakers {states[0]}/{states[1]}, "
+          f"cached details served in {(time.perf_counter() - start) * 1000:.1f} ms, "
+          f"same as before: {served == warm}")
+
+    await upstream.close_client()
+    ok = (
+        empty_before > 0 and empty_after == 0 and missing_after < missing_before
+        and states == ("open", "open") and served == warm and bool(warm.get("runtime"))
+    )
+    print("OK" if ok else "FAILED")
+    return ok
+
+if __name__ == "__main__":
+    raise SystemExit(0 if asyncio.run(main()) else 1)
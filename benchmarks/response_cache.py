@@ -0,0 +1,81 @@
+"""
+Check and time ETag revalidation of /api/favorites, /api/wrapped and /api/search.
+
+A request with a matching If-None-Match must get a 304 without loading
+the user from the store and without serializing the response. Search
+runs against the mock TMDB/OMDb from benchmarks.mock_upstream.
+
+Run from the project root:  python -m benchmarks.response_cache
+"""
+import asyncio
+import time
+
+from benchmarks import use_mock_upstream
+
+REQUESTS = 500
+
+async def run() -> bool:
+    import httpx
+    import main
+    import responses
+    import services
+
+    calls = {"get_user": 0, "render": 0}
+
+    def counted(name, fn):
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return fn(*args, **kwargs)
+        return wrapper
+
+    main.get_user = counted("get_user", main.get_user)
+    responses.render = counted("render", responses.render)
+
+    ok = True
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            await client.post("/api/register", data={"username": "etag", "password": "pw"})
+            for movie_id in range(50):
+                await client.post("/api/favorites", data={
+                    "id": movie_id, "title": f"Movie {movie_id}", "runtime": 100,
+                    "rating": 7, "genres": "Drama", "release_date": "1999-01-01",
+                })
+
+            for path in ("/api/favorites", "/api/wrapped", "/api/search?q=Movie"):
+                first = await client.get(path)
+                etag = first.headers["etag"]
+
+                before = dict(calls)
+                start = time.perf_counter()
+                for _ in range(REQUESTS):
+                    r = await client.get(path, headers={"If-None-Match": etag})
+                    ok &= r.status_code == 304
+                revalidate = (time.perf_counter() - start) / REQUESTS
+                reads = calls["get_user"] - before["get_user"]
+                renders = calls["render"] - before["render"]
+                ok &= reads == 0 and renders == 0
+
+                start = time.perf_counter()
+                for _ in range(REQUESTS):
+                    await client.get(path)
+                full = (time.perf_counter() - start) / REQUESTS
+                print(f"{path:22} 304: {revalidate * 1000:.3f} ms (user loads {reads}, serializations {renders}), "
+                      f"200: {full * 1000:.3f} ms, cache-control: {first.headers['cache-control']}")
+
+            # A change gives a new ETag, so the old one no longer matches
+            etag = (await client.get("/api/favorites")).headers["etag"]
+            await client.delete("/api/favorites/0")
+            r = await client.get("/api/favorites", headers={"If-None-Match": etag})
+            changed = r.status_code == 200 and r.headers["etag"] != etag and len(r.json()["favorites"]) == 49
+            print(f"after a change: {r.status_code}, new etag {r.headers['etag']}")
+            ok &= changed
+
+    print("OK" if ok else "FAILED")
+    return ok
+
+def main():
+    use_mock_upstream(GENRE_POOL_REFRESH="0")
+    raise SystemExit(0 if asyncio.run(run()) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Serialization time per 1000 movies: the old model_dump + jsonable_encoder +
+json.dumps path (what FastAPI does with a returned dict) against render(),
+which goes straight from the models to bytes. Also checks both give the same JSON.
+
+Run from the project root:  python -m benchmarks.serialization [movies] [rounds]
+"""
+import json
+import sys
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from models import Movie
+from responses import render
+
+def make_movies(count: int):
+    return [
+        Movie(
+            id=i, title=f"Movie {i} – Ünïcode", poster_url=f"https://image.tmdb.org/t/p/w500/{i}.jpg",
+            release_date="1999-10-15", rating=7.8, director="Some Director", runtime=139,
+            genres=["Drama", "Thriller"], imdbRating=8.8,
+        )
+        for i in range(count)
+    ]
+
+def old_path(movies) -> bytes:
+    content = jsonable_encoder({"movies": [m.model_dump() for m in movies]})
+    return JSONResponse(content).body
+
+def fast_path(movies) -> bytes:
+    return render({"movies": movies})
+
+def per_thousand(fn, movies, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(movies)
+    return (time.perf_counter() - start) / rounds / len(movies) * 1000 * 1000
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    movies = make_movies(count)
+
+    same = json.loads(old_path(movies)) == json.loads(fast_path(movies))
+    old = per_thousand(old_path, movies, rounds)
+    fast = per_thousand(fast_path, movies, rounds)
+    print(f"{count} movies, {rounds} rounds")
+    print(f"model_dump + jsonable_encoder + json.dumps: {old:.2f} ms per 1000 movies")
+    print(f"render (pydantic_core.to_json):             {fast:.2f} ms per 1000 movies ({old / fast:.1f}x)")
+    print(f"same JSON: {same}")
+    raise SystemExit(0 if same else 1)
+
+if __name__ == "__main__":
+    main()
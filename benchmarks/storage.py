@@ -0,0 +1,68 @@
+"""
+Time get_user and set_favorites for the JSON and SQLite backends as the user base grows.
+
+Run from the project root:  python -m benchmarks.storage [max_users]
+JSON is skipped above 10k users since every call parses the whole file.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from models import Movie, User
+from storage import JsonUserStore, SqliteUserStore
+
+FAVORITES_PER_USER = 5
+LOOKUPS = 200
+
+def make_users(count: int):
+    for i in range(count):
+        yield User(
+            username=f"user{i}",
+            password="secret",
+            favorites=[
+                Movie(id=i * 10 + j, title=f"Movie {j}", release_date="1999-01-01",
+                      rating=7.0, runtime=100, genres=["Drama", "Action"])
+                for j in range(FAVORITES_PER_USER)
+            ],
+        )
+
+def time_store(store, count: int, lookups: int) -> tuple:
+    names = [f"user{random.randrange(count)}" for _ in range(lookups)]
+
+    start = time.perf_counter()
+    for name in names:
+        store.get_user(name)
+    read = (time.perf_counter() - start) / lookups
+
+    extra = Movie(id=-1, title="Extra")
+    start = time.perf_counter()
+    for name in names:
+        user = store.get_user(name)
+        store.set_favorites(name, user.favorites + [extra])
+    write = (time.perf_counter() - start) / lookups - read
+    return read, write
+
+def main():
+    max_users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    sizes = [n for n in (1_000, 10_000, 100_000) if n <= max_users]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in sizes:
+            users = list(make_users(count))
+
+            sqlite_store = SqliteUserStore(os.path.join(tmp, f"users{count}.db"))
+            sqlite_store.save_users(users)
+            read, write = time_store(sqlite_store, count, LOOKUPS)
+            sqlite_store.close()
+            print(f"sqlite {count:>7} users: read {read * 1000:8.3f} ms  write {write * 1000:8.3f} ms")
+
+            if count <= 10_000:
+                json_store = JsonUserStore(os.path.join(tmp, f"users{count}.json"))
+                json_store.save_users(users)
+                read, write = time_store(json_store, count, 10)
+                print(f"json   {count:>7} users: read {read * 1000:8.3f} ms  write {write * 1000:8.3f} ms")
+
+if __name__ == "__main__":
+    main()
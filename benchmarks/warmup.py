@@ -0,0 +1,108 @@
+"""
+First requests after a (re)start, with and without the startup warm-up.
+
+Starts the app three times in a row, each in a fresh process, against the
+mock TMDB/OMDb from benchmarks.mock_upstream (with its network latency):
+  - cold:     no warm-up (WARMUP_PREFETCH=0) and no snapshot, like before
+  - prefetch: no snapshot, the warm-up loads genre pools and popular movies
+  - snapshot: restart with the snapshot the prefetch run wrote on shutdown
+Each run polls /api/ready until it answers 200, then times the first
+/api/duel, /api/surprise and /api/movies/{id} of a user, and counts the
+upstream requests made while warming up and while answering. The warm-up
+doesn't ask OMDb (its daily quota is for users), so the first view of a
+movie may still fetch its OMDb rating; only TMDB requests are checked.
+
+Run from the project root:  python -m benchmarks.warmup
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import mock_clients, mock_env
+
+POPULAR_ID = 505  # on the first page of the mock's /movie/popular
+
+async def start_once() -> dict:
+    import httpx
+    import main
+    from benchmarks import mock_upstream
+
+    result = {}
+    start = time.perf_counter()
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            polls = 0
+            while True:
+                r = await client.get("/api/ready")
+                polls += 1
+                if r.status_code == 200:
+                    break
+                await asyncio.sleep(0.01)
+            result["ready_s"] = time.perf_counter() - start
+            result["not_ready_polls"] = polls - 1
+            result["status"] = r.json()
+            result["warmup_calls"] = sum(mock_upstream.CALLS.values())
+            mock_upstream.CALLS.clear()
+
+            form = {"username": "warm", "password": "pw"}
+            if (await client.post("/api/register", data=form)).status_code != 200:
+                (await client.post("/api/login", data=form)).raise_for_status()
+            for movie_id in range(1, 6):
+                await client.post("/api/favorites", data={
+                    "id": 10_000 + movie_id, "title": f"Favorite {movie_id}", "runtime": 100,
+                    "rating": 7, "genres": "Drama", "release_date": "1999-01-01",
+                })
+            for name, path in (("duel", "/api/duel"), ("surprise", "/api/surprise"),
+                               ("movie", f"/api/movies/{POPULAR_ID}")):
+                t = time.perf_counter()
+                r = await client.get(path)
+                r.raise_for_status()
+                result[f"{name}_ms"] = (time.perf_counter() - t) * 1000
+            result["request_calls"] = sum(mock_upstream.CALLS.values())
+            result["request_tmdb_calls"] = result["request_calls"] - mock_upstream.CALLS["/"]
+    return result
+
+def run(directory: str, env: dict) -> dict:
+    # A process per run, so nothing stays cached in memory between them
+    out = subprocess.run([sys.executable, "-m", "benchmarks.warmup", "--once"], env=mock_env(directory, **env),
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    if sys.argv[1:] == ["--once"]:
+        mock_clients()  # run() passed the mock_env() settings
+        print(json.dumps(asyncio.run(start_once())))
+        return
+
+    directory = tempfile.mkdtemp()
+    snapshot = os.path.join(directory, "warmup.json")
+    runs = {
+        "cold": run(directory, {"WARMUP_PREFETCH": "0"}),
+        "prefetch": run(directory, {"WARMUP_PREFETCH": None, "WARMUP_SNAPSHOT_FILE": snapshot}),
+        "snapshot": run(directory, {"WARMUP_PREFETCH": None, "WARMUP_SNAPSHOT_FILE": snapshot}),
+    }
+    for name, r in runs.items():
+        restored = r["status"]["restored"]
+        print(f"{name:9} ready after {r['ready_s']:5.2f} s ({r['warmup_calls']:4} upstream requests, "
+              f"restored {restored['genre_pools']} pools / {restored['movie_cache_entries']} cache entries); "
+              f"first duel {r['duel_ms']:7.1f} ms, surprise {r['surprise_ms']:6.1f} ms, "
+              f"movie {r['movie_ms']:6.1f} ms ({r['request_calls']} upstream requests, {r['request_tmdb_calls']} to TMDB)")
+    print(f"snapshot file: {os.path.getsize(snapshot) / 1024:.0f} KiB")
+
+    cold, prefetch, warm = runs["cold"], runs["prefetch"], runs["snapshot"]
+    ok = (
+        prefetch["request_tmdb_calls"] == 0 and warm["request_tmdb_calls"] == 0
+        and warm["status"]["restored"]["genre_pools"] > 0
+        and warm["ready_s"] < prefetch["ready_s"] / 2
+        and warm["warmup_calls"] <= warm["status"]["progress"]["popular_pages_total"]
+        and warm["duel_ms"] < cold["duel_ms"] / 10
+    )
+    print("OK" if ok else "FAILED")
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Check that the running Wrapped totals give the same stats as counting the list.
+
+Applies random adds and removes to a favorites list and its FavoriteStats
+and compares wrapped_stats_from_aggregate() with calculate_wrapped_stats()
+after every change. Few genres and decades, so ties for the top genre and
+decade happen all the time, and ratings with up to three decimals, so the
+float error of a long running sum would show. Also times both.
+
+Run from the project root:  python -m benchmarks.wrapped_stats [changes]
+"""
+import random
+import sys
+import time
+
+from models import FavoriteStats, Movie
+from services import calculate_wrapped_stats, wrapped_stats_from_aggregate
+
+GENRES = ["Drama", "Action", "Comedy"]
+
+def random_movie(rng: random.Random, movie_id: int) -> Movie:
+    return Movie(
+        id=movie_id, title=f"Movie {movie_id}", release_date=f"{rng.choice([1985, 1995, 2005])}-01-01",
+        rating=rng.choice([round(rng.uniform(1, 10), 1), round(rng.uniform(1, 10), 3), 10.6, 0.1]),
+        runtime=rng.randint(60, 200), genres=rng.sample(GENRES, rng.randint(0, 2)),
+    )
+
+def check(favorites, stats) -> bool:
+    return wrapped_stats_from_aggregate(stats) == calculate_wrapped_stats(favorites)
+
+def main():
+    changes = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    rng = random.Random(1)
+
+    # Tie after a removal: Action and Drama both once, "Action" sorts first
+    a = Movie(id=1, title="A", rating=7, runtime=100, genres=["Drama"], release_date="1999-01-01")
+    b = Movie(id=2, title="B", rating=7, runtime=100, genres=["Action", "Drama"], release_date="1999-01-01")
+    stats = FavoriteStats.from_movies([a, b])
+    stats.remove(a)
+    ok = check([b], stats) and wrapped_stats_from_aggregate(stats)["most_common_genre"] == "Action"
+
+    favorites, stats, mismatches = [], FavoriteStats(), 0
+    next_id = 100
+    for _ in range(changes):
+        if favorites and rng.random() < 0.45:
+            movie = favorites.pop(rng.randrange(len(favorites)))
+            stats.remove(movie)
+        else:
+            movie = random_movie(rng, next_id)
+            next_id += 1
+            favorites.append(movie)
+            stats.add(movie)
+        if not check(favorites, stats):
+            mismatches += 1
+            if mismatches <= 3:
+                print("mismatch:", wrapped_stats_from_aggregate(stats), calculate_wrapped_stats(favorites))
+    ok &= mismatches == 0
+
+    start = time.perf_counter()
+    for _ in range(100):
+        calculate_wrapped_stats(favorites)
+    full = (time.perf_counter() - start) / 100
+    start = time.perf_counter()
+    for _ in range(100):
+        wrapped_stats_from_aggregate(stats)
+    aggregate = (time.perf_counter() - start) / 100
+    print(f"{changes} random adds/removes, {len(favorites)} favorites left, {mismatches} mismatches")
+    print(f"calculate_wrapped_stats {full * 1e6:.0f} us, wrapped_stats_from_aggregate {aggregate * 1e6:.0f} us")
+    print("OK" if ok else "FAILED")
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
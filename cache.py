@@ -0,0 +1,286 @@
+"""
+Caches for movie metadata fetched from TMDB/OMDb.
+
+TTLCache is an in-memory LRU cache where every entry expires after a
+fixed time. MovieDetailCache keeps one TTLCache per part of a movie
+(details, director, imdbRating) and can also write them to a SQLite
+file so the cache survives a restart. warmup.py can also save it to and
+restore it from a snapshot (snapshot()/restore()).
+
+SQLite is only used from the WriteBehind thread: writes are queued and
+written in batches, and reads of the disk tier are awaited there, so the
+event loop never waits on the disk.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Returned by get() when a key is not cached (None is a valid cached value)
+MISSING = object()
+
+DAY = 24 * 60 * 60
+# How long an id found missing in the disk tier isn't looked up there again
+ABSENT_TTL = 10 * 60
+
+class TTLCache:
+    """Size bounded LRU cache, every entry expires ttl seconds after it was set"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+
+    def get(self, key, default=MISSING):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.time():
+            # Expired entries stay until they are evicted, get_stale() can still use them
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def get_stale(self, key, default=MISSING):
+        """Value even if it has expired, used when the upstream is down"""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        self.stale_hits += 1
+        return entry[1]
+
+    def set(self, key, value, expires_at: Optional[float] = None):
+        self._data[key] = (expires_at or time.time() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def items(self) -> List[tuple]:
+        """Every entry as (key, expires_at, value), least recently used first, expired ones too"""
+        return [(key, expires_at, value) for key, (expires_at, value) in self._data.items()]
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        """True if there is an entry for key, even an expired one"""
+        return key in self._data
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale_hits": self.stale_hits,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+class WriteBehind:
+    """
+    Queue of SQLite writes, run in order on one background thread. Everything
+    queued while a batch is being written goes into the next batch, one
+    transaction each. flush() waits until everything queued so far is written.
+    Reads run on the same thread (fetch_one), after the writes queued before them.
+    """
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.batches = 0
+        self._queue: List[tuple] = []  # (sql, rows)
+        self._scheduled = False
+        self._lock = threading.Lock()
+        self._conn = None  # opened on the writer thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="write-behind")
+
+    def write(self, sql: str, params: Sequence = ()):
+        self.write_many(sql, [params])
+
+    def write_many(self, sql: str, rows: List[Sequence]):
+        with self._lock:
+            self._queue.append((sql, rows))
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._executor.submit(self._write_queued)
+
+    def flush(self):
+        self._executor.submit(self._write_queued).result()
+
+    async def fetch_one(self, sql: str, params: Sequence = ()) -> Optional[tuple]:
+        """First row of a query, None if there is none or the read failed"""
+        return await asyncio.wrap_future(self._executor.submit(self._fetch_one, sql, params))
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_file)
+        return self._conn
+
+    def _fetch_one(self, sql: str, params: Sequence) -> Optional[tuple]:
+        try:
+            return self._connection().execute(sql, params).fetchone()
+        except sqlite3.Error as e:
+            print(f"Reading {self.db_file} failed: {e}")
+            return None
+
+    def _write_queued(self):
+        with self._lock:
+            batch, self._queue = self._queue, []
+            self._scheduled = False
+        if not batch:
+            return
+        try:
+            conn = self._connection()
+            with conn:
+                for sql, rows in batch:
+                    conn.executemany(sql, rows)
+            self.batches += 1
+        except sqlite3.Error as e:
+            # Only a cache: the entries are still in memory, and fetched again after a restart
+            print(f"Writing to {self.db_file} failed: {e}")
+
+class MovieDetailCache:
+    """
+    Cache keyed by TMDB movie id, with a separate TTL for each part.
+    If db_file is set, entries are also stored on disk and read back on a memory
+    miss (get()/get_stale() are awaited for that). Ids found missing on disk are
+    remembered for a while, so they don't cost a read every time.
+    """
+
+    def __init__(self, ttls: Dict[str, float], maxsize: int, db_file: Optional[str] = None):
+        self.parts = {part: TTLCache(maxsize, ttl) for part, ttl in ttls.items()}
+        self.disk_hits = 0
+        self.disk_reads = 0
+        self._writes: Optional[WriteBehind] = None
+        self._absent = TTLCache(maxsize, ABSENT_TTL)  # (part, movie_id) without a row on disk
+        if db_file:
+            db = sqlite3.connect(db_file)
+            try:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS movie_cache ("
+                    "part TEXT NOT NULL, movie_id INTEGER NOT NULL, value TEXT NOT NULL, "
+                    "expires_at REAL NOT NULL, PRIMARY KEY (part, movie_id))"
+                )
+                db.commit()
+            finally:
+                db.close()
+            self._writes = WriteBehind(db_file)
+
+    async def _load(self, part: str, movie_id: int) -> Optional[tuple]:
+        """
+        Read an entry memory doesn't have from disk into memory (expired ones
+        too, for get_stale()), returns it as (expires_at, value) or None.
+        Entries memory has, even expired ones, are never older than the disk's.
+        """
+        cache = self.parts[part]
+        if self._writes is None or movie_id in cache or self._absent.get((part, movie_id)) is not MISSING:
+            return None
+        self.disk_reads += 1
+        row = await self._writes.fetch_one(
+            "SELECT value, expires_at FROM movie_cache WHERE part = ? AND movie_id = ?", (part, movie_id)
+        )
+        if row is None:
+            self._absent.set((part, movie_id), True)
+            return None
+        expires_at, value = row[1], json.loads(row[0])
+        if movie_id not in cache:  # unless it was set while we read
+            cache.set(movie_id, value, expires_at=expires_at)
+        return expires_at, value
+
+    async def get(self, part: str, movie_id: int):
+        value = self.parts[part].get(movie_id)
+        if value is MISSING:
+            entry = await self._load(part, movie_id)
+            if entry is not None and entry[0] >= time.time():
+                self.disk_hits += 1
+                value = entry[1]
+        return value
+
+    async def get_stale(self, part: str, movie_id: int):
+        """Cached value even if it has expired, MISSING if there is none"""
+        value = self.parts[part].get_stale(movie_id)
+        if value is MISSING:
+            entry = await self._load(part, movie_id)
+            if entry is not None:
+                value = entry[1]
+        return value
+
+    def set(self, part: str, movie_id: int, value):
+        cache = self.parts[part]
+        cache.set(movie_id, value)
+        if self._writes is not None:
+            self._absent.discard((part, movie_id))
+            self._writes.write(
+                "INSERT OR REPLACE INTO movie_cache (part, movie_id, value, expires_at) VALUES (?, ?, ?, ?)",
+                (part, movie_id, json.dumps(value), time.time() + cache.ttl),
+            )
+
+    def snapshot(self) -> Dict[str, list]:
+        """Entries of every part as [movie_id, expires_at, value], see restore()"""
+        return {part: [list(item) for item in cache.items()] for part, cache in self.parts.items()}
+
+    def restore(self, snapshot: Dict[str, list]) -> int:
+        """
+        Put the entries of a snapshot() back in memory, returns how many.
+        They keep their expiry time, expired ones are still used by get_stale().
+        """
+        restored = 0
+        for part, entries in snapshot.items():
+            cache = self.parts.get(part)
+            if cache is None:
+                continue
+            for movie_id, expires_at, value in entries:
+                cache.set(movie_id, value, expires_at=expires_at)
+                restored += 1
+        return restored
+
+    def clear(self):
+        for cache in self.parts.values():
+            cache.clear()
+        self._absent.clear()
+        if self._writes is not None:
+            # Reads run after it on the same thread, so they can't find a cleared entry
+            self._writes.write("DELETE FROM movie_cache")
+
+    def flush(self):
+        """Wait until every entry set so far is on disk (called on app shutdown)"""
+        if self._writes is not None:
+            self._writes.flush()
+
+    def stats(self) -> dict:
+        stats = {part: cache.stats() for part, cache in self.parts.items()}
+        stats["disk"] = {"enabled": self._writes is not None, "reads": self.disk_reads, "hits": self.disk_hits}
+        return stats
+
+# Shared cache for services.py, configurable with env variables
+movie_cache = MovieDetailCache(
+    ttls={
+        "details": float(os.getenv("DETAILS_CACHE_TTL", str(7 * DAY))),
+        "director": float(os.getenv("DIRECTOR_CACHE_TTL", str(30 * DAY))),
+        "imdbRating": float(os.getenv("RATING_CACHE_TTL", str(DAY))),
+    },
+    maxsize=int(os.getenv("MOVIE_CACHE_SIZE", "5000")),
+    db_file=os.getenv("CACHE_DB_FILE") or None,
+)
@@ -0,0 +1,288 @@
+"""
+Local catalog of every movie the app has seen from TMDB: search results,
+movie details and genre pools. Favorites are never added, they come from
+the client and the catalog answers every user's searches.
+
+Titles and directors go into an inverted index (word -> movie ids), with
+a sorted word list for prefix lookups, so type-ahead never leaves the
+process. search_movies() asks lookup() first and only goes to TMDB when
+the catalog isn't confident:
+  - the same search was answered by TMDB before (within CATALOG_QUERY_TTL)
+    and every movie it returned is still in the catalog, or
+  - at least CATALOG_CONFIDENT_HITS movies match every word of the query.
+Full searches also need every movie to be enriched (runtime, genres, director).
+
+Entries are kept as compact FavoriteMovie records. If CATALOG_DB_FILE is
+set the catalog is also written to SQLite (in the background, see
+cache.WriteBehind) and loaded again on start.
+"""
+import bisect
+import heapq
+import itertools
+import json
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+from dotenv import load_dotenv
+
+from cache import DAY, MISSING, TTLCache, WriteBehind
+from models import FavoriteMovie, Movie
+
+load_dotenv()
+
+CATALOG_DB_FILE = os.getenv("CATALOG_DB_FILE") or None
+CATALOG_QUERY_TTL = float(os.getenv("CATALOG_QUERY_TTL", str(DAY)))
+CATALOG_CONFIDENT_HITS = int(os.getenv("CATALOG_CONFIDENT_HITS", "10"))
+# Movies returned for a search, same as a TMDB search page we use
+SEARCH_LIMIT = 10
+# Prefixes matching more movies than this are answered by walking the movies in
+# popularity order instead of ranking every match, keeps one-letter prefixes fast
+MAX_CANDIDATES = 1000
+# Movies looked at at most for one suggestion, type-ahead is best effort
+SCAN_LIMIT = 5000
+# Seconds the popularity order may be out of date
+POPULARITY_REFRESH = 30
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """'Amélie (2001)' -> ['amelie', '2001']"""
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.findall(r"[^\W_]+", text)
+
+class Catalog:
+    def __init__(self, db_file: Optional[str] = None, query_ttl: float = CATALOG_QUERY_TTL,
+                 confident_hits: int = CATALOG_CONFIDENT_HITS):
+        self.confident_hits = confident_hits
+        self.movies: Dict[int, FavoriteMovie] = {}
+        self.enriched: Set[int] = set()
+        self.popularity: Dict[int, int] = {}  # how often a movie showed up anywhere
+        self._titles: Dict[str, Set[int]] = {}
+        self._directors: Dict[str, Set[int]] = {}
+        self._words: List[str] = []  # sorted keys of _titles
+        self._title_text: Dict[int, str] = {}  # ' amelie 2001', for prefix checks with `in`
+        self._by_popularity: List[int] = []
+        self._popular_postings: Dict[str, List[int]] = {}
+        self._sorted_at = 0.0
+        # (search type, query words) -> movie ids TMDB returned for it
+        self._queries = TTLCache(10_000, query_ttl)
+        self.local_answers = 0
+        self.fallbacks = 0
+        self._db = None
+        self._writes: Optional[WriteBehind] = None
+        if db_file:
+            self._db = sqlite3.connect(db_file, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS catalog ("
+                "movie_id INTEGER PRIMARY KEY, movie TEXT NOT NULL, enriched INTEGER NOT NULL, "
+                "popularity INTEGER NOT NULL)"
+            )
+            self._db.commit()
+            self._load()
+            self._writes = WriteBehind(db_file)
+
+    def _load(self):
+        for movie, enriched, popularity in self._db.execute("SELECT movie, enriched, popularity FROM catalog"):
+            record = FavoriteMovie(**json.loads(movie))
+            self._put(record, bool(enriched))
+            self.popularity[record.id] = popularity
+
+    # --- Adding movies ---
+
+    def add(self, movie: Union[Movie, FavoriteMovie], enriched: bool = False):
+        self.add_many([movie], enriched)
+
+    def add_many(self, movies: Iterable[Union[Movie, FavoriteMovie]], enriched: bool = False):
+        changed = []
+        for movie in movies:
+            self.popularity[movie.id] = self.popularity.get(movie.id, 0) + 1
+            # Never replace details with a search result that has fewer of them
+            if movie.id in self.enriched and not enriched:
+                continue
+            record = FavoriteMovie.of(movie)
+            self._put(record, enriched)
+            changed.append(record)
+        if self._writes is not None and changed:
+            self._writes.write_many(
+                "INSERT OR REPLACE INTO catalog (movie_id, movie, enriched, popularity) VALUES (?, ?, ?, ?)",
+                [(r.id, json.dumps(r.to_dict()), r.id in self.enriched, self.popularity[r.id]) for r in changed],
+            )
+
+    def _put(self, record: FavoriteMovie, enriched: bool):
+        old = self.movies.get(record.id)
+        if old is not None:
+            self._unindex(old)
+        self.movies[record.id] = record
+        if enriched:
+            self.enriched.add(record.id)
+        words = tokenize(record.title)
+        self._title_text[record.id] = " " + " ".join(words)
+        if old is None:
+            self._by_popularity.append(record.id)
+        for word in set(words):
+            ids = self._titles.get(word)
+            if ids is None:
+                ids = self._titles[word] = set()
+                bisect.insort(self._words, word)
+            ids.add(record.id)
+        for word in set(tokenize(record.director)):
+            self._directors.setdefault(word, set()).add(record.id)
+
+    def _unindex(self, record: FavoriteMovie):
+        for word in set(self._title_text.pop(record.id, "").split()):
+            ids = self._titles.get(word)
+            if ids is not None:
+                ids.discard(record.id)
+                if not ids:
+                    del self._titles[word]
+                    del self._words[bisect.bisect_left(self._words, word)]
+        for word in set(tokenize(record.director)):
+            self._directors.get(word, set()).discard(record.id)
+
+    def remember(self, search_type: str, query: str, movies: List[Movie], enriched: bool = False):
+        """Store what TMDB answered for a search, so the same search can be answered locally"""
+        self.add_many(movies, enriched)
+        self._queries.set((search_type, tuple(tokenize(query))), [m.id for m in movies])
+
+    def clear(self):
+        self.movies.clear()
+        self.enriched.clear()
+        self.popularity.clear()
+        self._titles.clear()
+        self._directors.clear()
+        self._words.clear()
+        self._title_text.clear()
+        self._by_popularity = []
+        self._popular_postings = {}
+        self._sorted_at = 0.0
+        self._queries.clear()
+        if self._writes is not None:
+            self._writes.write("DELETE FROM catalog")
+
+    def flush(self):
+        """Wait until every movie added so far is on disk (called on app shutdown)"""
+        if self._writes is not None:
+            self._writes.flush()
+
+    # --- Searching ---
+
+    def _ranked(self, ids: Iterable[int], words: List[str], limit: int) -> List[int]:
+        # Exact titles first, then the movies seen most often
+        exact = " " + " ".join(words)
+        def key(movie_id):
+            return (self._title_text[movie_id] != exact, -self.popularity.get(movie_id, 0), movie_id)
+        return heapq.nsmallest(limit, ids, key=key)
+
+    def _popularity_order(self) -> List[int]:
+        """Every movie id, most popular first (re-sorted at most every POPULARITY_REFRESH seconds)"""
+        if time.monotonic() - self._sorted_at > POPULARITY_REFRESH:
+            self._by_popularity = sorted(self.movies, key=self.popularity.__getitem__, reverse=True)
+            # Same order per common title word, for type-ahead after a common word
+            popular = {}
+            for movie_id in self._by_popularity:
+                for word in set(self._title_text[movie_id].split()):
+                    if len(self._titles[word]) > MAX_CANDIDATES:
+                        popular.setdefault(word, []).append(movie_id)
+            self._popular_postings = popular
+            self._sorted_at = time.monotonic()
+        return self._by_popularity
+
+    def _matching(self, index: Dict[str, Set[int]], words: List[str]) -> Set[int]:
+        """Movies that have every word"""
+        postings = [index.get(word) for word in words]
+        if not postings or not all(postings):
+            return set()
+        postings.sort(key=len)
+        return set(postings[0]).intersection(*postings[1:])
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> List[Movie]:
+        """Title search: every word of the query has to be in the title"""
+        words = tokenize(query)
+        return [self.movies[i].to_movie() for i in self._ranked(self._matching(self._titles, words), words, limit)]
+
+    def suggest(self, prefix: str, limit: int = 8) -> List[FavoriteMovie]:
+        """Type-ahead: the last word may be incomplete, the others have to match whole"""
+        words = tokenize(prefix)
+        if not words:
+            return []
+        *complete, last = words
+        partial = " " + last
+        required = sorted((self._titles.get(word, ()) for word in complete), key=len)
+        if required and not required[0]:
+            return []
+
+        # Few movies to choose from: rank them all (every word has at least one movie)
+        start = bisect.bisect_left(self._words, last)
+        end = bisect.bisect_left(self._words, last + "\U0010ffff", start)
+        candidates = None
+        if end - start <= MAX_CANDIDATES:
+            postings = [self._titles[word] for word in self._words[start:end]]
+            if sum(map(len, postings)) <= MAX_CANDIDATES:
+                candidates = set().union(*postings)
+        if candidates is not None:
+            candidates = [i for i in candidates if all(i in ids for ids in required)]
+        elif len(required) > 1:
+            # Two common words rarely share many titles
+            required = [required[0].intersection(*required[1:])]
+        if candidates is None and required and len(required[0]) <= MAX_CANDIDATES:
+            candidates = [i for i in required[0] if partial in self._title_text[i]]
+        if candidates is not None:
+            best = heapq.nsmallest(limit, candidates, key=lambda i: (-self.popularity.get(i, 0), i))
+            return [self.movies[i] for i in best]
+
+        # Common words only: walk the movies most popular first, the best ones almost always match
+        order = self._popularity_order()
+        if required:
+            order = self._popular_postings.get(complete[0]) if len(complete) == 1 else None
+            order = order or required[0]
+        best = []
+        for movie_id in itertools.islice(order, SCAN_LIMIT):
+            if partial in self._title_text[movie_id]:
+                best.append(movie_id)
+                if len(best) == limit:
+                    break
+        return [self.movies[i] for i in best]
+
+    def lookup(self, search_type: str, query: str, enriched: bool = False) -> Optional[List[Movie]]:
+        """Answer a search from the catalog, None if TMDB should be asked instead"""
+        words = tokenize(query)
+        ids = self._queries.get((search_type, tuple(words)))
+        if ids is MISSING:
+            if search_type == "director":
+                # Everyone whose director has exactly these words
+                matches = [i for i in self._matching(self._directors, words)
+                           if tokenize(self.movies[i].director) == words]
+            else:
+                matches = self._matching(self._titles, words)
+            if enriched:
+                matches = [i for i in matches if i in self.enriched]
+            ids = self._ranked(matches, words, SEARCH_LIMIT) if len(matches) >= self.confident_hits else None
+        elif not all(i in self.movies and (not enriched or i in self.enriched) for i in ids):
+            ids = None
+
+        if ids is None:
+            self.fallbacks += 1
+            return None
+        self.local_answers += 1
+        return [self.movies[i].to_movie() for i in ids]
+
+    def stats(self) -> dict:
+        answered = self.local_answers + self.fallbacks
+        return {
+            "movies": len(self.movies),
+            "enriched": len(self.enriched),
+            "words": len(self._words),
+            "remembered_searches": len(self._queries),
+            "local_answers": self.local_answers,
+            "fallbacks": self.fallbacks,
+            "local_ratio": round(self.local_answers / answered, 3) if answered else 0.0,
+            "disk": self._db is not None,
+        }
+
+catalog = Catalog(CATALOG_DB_FILE)
@@ -0,0 +1,209 @@
+"""
+Streaming import of favorites from CSV or JSONL.
+
+The upload is read chunk by chunk and parsed line by line, so the size of
+the file doesn't matter. Movies are written in batches of IMPORT_BATCH_SIZE
+(one store write per batch). Rows with a TMDB id are used as they are; rows
+with only a title (like a Letterboxd export: Name, Year) are looked up on
+TMDB first.
+
+CSV needs a header row. Recognized columns (case-insensitive):
+id / tmdb_id / movie_id, title / name, year, release_date, rating,
+runtime, genres (comma or | separated), director, poster_url.
+"""
+import asyncio
+import codecs
+import csv
+import json
+import os
+from typing import AsyncIterator, List, Optional
+
+from dotenv import load_dotenv
+from pydantic import ValidationError
+
+from models import Movie
+from services import MAX_CONCURRENT_REQUESTS, find_movie, get_movie, update_favorites
+from upstream import UpstreamUnavailable
+
+load_dotenv()
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+# Longest line accepted, protects against a file without newlines
+MAX_LINE_LENGTH = 64 * 1024
+# Titles that couldn't be found, at most this many are reported back
+MAX_REPORTED = 20
+
+ID_COLUMNS = ("id", "tmdb_id", "movie_id")
+
+class ImportFormatError(ValueError):
+    """The upload can't be imported (unknown format, broken header)"""
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decoded lines of a byte stream, a UTF-8 BOM is dropped"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+        if len(buffer) > MAX_LINE_LENGTH:
+            raise ImportFormatError("Line too long")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+async def csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[Optional[dict]]:
+    """Rows as dicts keyed by the lowercased header, None for rows that can't be parsed"""
+    header = None
+    record = ""
+    async for line in lines:
+        record = f"{record}\n{line}" if record else line
+        # An odd number of quotes means a quoted field continues on the next line
+        if record.count('"') % 2:
+            if len(record) > MAX_LINE_LENGTH:
+                raise ImportFormatError("Line too long")
+            continue
+        text, record = record, ""
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip().lower() for name in values]
+            if not any(name in header for name in ID_COLUMNS + ("title", "name")):
+                raise ImportFormatError("CSV header needs an id or a title/name column")
+            continue
+        yield dict(zip(header, values)) if len(values) <= len(header) else None
+    if record:
+        yield None
+
+async def jsonl_rows(lines: AsyncIterator[str]) -> AsyncIterator[Optional[dict]]:
+    async for line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield None
+            continue
+        yield {str(k).lower(): v for k, v in row.items()} if isinstance(row, dict) else None
+
+def _number(value, kind):
+    if value is None or value == "":
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_row(row: dict) -> Optional[dict]:
+    """Movie fields from an import row, None if it has neither an id nor a title"""
+    ids = (_number(row.get(column), int) for column in ID_COLUMNS)
+    movie_id = next((i for i in ids if i is not None), None)
+    title = str(row.get("title") or row.get("name") or "").strip()
+    if movie_id is None and not title:
+        return None
+
+    genres = row.get("genres") or []
+    if isinstance(genres, str):
+        genres = [g.strip() for g in genres.replace("|", ",").split(",") if g.strip()]
+    release_date = row.get("release_date") or None
+    year = _number(row.get("year"), int)
+    if not release_date and year:
+        release_date = f"{year}-01-01"
+    return {
+        "id": movie_id,
+        "title": title,
+        "year": year,
+        "release_date": release_date,
+        "rating": _number(row.get("rating"), float) or 0.0,
+        "runtime": _number(row.get("runtime"), int) or 0,
+        "genres": genres,
+        "director": row.get("director") or None,
+        "poster_url": row.get("poster_url") or None,
+    }
+
+class FavoriteImport:
+    """Collects rows into batches and writes them, keeps the counts for the summary"""
+
+    def __init__(self, username: str, details: bool = False):
+        self.username = username
+        self.details = details
+        self.seen = set()  # movie ids already in this upload
+        self.batch: List[dict] = []
+        self.counts = {"added": 0, "already_in_favorites": 0, "duplicates": 0, "not_found": 0, "invalid": 0}
+        self.not_found: List[str] = []
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def add(self, row: Optional[dict]):
+        fields = parse_row(row) if row is not None else None
+        if fields is None:
+            self.counts["invalid"] += 1
+            return
+        self.batch.append(fields)
+        if len(self.batch) >= IMPORT_BATCH_SIZE:
+            await self.flush()
+
+    async def _resolve(self, fields: dict) -> Optional[Movie]:
+        async with self._semaphore:
+            if fields["id"] is None:
+                found = await find_movie(fields["title"], fields["year"])
+                if found is None:
+                    return None
+                fields = {**fields, **{k: v for k, v in found.model_dump().items() if v}}
+            # An id without a title needs the details anyway
+            if not fields["title"] or self.details and not (fields["runtime"] and fields["genres"]):
+                try:
+                    detailed = await get_movie(fields["id"])
+                except UpstreamUnavailable:
+                    detailed = None  # import what the file has
+                if detailed is not None:
+                    fields = {**detailed.model_dump(), **{k: v for k, v in fields.items() if v}}
+        try:
+            return Movie(**fields)
+        except ValidationError:
+            return None
+
+    async def flush(self):
+        batch, self.batch = self.batch, []
+        movies = []
+        for fields, movie in zip(batch, await asyncio.gather(*(self._resolve(f) for f in batch))):
+            if movie is None and fields["id"] is None:
+                self.counts["not_found"] += 1
+                if len(self.not_found) < MAX_REPORTED:
+                    self.not_found.append(fields["title"])
+            elif movie is None:
+                self.counts["invalid"] += 1
+            elif movie.id in self.seen:
+                self.counts["duplicates"] += 1
+            else:
+                self.seen.add(movie.id)
+                movies.append(movie)
+
+        _, added = await update_favorites(self.username, add=movies)
+        for was_added in added:
+            self.counts["added" if was_added else "already_in_favorites"] += 1
+
+    def summary(self) -> dict:
+        return {"status": "ok", **self.counts, "not_found_titles": self.not_found}
+
+def detect_format(content_type: str, fmt: Optional[str]) -> str:
+    fmt = (fmt or "").lower()
+    if not fmt:
+        content_type = content_type.lower()
+        fmt = "jsonl" if "json" in content_type else "csv" if "csv" in content_type else ""
+    if fmt in ("jsonl", "ndjson"):
+        return "jsonl"
+    if fmt == "csv":
+        return "csv"
+    raise ImportFormatError("Unknown format, use format=csv or format=jsonl")
+
+async def import_favorites(username: str, chunks: AsyncIterator[bytes], fmt: str, details: bool = False) -> dict:
+    """Import every row of the upload into the user's favorites, returns counts per outcome"""
+    lines = iter_lines(chunks)
+    rows = csv_rows(lines) if fmt == "csv" else jsonl_rows(lines)
+    job = FavoriteImport(username, details)
+    async for row in rows:
+        await job.add(row)
+    await job.flush()
+    return job.summary()
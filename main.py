@@ -1,17 +1,50 @@
 import uvicorn
+import asyncio
+import json
 import os
 from collections import Counter
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Form, Depends, HTTPException
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware 
-from models import Movie, User, WrappedStats
-from services import load_users, save_users, get_user, update_user_favorites, search_movies, calculate_wrapped_stats, search_movies_by_genre_async
-
-app = FastAPI()
+from models import BulkFavorites, Favorites, Movie, User, WrappedStats
+import upstream
+from cache import MISSING, movie_cache
+import responses
+import metrics
+from responses import ModelJSONResponse
+from catalog import catalog
+from services import get_store, open_store, close_store, director_search_stats, get_movie, search_movies_summary, stream_search_movies, get_user, get_favorites_version, add_user, add_favorite, remove_favorite, update_favorites, search_movies, normalize_query, wrapped_stats_from_aggregate
+from pools import genre_pools
+from recommend import recommender
+from importer import ImportFormatError, detect_format, import_favorites
+from warmup import warmup
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Open the shared TMDB/OMDb client and the user store, and start the warm-up
+    (restores the cache snapshot, loads the rest in the background, then starts the genre pool refresher)
+    """
+    await upstream.start_client()
+    open_store()
+    await warmup.start()
+    yield
+    await warmup.stop()
+    await genre_pools.stop()
+    await asyncio.to_thread(movie_cache.flush)
+    await asyncio.to_thread(catalog.flush)
+    await close_store()
+    await upstream.close_client()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(SessionMiddleware, secret_key=os.getenv("SECRET_KEY", "hemlig-nyckel"), max_age=3600)
+# Added last so it is outermost and times everything, sessions included
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
 
 # Setup Static files & Templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -30,11 +63,11 @@ def format_runtime(minutes):
 templates.env.filters["format_runtime"] = format_runtime
 
 # --- HELPER FUNCTION: Get current logged-in user ---
-def get_current_user(request: Request):
+async def get_current_user(request: Request):
     username = request.session.get("username")
     if not username:
         return None
-    return get_user(username)
+    return await get_user(username)
 
 # --- ROUTES: PAGES (Return HTML) ---
 @app.get("/")
@@ -52,7 +85,7 @@ def logout(request: Request):
 
 @app.get("/movies")
 async def movies_page(request: Request):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user: return RedirectResponse("/")
 
     return templates.TemplateResponse("movies.html", {
@@ -61,8 +94,8 @@ async def movies_page(request: Request):
     })
 
 @app.get("/my_list")
-def my_list_page(request: Request):
-    user = get_current_user(request)
+async def my_list_page(request: Request):
+    user = await get_current_user(request)
     if not user: return RedirectResponse("/")
 
     return templates.TemplateResponse("my_list.html", {
@@ -71,17 +104,17 @@ def my_list_page(request: Request):
     })
 
 @app.get("/wrapped")
-def wrapped_page(request: Request):
-    user = get_current_user(request)
+async def wrapped_page(request: Request):
+    user = await get_current_user(request)
     if not user: return RedirectResponse("/")
     
     return templates.TemplateResponse("wrapped.html", {"request": request})
 
 @app.get("/duel")
-def duel_page(request: Request):
+async def duel_page(request: Request):
     """checks if the user is logged in, if not, redirects to the login page.
     if the user is authenticated, returns the duel.html template with the username"""
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         return RedirectResponse("/")
 
@@ -92,44 +125,114 @@ def duel_page(request: Request):
 
 # --- JSON API ENDPOINTS ---
 @app.get("/api/search")
-async def api_search_movies(q: str = "", type: str = "film"):
-    """Search movies via external API query. based on film name or director name, realizes GET /api/search"""
+async def api_search_movies(request: Request, q: str = "", type: str = "film", detail: str = "full"):
+    """
+    Search movies via external API query. based on film name or director name, realizes GET /api/search.
+    detail=summary only returns what the search itself gives, use /api/movies/{id} for the rest.
+    Responses are cached for SEARCH_CACHE_TTL seconds and can be revalidated with their ETag.
+    """
     if not q:
         return {"movies": []}
-    
-    movies = await search_movies(q, type)
-    return {"movies": [m.model_dump() for m in movies]}
+
+    key = (normalize_query(q), type, detail)
+    cached = responses.search_responses.get(key)
+    if cached is MISSING:
+        if detail == "summary":
+            movies = await search_movies_summary(q, type)
+        else:
+            movies = await search_movies(q, type)
+        body = responses.render({"movies": movies})
+        cached = (body, responses.body_etag(body))
+        # No results can also mean TMDB was down, don't keep that around
+        if movies:
+            responses.search_responses.set(key, cached)
+    body, etag = cached
+    return responses.json_response(request, body, etag, responses.PUBLIC_SEARCH)
+
+@app.get("/api/search/stream")
+async def api_search_movies_stream(q: str = "", type: str = "film", detail: str = "full"):
+    """
+    Streaming version of /api/search (NDJSON, one event per line). Movies are sent
+    as soon as the basic search returns (director searches: as soon as the director
+    is confirmed), details follow as patch events.
+    """
+    async def events():
+        async for event in stream_search_movies(q, type, summary=detail == "summary"):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@app.get("/api/search/suggest")
+async def api_search_suggest(q: str = "", limit: int = 8):
+    """Type-ahead from the local movie catalog (no TMDB call), the last word of q may be incomplete"""
+    return ModelJSONResponse({
+        "movies": [
+            {"id": m.id, "title": m.title, "year": m.year, "poster_url": m.poster_url}
+            for m in catalog.suggest(q, min(max(limit, 1), 20))
+        ]
+    })
+
+@app.get("/api/movies/{movie_id}")
+async def api_movie_details(movie_id: int):
+    """Fully enriched movie (runtime, genres, director, IMDb rating), realizes GET /api/movies/{movie_id}"""
+    try:
+        movie = await get_movie(movie_id)
+    except upstream.UpstreamUnavailable:
+        raise HTTPException(503, "Movie details are unavailable right now, try again later")
+    if not movie:
+        raise HTTPException(404, "Movie not found")
+    return ModelJSONResponse(movie)
 
 @app.post("/api/register")
 async def api_register(request: Request, username: str = Form(...), password: str = Form(...)):
     """Register new user with username & password, realizes POST /api/register"""
-    if get_user(username):
+    if not await add_user(User(username=username, password=password)):
         raise HTTPException(400, "User already exists")
     
-    users = load_users()
-    users.append(User(username=username, password=password))
-    save_users(users)
-    
     request.session["username"] = username
     return {"status": "ok", "message": "User created"}
 
 @app.post("/api/login")
 async def api_login(request: Request, username: str = Form(...), password: str = Form(...)):
     """Loggin a specific user with username & password, realizes POST /api/login"""
-    user = get_user(username)
+    user = await get_user(username)
     if not user or user.password != password:
         raise HTTPException(401, "Invalid credentials")
     
     request.session["username"] = username
     return {"status": "ok", "username": username}
 
+async def user_json_response(request: Request, kind: str, build) -> Response:
+    """
+    Per-user JSON response with the favorites version as ETag. A matching
+    If-None-Match gets a 304 before the user is loaded or anything is serialized.
+    """
+    username = request.session.get("username")
+    version = await get_favorites_version(username) if username else None
+    if version is None:
+        raise HTTPException(401, "Not authenticated")
+
+    etag = responses.user_etag(kind, username, version)
+    if responses.etag_matches(request, etag):
+        return responses.not_modified(etag, responses.PRIVATE)
+
+    body = responses.user_responses.get((kind, username, version))
+    if body is MISSING:
+        user = await get_user(username)
+        if not user:
+            raise HTTPException(401, "Not authenticated")
+        # The favorites may have changed since the version was read, go by what was loaded
+        version = user.stats.version
+        etag = responses.user_etag(kind, username, version)
+        body = responses.render(build(user))
+        responses.user_responses.set((kind, username, version), body)
+    return responses.json_response(request, body, etag, responses.PRIVATE)
+
 @app.get("/api/favorites")
 async def api_get_favorites(request: Request):
     """Get user's favorites list, realizes GET /api/favorites"""
-    user = get_current_user(request)
-    if not user:
-        raise HTTPException(401, "Not authenticated")
-    return {"favorites": [m.model_dump() for m in user.favorites]}
+    # The records serialize with the public Movie fields, no Movie models or dicts are built for it
+    return await user_json_response(request, "favorites", lambda user: Favorites.model_construct(favorites=user.favorites))
 
 @app.post("/api/favorites")
 async def api_add_favorite(
@@ -144,14 +247,10 @@ async def api_add_favorite(
     genres: str = Form("")
 ):
     """Add movie favorite list, realizes POST /api/favorites"""
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(401, "Not authenticated")
     
-    # Check if already exists
-    if any(m.id == id for m in user.favorites):
-        return JSONResponse({"status": "ok", "message": "Already in favorites"})
-    
     genre_list = [g.strip() for g in genres.split(",")] if genres else []
     
     movie = Movie(
@@ -164,30 +263,23 @@ async def api_add_favorite(
         runtime=runtime,
         genres=genre_list
     )
-    user.favorites.append(movie)
-    update_user_favorites(user.username, user.favorites)
+    # Checked and added in one step, so concurrent requests can't add it twice
+    if not await add_favorite(user.username, movie):
+        return JSONResponse({"status": "ok", "message": "Already in favorites"})
     return {"status": "ok", "message": "Added to favorites"}
 
 @app.delete("/api/favorites/{movie_id}")
 async def api_remove_favorite(request: Request, movie_id: int):
     """Remove favorite from list, realizes DELETE /api/favorites/{movie_id}"""
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(401, "Not authenticated")
     
-    new_favs = [m for m in user.favorites if m.id != movie_id]
-    update_user_favorites(user.username, new_favs)
+    await remove_favorite(user.username, movie_id)
     return {"status": "ok", "message": "Removed"}
 
-@app.get("/api/wrapped")
-async def api_get_wrapped(request: Request):
-    """Get wrapped statistics based on movies in list, relizes GET /api/wrapped"""
-    user = get_current_user(request)
-    if not user:
-        raise HTTPException(401, "Not authenticated")
-    
-    favs = user.favorites
-    if not favs:
+def build_wrapped(user: User) -> WrappedStats:
+    if not user.stats.total_movies:
         return WrappedStats(
             hours=0,
             minutes=0,
@@ -200,7 +292,7 @@ async def api_get_wrapped(request: Request):
             decade_breakdown={}
         )
     
-    stats = calculate_wrapped_stats(favs)
+    stats = wrapped_stats_from_aggregate(user.stats)
     avg_rating = stats["average_rating"]
     
     return WrappedStats(
@@ -217,53 +309,96 @@ async def api_get_wrapped(request: Request):
         decade_breakdown=stats["decade_breakdown"]
     )
 
+# Most movies accepted by one bulk request, larger lists go through /api/favorites/import
+BULK_MAX_MOVIES = int(os.getenv("BULK_MAX_MOVIES", "5000"))
+
+@app.post("/api/favorites/bulk")
+async def api_bulk_favorites(request: Request, body: BulkFavorites):
+    """
+    Add and remove many favorites in one JSON request and a single write, realizes POST /api/favorites/bulk.
+    Body: {"add": [movie, ...], "remove": [movie_id, ...]}, removes are applied first.
+    """
+    user = await get_current_user(request)
+    if not user:
+        raise HTTPException(401, "Not authenticated")
+    if len(body.add) + len(body.remove) > BULK_MAX_MOVIES:
+        raise HTTPException(413, f"At most {BULK_MAX_MOVIES} movies per request, use /api/favorites/import")
+
+    removed, added = await update_favorites(user.username, add=body.add, remove=body.remove)
+    return {
+        "status": "ok",
+        "added": sum(added),
+        "removed": sum(removed),
+        "already_in_favorites": [m.id for m, ok in zip(body.add, added) if not ok],
+        "not_in_favorites": [i for i, ok in zip(body.remove, removed) if not ok],
+    }
+
+@app.post("/api/favorites/import")
+async def api_import_favorites(request: Request, format: str = None, details: bool = False):
+    """
+    Import favorites from a CSV or JSONL upload of any size, sent as the raw request body,
+    realizes POST /api/favorites/import. The format comes from ?format= or the Content-Type.
+    Rows without a TMDB id are looked up by title (and year), details=true also fetches
+    runtime/genres for rows that don't have them.
+    """
+    user = await get_current_user(request)
+    if not user:
+        raise HTTPException(401, "Not authenticated")
+    try:
+        fmt = detect_format(request.headers.get("content-type", ""), format)
+        return await import_favorites(user.username, request.stream(), fmt, details)
+    except ImportFormatError as e:
+        raise HTTPException(400, str(e))
+
+@app.get("/api/wrapped")
+async def api_get_wrapped(request: Request):
+    """Get wrapped statistics based on movies in list, relizes GET /api/wrapped"""
+    return await user_json_response(request, "wrapped", build_wrapped)
+
+# Movies per duel, and how many of the best fits a surprise is drawn from
+DUEL_MOVIES = 6
+SURPRISE_SPREAD = 10
+
 @app.get("/api/duel")
 async def api_duel(request: Request):
     """
     generates movies for the duel feature. 
-    finds the users top genre from their lists, fetches movies from
-    the external api, filters out saved movies and returns 6 random ones for the duel rounds.
+    finds the users top genre from their lists, ranks the movies of the prefetched
+    genre pools by how well they fit the users genres and decades, filters out saved
+    movies and returns 6 of the best ones for the duel rounds.
     """
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(401, "Not authenticated")
 
     if not user.favorites:
         return {"status": "no_favorites"}
 
-    stats = calculate_wrapped_stats(user.favorites)
+    stats = wrapped_stats_from_aggregate(user.stats)
     top_genre = stats.get("most_common_genre")
 
     if not top_genre:
         return {"status": "no_genre"}
 
-    movies = await search_movies_by_genre_async(top_genre)
-
-    if not movies or len(movies) < 2:
-        return {"status": "not_enough_movies"}
-
-    # remove movies that are already in user's favorites
-    favorite_ids = [movie.id for movie in user.favorites]
-    movies = [movie for movie in movies if movie.id not in favorite_ids]
+    # Only waits on TMDB if this genre was never loaded, picks come from every loaded pool
+    await genre_pools.get(top_genre)
+    picked = recommender.recommend(user, DUEL_MOVIES)
 
-    if len(movies) < 6:
+    if len(picked) < DUEL_MOVIES:
         return {"status": "not_enough_movies"}
 
-    import random
-    picked = random.sample(movies, 6)
-
-    return {
+    return ModelJSONResponse({
         "status": "ok",
         "top_genre": top_genre,
-        "movies": [movie.model_dump() for movie in picked]
-    }
+        "movies": picked
+    })
 
 @app.get("/api/surprise")
 async def api_surprise(request: Request):
     """
     Ensures surprise kicks in if user is logged in AND wrapped even exists.
     """
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(401, "Not authenticated")
 
@@ -272,35 +407,130 @@ async def api_surprise(request: Request):
         return {"status": "no_wrapped"}
 
     # Reusing wrapped logic
-    stats = calculate_wrapped_stats(user.favorites)
+    stats = wrapped_stats_from_aggregate(user.stats)
     top_genre = stats.get("most_common_genre")
 
     if not top_genre:
         return {"status": "no_wrapped"}
 
-    # get genre
-    movies = await search_movies_by_genre_async(top_genre)
+    await genre_pools.get(top_genre)
+    # one of the best fits for surprise
+    picked = recommender.recommend(user, 1, spread=SURPRISE_SPREAD)
 
-    if not movies:
+    if not picked:
         return {"status": "no_results", "top_genre": top_genre}
 
-    # one random for surprise
-    import random
-    movie = random.choice(movies)
-
-    return {
+    return ModelJSONResponse({
         "status": "ok",
         "top_genre": top_genre,
-        "movie": movie.model_dump()
+        "movie": picked[0]
+    })
+
+@app.get("/api/stats/cache")
+async def api_cache_stats():
+    """Hit/miss/eviction counters for the movie detail cache"""
+    return movie_cache.stats()
+
+@app.get("/api/stats/responses")
+async def api_response_cache_stats():
+    """Hit/miss counters for the cached search and per-user responses"""
+    return responses.stats()
+
+@app.get("/api/stats/catalog")
+async def api_catalog_stats():
+    """Size of the local movie catalog and how many searches it answered without TMDB"""
+    return catalog.stats()
+
+@app.get("/api/stats/recommendations")
+async def api_recommendation_stats():
+    """Movies the duel/surprise picks are ranked from, and the cached per-user rankings"""
+    return recommender.stats()
+
+@app.get("/api/stats/genre-pools")
+async def api_genre_pool_stats():
+    """Size and age (seconds) of every loaded genre pool"""
+    return genre_pools.stats()
+
+@app.get("/api/stats/upstream")
+async def api_upstream_stats():
+    """Coalesced lookups, plus rate limit/retry/circuit breaker counters per upstream"""
+    return {
+        "coalescing": upstream.flights.stats(),
+        "upstreams": upstream.stats(),
+        "director_search": director_search_stats,
     }
 
+# --- METRICS ---
+def lookup_counters() -> dict:
+    """Everything that counts hits and misses: caches, the user identity map and the local catalog"""
+    counters = {f"movie_{part}": (cache.hits, cache.misses) for part, cache in movie_cache.parts.items()}
+    counters["search_responses"] = (responses.search_responses.hits, responses.search_responses.misses)
+    counters["user_responses"] = (responses.user_responses.hits, responses.user_responses.misses)
+    store = get_store()
+    counters["users"] = (store.hits, store.misses)
+    counters["catalog"] = (catalog.local_answers, catalog.fallbacks)
+    counters["rankings"] = (recommender.rankings.hits, recommender.rankings.misses)
+    return counters
+
+@metrics.collector("cache_hits_total", "counter", "Lookups answered without going further (to TMDB, the store, ...)")
+def cache_hits():
+    return [("cache_hits_total", {"cache": name}, hits) for name, (hits, _) in lookup_counters().items()]
+
+@metrics.collector("cache_misses_total", "counter", "Lookups that had to go further")
+def cache_misses():
+    return [("cache_misses_total", {"cache": name}, misses) for name, (_, misses) in lookup_counters().items()]
+
+@metrics.collector("cache_hit_ratio", "gauge", "Share of lookups answered from the cache since start")
+def cache_hit_ratios():
+    return [
+        ("cache_hit_ratio", {"cache": name}, hits / (hits + misses) if hits + misses else 0.0)
+        for name, (hits, misses) in lookup_counters().items()
+    ]
+
+@metrics.collector("upstream_circuit_state", "gauge", "1 for the current circuit breaker state of each upstream")
+def upstream_circuits():
+    return [
+        ("upstream_circuit_state", {"upstream": name, "state": state}, int(up.breaker.state == state))
+        for name, up in upstream.UPSTREAMS.items() for state in ("closed", "open", "half-open")
+    ]
+
+@metrics.collector("upstream_lookups_in_flight", "gauge", "Distinct movie lookups running (coalesced requests wait on these)")
+def upstream_lookups():
+    return [("upstream_lookups_in_flight", {}, upstream.flights.stats()["in_flight"])]
+
+@metrics.collector("genre_pool_movies", "gauge", "Movies in each loaded genre pool")
+def genre_pool_sizes():
+    return [("genre_pool_movies", {"genre": genre}, pool["size"]) for genre, pool in genre_pools.stats().items()]
+
+@app.get("/metrics")
+async def api_metrics():
+    """Prometheus metrics: request/upstream/storage timings, cache hit ratios, in-flight requests"""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(404, "Metrics are turned off")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@metrics.collector("warmup_ready", "gauge", "1 once the startup warm-up is done (see /api/ready)")
+def warmup_ready():
+    return [("warmup_ready", {}, int(warmup.ready))]
+
+@app.get("/api/ready")
+async def api_ready():
+    """Readiness for the load balancer: 503 with the warm-up progress until the caches are warm"""
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/api/stats/traces")
+async def api_traces():
+    """Spans of the last traced requests (TRACE_SAMPLE_RATE of all requests are traced)"""
+    return {"sample_rate": metrics.TRACE_SAMPLE_RATE, "traces": list(metrics.traces)}
+
 @app.get("/surprise")
-def surprise_page(request: Request):
+async def surprise_page(request: Request):
     """
     Function to ensure that surprise.html can be accessed upon login as existing user.
     If not, boot back to /.
     """
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         return RedirectResponse("/")
     return templates.TemplateResponse("surprise.html", {"request": request})
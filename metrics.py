@@ -0,0 +1,354 @@
+"""
+Counters, gauges and histograms in the Prometheus text format, served at /metrics.
+
+Kept dependency-free: a metric is a dict from label values to numbers,
+guarded by a lock because storage calls run in worker threads. Values
+that already live elsewhere (cache hit counters, catalog, upstream
+breakers) are read when /metrics is scraped, through collectors.
+
+Tracing is optional: a sampled share of requests (TRACE_SAMPLE_RATE)
+collects spans (upstream calls, storage operations) which are sent back
+in a Server-Timing header and kept for /api/stats/traces.
+"""
+import bisect
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 0 turns every metric and the /metrics endpoint off
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+# Finished traces kept for /api/stats/traces
+TRACE_HISTORY = 100
+
+# Seconds, from a cache hit to a slow upstream call with retries
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Sample = Tuple[str, Dict[str, str], float]  # (name with suffix, labels, value)
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        pairs = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        return f"{name}{{{pairs}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _labels(self, values: tuple) -> Dict[str, str]:
+        return dict(zip(self.labels, values))
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(self.name, self._labels(key), value) for key, value in sorted(self._values.items())]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set_function(self, fn: Callable[[], float]):
+        """Read the (unlabelled) value from fn when scraped, for values kept elsewhere"""
+        self._function = fn
+
+    def samples(self) -> List[Sample]:
+        if self._function is not None:
+            return [(self.name, {}, self._function())]
+        return super().samples()
+
+    def set(self, value: float, *labels):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    @contextmanager
+    def track(self, *labels):
+        """+1 while the block runs"""
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        self.observe_many([value], *labels)
+
+    def observe_many(self, values: List[float], *labels):
+        if not METRICS_ENABLED:
+            return
+        indexes = [bisect.bisect_left(self.buckets, value) for value in values]
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # per-bucket counts (not cumulative) + the +Inf bucket, sum, count
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = entry[0]
+            for index in indexes:
+                counts[index] += 1
+            entry[1] += sum(values)
+            entry[2] += len(values)
+
+    @contextmanager
+    def time(self, *labels, span_name: Optional[str] = None):
+        """Observe how long the block took, and record it as a span if the request is traced"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(elapsed, *labels)
+            if span_name is not None:
+                add_span(span_name, start, elapsed)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in sorted(self._values.items())]
+        samples = []
+        for key, counts, total, count in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+REGISTRY: List[Metric] = []
+# name -> (type, help, function returning samples), read at scrape time
+COLLECTORS: List[Tuple[str, str, str, Callable[[], Iterable[Sample]]]] = []
+
+def collector(name: str, kind: str, help: str):
+    """Register a function that returns (name, labels, value) samples when /metrics is scraped"""
+    def register(fn: Callable[[], Iterable[Sample]]):
+        COLLECTORS.append((name, kind, help, fn))
+        return fn
+    return register
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format (version 0.0.4)"""
+    flush_requests()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(format_sample(*sample) for sample in metric.samples())
+    for name, kind, help, fn in COLLECTORS:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(format_sample(*sample) for sample in fn())
+    return "\n".join(lines) + "\n"
+
+# --- Metrics of the app ---
+
+http_requests = Counter("http_requests_total", "HTTP requests handled", ("method", "route", "status"))
+http_duration = Histogram("http_request_duration_seconds", "Time to handle an HTTP request", ("method", "route"))
+http_in_flight = Gauge("http_requests_in_flight", "HTTP requests being handled right now")
+upstream_duration = Histogram(
+    "upstream_request_duration_seconds", "Time of one TMDB/OMDb request (every retry counts)", ("upstream", "endpoint")
+)
+upstream_requests = Counter(
+    "upstream_requests_total", "TMDB/OMDb requests by outcome (HTTP status or error)", ("upstream", "endpoint", "outcome")
+)
+upstream_in_flight = Gauge("upstream_requests_in_flight", "TMDB/OMDb requests waiting for a response", ("upstream",))
+storage_duration = Histogram(
+    "storage_operation_duration_seconds", "Time of one user store operation", ("backend", "operation")
+)
+
+# --- Tracing ---
+
+_spans: ContextVar[Optional[list]] = ContextVar("trace_spans", default=None)
+traces = deque(maxlen=TRACE_HISTORY)
+
+def add_span(name: str, start: float, elapsed: float):
+    """Record a span in the current trace (no-op when the request isn't traced)"""
+    spans = _spans.get()
+    if spans is not None:
+        spans.append((name, start, elapsed))
+
+@contextmanager
+def span(name: str):
+    spans = _spans.get()
+    if spans is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans.append((name, start, time.perf_counter() - start))
+
+def server_timing(spans: List[tuple], total: float) -> str:
+    """Server-Timing header value, spans with the same name are added up (even if they overlapped)"""
+    durations: Dict[str, List[float]] = {}
+    for name, _, elapsed in spans:
+        durations.setdefault(name, []).append(elapsed)
+    parts = [
+        f"{name};dur={sum(times) * 1000:.2f}" + (f';desc="{len(times)} calls"' if len(times) > 1 else "")
+        for name, times in durations.items()
+    ]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+# Finished requests as (scope, status, seconds), added to the HTTP metrics
+# in batches: one list append is all a request pays for, the method and
+# route label are read from the scope when the batch is flushed
+_finished: List[tuple] = []
+FLUSH_SIZE = 256
+
+def flush_requests():
+    """Move buffered requests into http_requests_total and http_request_duration_seconds"""
+    global _finished
+    batch, _finished = _finished, []
+    durations: Dict[tuple, List[float]] = {}
+    statuses: Dict[tuple, int] = {}
+    for scope, status, elapsed in batch:
+        method, route = scope["method"], route_label(scope)
+        durations.setdefault((method, route), []).append(elapsed)
+        statuses[method, route, status] = statuses.get((method, route, status), 0) + 1
+    for labels, values in durations.items():
+        http_duration.observe_many(values, *labels)
+    for (method, route, status), count in statuses.items():
+        http_requests.inc(method, route, str(status), amount=count)
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware (cheaper than BaseHTTPMiddleware): times every
+    request by route template, counts responses and traces a sample of them.
+    """
+
+    # Only changed on the event loop, so a plain int (no lock) is enough
+    in_flight = 0
+
+    def __init__(self, app, trace_sample_rate: float = TRACE_SAMPLE_RATE):
+        self.app = app
+        self.trace_sample_rate = trace_sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        if self.trace_sample_rate and random.random() < self.trace_sample_rate:
+            await self._traced(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        MetricsMiddleware.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            MetricsMiddleware.in_flight -= 1
+            _finished.append((scope, status, time.perf_counter() - start))
+            if len(_finished) >= FLUSH_SIZE:
+                flush_requests()
+
+    async def _traced(self, scope, receive, send):
+        """Like an untraced request, plus its spans in a Server-Timing header and in traces"""
+        status = 500
+        spans = []
+        token = _spans.set(spans)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                value = server_timing(spans, time.perf_counter() - start)
+                headers.append((b"server-timing", value.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        MetricsMiddleware.in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            MetricsMiddleware.in_flight -= 1
+            _finished.append((scope, status, elapsed))
+            if len(_finished) >= FLUSH_SIZE:
+                flush_requests()
+            _spans.reset(token)
+            traces.append({
+                "method": scope["method"], "path": scope["path"], "route": route_label(scope), "status": status,
+                "total_ms": round(elapsed * 1000, 3),
+                "spans": [
+                    {"name": name, "start_ms": round((at - start) * 1000, 3), "duration_ms": round(d * 1000, 3)}
+                    for name, at, d in spans
+                ],
+            })
+
+http_in_flight.set_function(lambda: MetricsMiddleware.in_flight)
+
+def route_label(scope) -> str:
+    """Route template like /api/movies/{movie_id}, so ids don't make a label each"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if scope["path"].startswith("/static/"):
+        return "/static"
+    return "unmatched"
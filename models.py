@@ -1,6 +1,10 @@
 from __future__ import annotations
-from pydantic import BaseModel, ConfigDict
-from typing import List, Optional
+import threading
+from dataclasses import dataclass
+from pydantic import BaseModel, ConfigDict, GetCoreSchemaHandler, TypeAdapter
+from pydantic_core import core_schema
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from typing_extensions import TypedDict
 
 class Movie(BaseModel):
     id: int
@@ -13,12 +17,246 @@ class Movie(BaseModel):
     genres: List[str] = []
     imdbRating: Optional[float] = None  
 
+class _MovieKey(TypedDict):
+    id: int
+    title: str
+
+class MovieFields(_MovieKey, total=False):
+    """Movie as a plain dict, validated without creating the model"""
+    poster_url: Optional[str]
+    release_date: Optional[str]
+    rating: float
+    director: Optional[str]
+    runtime: int
+    genres: List[str]
+    imdbRating: Optional[float]
+
+def decade_label(release_date: Optional[str]) -> Optional[str]:
+    """'1994-07-06' -> '1990s', None if there is no usable year"""
+    if not release_date:
+        return None
+    try:
+        year = int(str(release_date)[:4])
+    except (ValueError, TypeError):
+        return None
+    return f"{(year // 10) * 10}s"
+
+def most_common(counts: Dict[str, int]) -> Optional[str]:
+    """
+    Key with the highest count, None if there is none. Ties go to the key that
+    sorts first, so the running totals (where keys come and go as favorites are
+    added and removed) give the same answer as counting the current list.
+    """
+    return min(counts, key=lambda key: (-counts[key], key)) if counts else None
+
+def rating_total(total: float) -> float:
+    """Sums of ratings are rounded, so float error can't build up or change an average rounded to one decimal"""
+    return round(total, 6)
+
+class Codes:
+    """Maps labels (genre names, decades) to small integer codes"""
+
+    def __init__(self, labels: Iterable[str] = ()):
+        self.labels: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        for label in labels:
+            self.code(label)
+
+    def code(self, label: str) -> int:
+        code = self._codes.get(label)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(label)
+                if code is None:
+                    code = self._codes[label] = len(self.labels)
+                    self.labels.append(label)
+        return code
+
+    def __len__(self):
+        return len(self.labels)
+
+# Genre codes for every favorite in this process, services loads GENRE_MAP into it first
+GENRE_CODES = Codes()
+# Genre names -> one shared tuple of codes per combination, most favorites reuse a handful of them.
+# And back: the names of each of those tuples, so reading genres doesn't decode them every time
+_genre_tuples: Dict[Tuple[str, ...], Tuple[int, ...]] = {}
+_genre_names: Dict[Tuple[int, ...], Tuple[str, ...]] = {}
+
+def _genre_codes(genres: Iterable[str]) -> Tuple[int, ...]:
+    names = tuple(genres)
+    codes = _genre_tuples.get(names)
+    if codes is None:
+        codes = _genre_tuples[names] = tuple(GENRE_CODES.code(genre) for genre in names)
+        _genre_names[codes] = names
+    return codes
+
+# Validates a Movie given as a dict, without building the model
+_MOVIE_FIELDS = TypeAdapter(MovieFields)
+
+@dataclass(init=False, repr=False, eq=False)
+class FavoriteMovie:
+    """
+    Compact in-memory form of a favorite: slotted, genres as a shared tuple of
+    genre codes (their names are looked up per tuple). Reads like a Movie
+    (same attribute names), is stored in the same format, and is turned into
+    a Movie only when it leaves the API (to_movie).
+    Treated as immutable, changes replace the whole record.
+    A dataclass with the Movie fields (genres is the property below) only so
+    pydantic serializes it like a Movie, straight from the attributes.
+    """
+    __slots__ = ("id", "title", "poster_url", "release_date", "rating", "director", "runtime", "genre_codes", "imdbRating")
+    id: int
+    title: str
+    poster_url: Optional[str]
+    release_date: Optional[str]
+    rating: float
+    director: Optional[str]
+    runtime: int
+    genres: List[str]
+    imdbRating: Optional[float]
+
+    def __init__(self, id: int, title: str, poster_url: Optional[str] = None, release_date: Optional[str] = None,
+                 rating: float = 0.0, director: Optional[str] = None, runtime: int = 0,
+                 genres: Iterable[str] = (), imdbRating: Optional[float] = None):
+        self.id = id
+        self.title = title
+        self.poster_url = poster_url
+        self.release_date = release_date
+        self.rating = rating
+        self.director = director
+        self.runtime = runtime
+        self.genre_codes = _genre_codes(genres)
+        self.imdbRating = imdbRating
+
+    @property
+    def genres(self) -> List[str]:
+        return list(_genre_names[self.genre_codes])
+
+    @property
+    def year(self) -> Optional[int]:
+        try:
+            return int(self.release_date[:4])
+        except (TypeError, ValueError):
+            return None
+
+    @classmethod
+    def of(cls, movie: Union[Movie, FavoriteMovie]) -> FavoriteMovie:
+        if isinstance(movie, FavoriteMovie):
+            return movie
+        return cls(movie.id, movie.title, movie.poster_url, movie.release_date, movie.rating,
+                   movie.director, movie.runtime, movie.genres, movie.imdbRating)
+
+    def to_movie(self) -> Movie:
+        return Movie.model_construct(**self.to_dict())
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id, "title": self.title, "poster_url": self.poster_url,
+            "release_date": self.release_date, "rating": self.rating, "director": self.director,
+            "runtime": self.runtime, "genres": list(_genre_names[self.genre_codes]), "imdbRating": self.imdbRating,
+        }
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return f"FavoriteMovie(id={self.id!r}, title={self.title!r})"
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: Any, handler: GetCoreSchemaHandler) -> core_schema.CoreSchema:
+        # Dicts are checked/coerced like a Movie (without building one)
+        validate_fields = _MOVIE_FIELDS.validator.validate_python
+
+        def validate(value, _):
+            if isinstance(value, (FavoriteMovie, Movie)):
+                return cls.of(value)
+            return cls(**validate_fields(value))
+
+        # Serialized by the wrapped dataclass schema (it never validates): the fields are read
+        # straight from the attributes, no dict is built per favorite
+        fields = _MOVIE_FIELDS.core_schema["fields"]
+        serialized = core_schema.dataclass_schema(
+            cls,
+            core_schema.dataclass_args_schema(
+                cls.__name__, [core_schema.dataclass_field(name, field["schema"]) for name, field in fields.items()]
+            ),
+            list(fields),
+            slots=True,
+        )
+        return core_schema.no_info_wrap_validator_function(validate, serialized)
+
+class FavoriteStats(BaseModel):
+    """Running totals over a user's favorites, updated on every add/remove"""
+    # Goes up on every change, used for ETags
+    version: int = 0
+    total_movies: int = 0
+    total_minutes: int = 0
+    rating_sum: float = 0.0
+    genre_counts: Dict[str, int] = {}
+    decade_counts: Dict[str, int] = {}
+
+    @classmethod
+    def from_movies(cls, movies: List[Movie]) -> FavoriteStats:
+        stats = cls()
+        for movie in movies:
+            stats.add(movie)
+        return stats
+
+    def replace(self, movies: List[Movie]) -> FavoriteStats:
+        """Stats for a whole new list, with a newer version than this one"""
+        stats = FavoriteStats.from_movies(movies)
+        stats.version = max(stats.version, self.version + 1)
+        return stats
+
+    def add(self, movie: Movie):
+        self._update(movie, 1)
+
+    def remove(self, movie: Movie):
+        self._update(movie, -1)
+
+    def _update(self, movie: Movie, sign: int):
+        self.version += 1
+        self.total_movies += sign
+        self.total_minutes += sign * movie.runtime
+        self.rating_sum = rating_total(self.rating_sum + sign * movie.rating)
+        for genre in movie.genres:
+            _bump(self.genre_counts, genre, sign)
+        decade = decade_label(movie.release_date)
+        if decade:
+            _bump(self.decade_counts, decade, sign)
+
+def _bump(counts: Dict[str, int], key: str, sign: int):
+    count = counts.get(key, 0) + sign
+    if count > 0:
+        counts[key] = count
+    else:
+        counts.pop(key, None)
+
 class User(BaseModel):
     username: str
     password: str
-    favorites: List[Movie] = []
+    favorites: List[FavoriteMovie] = []
+    stats: Optional[FavoriteStats] = None
     model_config = ConfigDict(from_attributes=True)
 
+    def model_post_init(self, __context):
+        # Users saved before stats existed get them computed once on load
+        if self.stats is None:
+            self.stats = FavoriteStats.from_movies(self.favorites)
+
+class Favorites(BaseModel):
+    """Body of GET /api/favorites, rendered straight from the user's records"""
+    favorites: List[FavoriteMovie]
+
+class BulkFavorites(BaseModel):
+    """Body of POST /api/favorites/bulk"""
+    add: List[Movie] = []
+    remove: List[int] = []
+
 class WrappedStats(BaseModel):
     hours: int
     minutes: int
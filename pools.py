@@ -0,0 +1,158 @@
+"""
+In-memory pools of enriched movies per genre, used by /api/duel and /api/surprise.
+
+A background task refreshes every genre in GENRE_MAP on an interval.
+Requests always get the current pool right away (stale-while-revalidate);
+only a genre that has never been loaded is fetched on demand. Pools can
+be restored from a warm-up snapshot, they keep the age they had.
+"""
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from models import Movie
+from services import GENRE_MAP, search_movies_by_genre_async
+
+load_dotenv()
+
+GENRE_POOL_PAGES = int(os.getenv("GENRE_POOL_PAGES", "3"))
+# Seconds between refreshes, 0 turns the background refresher off
+GENRE_POOL_REFRESH = float(os.getenv("GENRE_POOL_REFRESH", "3600"))
+
+class GenrePools:
+    def __init__(
+        self,
+        fetch: Callable[[str, int], Awaitable[List[Movie]]],
+        genres: List[str],
+        pages: int = GENRE_POOL_PAGES,
+        refresh_interval: float = GENRE_POOL_REFRESH,
+    ):
+        self.fetch = fetch
+        self.genres = genres
+        self.pages = pages
+        self.refresh_interval = refresh_interval
+        self._pools: Dict[str, List[Movie]] = {}
+        self._refreshed_at: Dict[str, float] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Called with (genre, pool) after a pool was loaded, e.g. to rebuild recommendations
+        self.listeners: List[Callable[[str, List[Movie]], None]] = []
+
+    def peek(self, genre: str) -> List[Movie]:
+        """Current pool without triggering any fetch"""
+        return self._pools.get(genre, [])
+
+    def age(self, genre: str) -> float:
+        """Seconds since the pool was loaded, infinite if it never was"""
+        if genre not in self._refreshed_at:
+            return float("inf")
+        return time.monotonic() - self._refreshed_at[genre]
+
+    def is_fresh(self, genre: str) -> bool:
+        """Loaded and not due for a refresh yet"""
+        if genre not in self._pools:
+            return False
+        return not self.refresh_interval or self.age(genre) < self.refresh_interval
+
+    async def get(self, genre: str) -> List[Movie]:
+        """Return the pool for a genre, refreshing it in the background if it is stale"""
+        if genre not in GENRE_MAP:
+            return []
+        pool = self._pools.get(genre)
+        if pool is None:
+            # Never loaded yet: wait for the first fetch
+            await self.refresh(genre)
+            return self._pools.get(genre, [])
+
+        age = time.monotonic() - self._refreshed_at.get(genre, 0)
+        if self.refresh_interval and age > self.refresh_interval:
+            self.refresh_in_background(genre)
+        return pool
+
+    def refresh_in_background(self, genre: str) -> asyncio.Task:
+        """Start a refresh for genre unless one is already running"""
+        task = self._refreshing.get(genre)
+        if task is None or task.done():
+            task = asyncio.create_task(self._refresh(genre))
+            self._refreshing[genre] = task
+        return task
+
+    async def refresh(self, genre: str):
+        await asyncio.shield(self.refresh_in_background(genre))
+
+    async def _refresh(self, genre: str):
+        pages = await asyncio.gather(
+            *(self.fetch(genre, page) for page in range(1, self.pages + 1)),
+            return_exceptions=True,
+        )
+        seen = set()
+        pool = []
+        for movies in pages:
+            if isinstance(movies, BaseException):
+                continue
+            for movie in movies:
+                if movie.id not in seen:
+                    seen.add(movie.id)
+                    pool.append(movie)
+
+        # Keep serving the old pool if the upstream gave us nothing
+        if pool:
+            self._set(genre, pool, time.monotonic())
+
+    def _set(self, genre: str, pool: List[Movie], refreshed_at: float):
+        self._pools[genre] = pool
+        self._refreshed_at[genre] = refreshed_at
+        for listener in self.listeners:
+            listener(genre, pool)
+
+    def restore(self, genre: str, pool: List[Movie], age: float) -> bool:
+        """Use a pool from a snapshot that was age seconds old, unless the genre is loaded already"""
+        if genre not in GENRE_MAP or genre in self._pools or not pool:
+            return False
+        self._set(genre, pool, time.monotonic() - age)
+        return True
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Every loaded pool with its age in seconds, see restore()"""
+        return {
+            genre: {"age": self.age(genre), "movies": [movie.model_dump() for movie in pool]}
+            for genre, pool in self._pools.items()
+        }
+
+    async def _run(self):
+        while True:
+            for genre in self.genres:
+                if self.is_fresh(genre):
+                    continue  # e.g. restored from a snapshot or loaded by the warm-up
+                try:
+                    await self.refresh(genre)
+                except Exception as e:
+                    print(f"Genre pool refresh failed for {genre}: {e}")
+            # Until the oldest pool is due again
+            ages = [self.age(genre) for genre in self.genres if genre in self._pools]
+            await asyncio.sleep(max(1.0, self.refresh_interval - max(ages, default=0.0)))
+
+    def start(self):
+        """Start the background refresher (called on app startup)"""
+        if self.refresh_interval and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = list(self._refreshing.values())
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._refreshing.clear()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            genre: {"size": len(pool), "age": round(now - self._refreshed_at.get(genre, now), 1)}
+            for genre, pool in self._pools.items()
+        }
+
+genre_pools = GenrePools(search_movies_by_genre_async, list(GENRE_MAP))
@@ -0,0 +1,129 @@
+"""
+Ranked picks for /api/duel and /api/surprise, from the genre pools.
+
+Every movie in the loaded genre pools is a row of a 0/1 feature matrix
+over genres and decades. A user's affinity vector over the same columns
+comes from their running FavoriteStats (share of favorites per genre and
+per decade), so scoring every candidate is one matrix-vector product.
+
+The matrix is rebuilt by the pool refresh task whenever a pool changes,
+and a user's ranking is kept until their favorites or the pools change,
+so a request never waits on TMDB or on scoring more than once.
+"""
+import os
+import random
+from typing import Dict, List
+
+import numpy as np
+from dotenv import load_dotenv
+
+from cache import DAY, MISSING, TTLCache
+from models import Codes, FavoriteStats, Movie, User, decade_label
+from pools import GenrePools, genre_pools
+from services import GENRE_MAP
+
+load_dotenv()
+
+# Weight of a matching decade against a matching genre
+RECOMMEND_DECADE_WEIGHT = float(os.getenv("RECOMMEND_DECADE_WEIGHT", "0.5"))
+# Picks are drawn at random from the best count * RECOMMEND_SPREAD movies, so reloads differ
+RECOMMEND_SPREAD = int(os.getenv("RECOMMEND_SPREAD", "2"))
+RANKING_CACHE_SIZE = int(os.getenv("RANKING_CACHE_SIZE", "1000"))
+# Rating (0-10) breaks ties between movies that fit equally well
+RATING_WEIGHT = 0.01
+
+class Recommender:
+    def __init__(self, pools: GenrePools, genres: List[str], decade_weight: float = RECOMMEND_DECADE_WEIGHT):
+        self.decade_weight = decade_weight
+        self.genres = Codes(genres)
+        self.decades = Codes()
+        self._pools: Dict[str, List[Movie]] = {}
+        # Bumped on every rebuild, cached rankings from older versions are recomputed
+        self.version = 0
+        self.movies: List[Movie] = []
+        self.features = np.zeros((0, 0), dtype=np.float32)
+        self._n_genres = 0
+        self.quality = np.zeros(0, dtype=np.float32)
+        # username -> (favorites version, matrix version, movie indexes best first)
+        self.rankings = TTLCache(RANKING_CACHE_SIZE, DAY)
+        pools.listeners.append(self.update_pool)
+
+    def update_pool(self, genre: str, movies: List[Movie]):
+        """Called by GenrePools after a pool was (re)loaded"""
+        self._pools[genre] = movies
+        self._rebuild()
+
+    def _rebuild(self):
+        unique: Dict[int, Movie] = {}
+        for pool in self._pools.values():
+            for movie in pool:
+                unique.setdefault(movie.id, movie)
+        movies = list(unique.values())
+
+        genre_rows, genre_codes, decade_rows, decade_codes = [], [], [], []
+        for row, movie in enumerate(movies):
+            for genre in movie.genres:
+                genre_rows.append(row)
+                genre_codes.append(self.genres.code(genre))
+            decade = decade_label(movie.release_date)
+            if decade:
+                decade_rows.append(row)
+                decade_codes.append(self.decades.code(decade))
+
+        # Genre columns first, then decades
+        n_genres = len(self.genres)
+        features = np.zeros((len(movies), n_genres + len(self.decades)), dtype=np.float32)
+        features[np.array(genre_rows, dtype=np.int64), np.array(genre_codes, dtype=np.int64)] = 1.0
+        decade_columns = n_genres + np.array(decade_codes, dtype=np.int64)
+        features[np.array(decade_rows, dtype=np.int64), decade_columns] = self.decade_weight
+        self._n_genres = n_genres
+        self.movies = movies
+        self.features = features
+        self.quality = np.array([movie.rating or 0.0 for movie in movies], dtype=np.float32) * RATING_WEIGHT
+        self.version += 1
+
+    def affinity(self, stats: FavoriteStats) -> np.ndarray:
+        """Share of the user's favorites per genre and per decade, in the matrix' columns"""
+        vector = np.zeros(self.features.shape[1], dtype=np.float32)
+        if not stats.total_movies:
+            return vector
+        n_genres = self._n_genres
+        for genre, count in stats.genre_counts.items():
+            code = self.genres.code(genre)
+            if code < n_genres:
+                vector[code] = count / stats.total_movies
+        for decade, count in stats.decade_counts.items():
+            code = n_genres + self.decades.code(decade)
+            if code < len(vector):
+                vector[code] = count / stats.total_movies
+        return vector
+
+    def ranking(self, user: User) -> np.ndarray:
+        """Indexes into self.movies of the movies the user hasn't saved, best fit first"""
+        cached = self.rankings.get(user.username)
+        if cached is not MISSING and cached[0] == user.stats.version and cached[1] == self.version:
+            return cached[2]
+        scores = self.features @ self.affinity(user.stats) + self.quality
+        saved = {movie.id for movie in user.favorites}
+        unsaved = np.fromiter((movie.id not in saved for movie in self.movies), dtype=bool, count=len(self.movies))
+        order = np.flatnonzero(unsaved)
+        order = order[np.argsort(-scores[order], kind="stable")]
+        self.rankings.set(user.username, (user.stats.version, self.version, order))
+        return order
+
+    def recommend(self, user: User, count: int, spread: int = RECOMMEND_SPREAD) -> List[Movie]:
+        """Up to count of the best count * spread movies for the user, best fit first"""
+        best = self.ranking(user)[:count * spread]
+        if len(best) > count:
+            best = best[sorted(random.sample(range(len(best)), count))]
+        return [self.movies[i] for i in best]
+
+    def stats(self) -> dict:
+        return {
+            "movies": len(self.movies),
+            "genres": len(self._pools),
+            "version": self.version,
+            "rankings": self.rankings.stats(),
+        }
+
+recommender = Recommender(genre_pools, list(GENRE_MAP))
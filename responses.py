@@ -0,0 +1,78 @@
+"""
+HTTP caching for the JSON API.
+
+Responses get an ETag so the browser can revalidate with If-None-Match
+and get a 304 Not Modified instead of the same payload again. Per-user
+responses use the favorites version as ETag, so a 304 can be sent
+without loading the user or serializing anything. Serialized bodies are
+kept in TTLCaches so a changed ETag only costs one serialization.
+"""
+import hashlib
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from pydantic_core import to_json
+
+from cache import DAY, TTLCache
+
+load_dotenv()
+
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "500"))
+USER_RESPONSE_CACHE_SIZE = int(os.getenv("USER_RESPONSE_CACHE_SIZE", "1000"))
+
+# Per-user data: only the browser may keep it, and it has to ask every time
+PRIVATE = "private, no-cache"
+# Search results are the same for everyone, so shared caches (proxies, CDN) may keep them too
+PUBLIC_SEARCH = f"public, max-age={SEARCH_CACHE_TTL}"
+
+# (normalized query, type, detail) -> (body, etag)
+search_responses = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+# (kind, username, favorites version) -> body, old versions just age out
+user_responses = TTLCache(USER_RESPONSE_CACHE_SIZE, DAY)
+
+def render(content) -> bytes:
+    """
+    JSON bytes straight from pydantic models (and dicts/lists of them), without
+    model_dump() copies or jsonable_encoder. Same JSON as FastAPI's JSONResponse.
+    """
+    return to_json(content)
+
+class ModelJSONResponse(JSONResponse):
+    """Opt-in response class for endpoints that return models, serialized with render()"""
+
+    def render(self, content) -> bytes:
+        return render(content)
+
+def body_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+def user_etag(kind: str, username: str, version: int) -> str:
+    # Weak: the same version always means the same data, not necessarily the same bytes
+    user = hashlib.blake2b(username.encode("utf-8"), digest_size=6).hexdigest()
+    return f'W/"{kind}-{user}-{version}"'
+
+def etag_matches(request: Request, etag: Optional[str]) -> bool:
+    """If-None-Match check, with the weak comparison RFC 9110 asks for"""
+    header = request.headers.get("if-none-match")
+    if not header or not etag:
+        return False
+    if header.strip() == "*":
+        return True
+    wanted = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == wanted for tag in header.split(","))
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+def json_response(request: Request, body: bytes, etag: str, cache_control: str) -> Response:
+    """body, or 304 if the client already has this ETag"""
+    if etag_matches(request, etag):
+        return not_modified(etag, cache_control)
+    return Response(body, media_type="application/json", headers={"ETag": etag, "Cache-Control": cache_control})
+
+def stats() -> dict:
+    return {"search": search_responses.stats(), "user": user_responses.stats()}
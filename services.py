@@ -1,16 +1,26 @@
-import json
+import asyncio
 import os
-import httpx
-from typing import List, Optional
-from models import Movie, User
+import re
+from typing import AsyncIterator, List, Optional, Tuple
+from models import GENRE_CODES, FavoriteStats, Movie, User, decade_label, most_common, rating_total
+import upstream
+from upstream import UpstreamUnavailable, flights, get_client
+from cache import MISSING, movie_cache
+from catalog import catalog
+from storage import STORAGE_BACKEND, AsyncUserStore, CachedUserStore, TimedUserStore, create_store
 from dotenv import load_dotenv
 
 load_dotenv()
 
 API_KEY = os.getenv("API_KEY")
-BASE_URL = "https://api.themoviedb.org/3"
+BASE_URL = os.getenv("TMDB_BASE_URL", "https://api.themoviedb.org/3")
+OMDB_URL = os.getenv("OMDB_URL", "https://www.omdbapi.com/")
 OMDB_API_KEY = os.getenv("OMDB_API_KEY")
-DB_FILE = "users.json"
+# Max number of movies enriched at the same time (each one makes up to 3 requests)
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "8"))
+# Director search: movies returned, and how many discover pages to look through for them
+DIRECTOR_SEARCH_LIMIT = 10
+DIRECTOR_MAX_PAGES = int(os.getenv("DIRECTOR_MAX_PAGES", "3"))
 
 
 # --- MAP FOR GENRE (LET THIS BE AT THE TOP, PLEASE) ---
@@ -38,193 +48,697 @@ GENRE_MAP = {
 
 }
 
-async def search_movies_by_genre_async(genre_name: str) -> List[Movie]:
+# Favorites keep genres as codes, the TMDB genres get the first (smallest) ones
+for _genre in GENRE_MAP:
+    GENRE_CODES.code(_genre)
+
+async def search_movies_by_genre_async(genre_name: str, page: int = 1) -> List[Movie]:
     """
     This is for fetching movies from tmbd based on the genre name.
+    page picks which page of the popularity sorted discover results to use.
+    Concurrent calls for the same genre and page share one fetch.
     """
+    return await flights.do(("genre", genre_name, page), _search_movies_by_genre, genre_name, page)
+
+async def _search_movies_by_genre(genre_name: str, page: int) -> List[Movie]:
     genre_id = GENRE_MAP.get(genre_name)
     if not genre_id:
         return []
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            f"{BASE_URL}/discover/movie",
-            params={
-                "api_key": API_KEY,
-                "with_genres": genre_id,
-                "sort_by": "popularity.desc"
-            }
-        )
-
-        if resp.status_code != 200:
-            return []
+    return await enriched_page("/discover/movie", {
+        "with_genres": genre_id,
+        "sort_by": "popularity.desc",
+        "page": page
+    })
 
-        results = resp.json().get("results", [])[:20]
-        movies = []
+async def popular_movies(page: int = 1) -> List[Movie]:
+    """One page of TMDB's popular movies, enriched, used to warm the detail cache on startup"""
+    return await flights.do(("popular", page), enriched_page, "/movie/popular", {"page": page})
 
-        for item in results:
-            details = await fetch_movie_details(client, item["id"])
+async def enriched_page(path: str, params: dict) -> List[Movie]:
+    """
+    The movies of one TMDB list page (discover, popular), with details, also added to the catalog.
+    These are loaded in the background (genre pools, warm-up) for hundreds of movies, so they don't
+    ask OMDb: that would use up its daily quota before users get their ratings. The rating is TMDB's,
+    or the OMDb one if it is cached already.
+    """
+    client = get_client()
+    data = await tmdb_get(client, path, params)
 
-            movies.append(Movie(
-                id=item["id"],
-                title=item["title"],
-                release_date=item.get("release_date", "Unknown"),
-                rating=details.get("imdbRating") or item.get("vote_average", 0),
-                poster_url=f"https://image.tmdb.org/t/p/w342{item['poster_path']}" if item.get("poster_path") else None,
-                runtime=details.get("runtime", 0) or 0,
-                genres=[g["name"] for g in details.get("genres", [])],
-                director=details.get("director"),
-            ))
+    if data is None:
+        return []
+
+    results = data.get("results", [])[:20]
+    all_details = await enrich_movies(client, results, omdb=False)
 
-        return movies
+    movies = [build_movie(item, details) for item, details in zip(results, all_details)]
+    add_to_catalog(movies)
+    return movies
 
 # --- DATABASE ---
-def load_users() -> List[User]:
-    if not os.path.exists(DB_FILE):
-        return []
-    try:
-        with open(DB_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            return [User(**u) for u in data]
-    except:
-        return []
+# Backend is picked with STORAGE_BACKEND (sqlite by default, see storage.py).
+# Users are kept in memory between requests by the CachedUserStore,
+# backend calls are timed for /metrics. Opened on first use, so importing
+# this module doesn't create (or migrate) the database.
+_store: Optional[CachedUserStore] = None
+_async_store: Optional[AsyncUserStore] = None
+
+def get_store() -> CachedUserStore:
+    """Return the user store, opening it if the app was not started (scripts, shell)"""
+    global _store
+    if _store is None:
+        _store = CachedUserStore(TimedUserStore(create_store(), STORAGE_BACKEND))
+    return _store
+
+def get_async_store() -> AsyncUserStore:
+    """What the endpoints use: disk reads and writes run on the storage threads, never on the event loop"""
+    global _async_store
+    if _async_store is None:
+        _async_store = AsyncUserStore(get_store())
+    return _async_store
+
+def open_store():
+    """Called on app startup, so the first request doesn't open the database"""
+    get_async_store()
+
+async def close_store():
+    """Called on app shutdown"""
+    if _async_store is not None:
+        await _async_store.close()
+
+async def load_users() -> List[User]:
+    return await get_async_store().load_users()
+
+async def save_users(users: List[User]):
+    await get_async_store().save_users(users)
+
+async def get_user(username: str) -> Optional[User]:
+    return await get_async_store().get_user(username)
+
+async def get_favorites_version(username: str) -> Optional[int]:
+    """Changes every time the user's favorites change, None if there is no such user"""
+    return await get_async_store().favorites_version(username)
 
-def save_users(users: List[User]):
-    with open(DB_FILE, "w", encoding="utf-8") as f:
-        # Pydantic model_dump to convert models to dicts
-        json.dump([u.model_dump() for u in users], f, indent=2, ensure_ascii=False)
-
-def get_user(username: str) -> Optional[User]:
-    users = load_users()
-    for user in users:
-        if user.username == username:
-            return user
-    return None
-
-def update_user_favorites(username: str, new_favorites: List[Movie]):
-    users = load_users()
-    for user in users:
-        if user.username == username:
-            user.favorites = new_favorites
-            break
-    save_users(users)
+async def add_user(user: User) -> bool:
+    """Store a new user, returns False if the username is taken"""
+    return await get_async_store().add_user(user)
+
+async def update_user_favorites(username: str, new_favorites: List[Movie]):
+    await get_async_store().set_favorites(username, new_favorites)
+
+class FavoriteWriter:
+    """
+    Serializes favorite changes from concurrent requests. Changes that arrive
+    while a write is running are queued and applied together in the next write.
+    Writes run in their own task, so a request that is cancelled (client gone)
+    doesn't leave the other requests of its batch waiting.
+    """
+
+    def __init__(self):
+        self._pending = []  # (change, future)
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, change) -> bool:
+        return (await self.submit_many([change]))[0]
+
+    async def submit_many(self, changes) -> List[bool]:
+        """Queue several changes at once, they always end up in the same write"""
+        if not changes:
+            return []
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((list(changes), future))
+        if self._task is None:
+            self._task = asyncio.create_task(self._write_pending())
+        return await future
+
+    async def _write_pending(self):
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    results = await get_async_store().apply_changes([c for group, _ in batch for c in group])
+                except asyncio.CancelledError:
+                    for _, f in batch:
+                        f.cancel()
+                    raise
+                except Exception as e:
+                    for _, f in batch:
+                        if not f.done():
+                            f.set_exception(e)
+                else:
+                    start = 0
+                    for group, f in batch:
+                        # Done already if that request was cancelled, its changes are written anyway
+                        if not f.done():
+                            f.set_result(results[start:start + len(group)])
+                        start += len(group)
+        finally:
+            self._task = None
+            for _, f in self._pending:
+                f.cancel()
+            self._pending = []
+
+favorite_writer = FavoriteWriter()
+
+def has_details(movie) -> bool:
+    """False if the TMDB details of the movie couldn't be loaded (upstream down, rate limited)"""
+    return bool(movie.runtime and movie.genres)
+
+def add_to_catalog(movies: List[Movie]):
+    """Movies from TMDB into the catalog, only those whose details loaded count as enriched"""
+    catalog.add_many([m for m in movies if has_details(m)], enriched=True)
+    catalog.add_many([m for m in movies if not has_details(m)])
+
+async def add_favorite(username: str, movie: Movie) -> bool:
+    """Add a movie to the user's favorites, returns False if it was already there"""
+    return await favorite_writer.submit(("add", username, movie))
+
+async def remove_favorite(username: str, movie_id: int) -> bool:
+    """Remove a movie from the user's favorites, returns False if it wasn't there"""
+    return await favorite_writer.submit(("remove", username, movie_id))
+
+async def update_favorites(username: str, add: List[Movie] = (), remove: List[int] = ()) -> Tuple[List[bool], List[bool]]:
+    """
+    Bulk version of add_favorite/remove_favorite in a single write. Removes go
+    first, so a movie can be removed and added again in one call.
+    Returns one bool per removed id and per added movie.
+    """
+    changes = [("remove", username, movie_id) for movie_id in remove]
+    changes += [("add", username, movie) for movie in add]
+    results = await favorite_writer.submit_many(changes)
+    return results[:len(remove)], results[len(remove):]
 
 # --- TMDB & OMDB LOGIC (Async) ---
-async def fetch_movie_details(client, movie_id):
-    """HHelper function to fetch details (runtime/genres/director/omdb rating)"""
-    resp = await client.get(f"{BASE_URL}/movie/{movie_id}", params={"api_key": API_KEY})
+# Metric labels of the TMDB paths we call
+TMDB_ENDPOINTS = {
+    "/movie/{id}": "details",
+    "/movie/{id}/credits": "credits",
+    "/discover/movie": "discover",
+    "/search/movie": "search",
+    "/search/person": "person",
+    "/movie/popular": "popular",
+}
+
+def tmdb_endpoint(path: str) -> str:
+    """'/movie/603/credits' -> 'credits'"""
+    template = re.sub(r"/\d+", "/{id}", path)
+    return TMDB_ENDPOINTS.get(template, template)
+
+async def tmdb_get(client, path: str, params: Optional[dict] = None) -> Optional[dict]:
+    """GET a TMDB endpoint (rate limited, retried), returns the JSON or None if it failed"""
+    try:
+        return await tmdb_fetch(client, path, params)
+    except UpstreamUnavailable:
+        return None
+
+async def tmdb_fetch(client, path: str, params: Optional[dict] = None) -> Optional[dict]:
+    """Like tmdb_get, but only returns None for a 404 and raises UpstreamUnavailable when TMDB couldn't answer"""
+    resp = await upstream.get("tmdb", f"{BASE_URL}{path}", {"api_key": API_KEY, **(params or {})}, client,
+                              endpoint=tmdb_endpoint(path))
     if resp.status_code == 200:
-        data = resp.json()
-        
-        # Fetch director from credits
-        credits_resp = await client.get(f"{BASE_URL}/movie/{movie_id}/credits", params={"api_key": API_KEY})
-        if credits_resp.status_code == 200:
-            credits = credits_resp.json()
-            crew = credits.get("crew", [])
-            director = next((person["name"] for person in crew if person.get("job") == "Director"), None)
-            data["director"] = director
-        
-        # Fetch OMDB rating via IMDb ID
-        imdb_id = data.get("imdb_id")
-        if imdb_id and OMDB_API_KEY:
-            omdb_resp = await client.get("https://www.omdbapi.com/", params={"i": imdb_id, "apikey": OMDB_API_KEY})
-            if omdb_resp.status_code == 200:
-                omdb_data = omdb_resp.json()
-                if "imdbRating" in omdb_data and omdb_data["imdbRating"] != "N/A":
-                    try:
-                        data["imdbRating"] = float(omdb_data["imdbRating"])
-                    except:
-                        pass
-        
-        return data
-    return {}
+        return resp.json()
+    if resp.status_code == 404:
+        return None
+    raise UpstreamUnavailable(f"tmdb answered {resp.status_code}")
+
+async def omdb_get(client, params: dict) -> Optional[dict]:
+    """GET from OMDb (rate limited, retried, daily quota), returns the JSON or None if it failed"""
+    try:
+        resp = await upstream.get("omdb", OMDB_URL, {"apikey": OMDB_API_KEY, **params}, client, endpoint="rating")
+    except UpstreamUnavailable:
+        return None
+    return resp.json() if resp.status_code == 200 else None
+
+# Fields kept from the TMDB details response in the cache
+DETAIL_FIELDS = ("id", "title", "release_date", "poster_path", "vote_average", "runtime", "genres", "imdb_id")
+
+async def fetch_movie_details(client, movie_id, omdb: bool = True):
+    """HHelper function to fetch details (runtime/genres/director/omdb rating), omdb=False only uses a cached rating"""
+    try:
+        return await load_movie_details(client, movie_id, omdb)
+    except UpstreamUnavailable:
+        return {}
+
+async def load_movie_details(client, movie_id, omdb: bool = True):
+    """
+    Like fetch_movie_details, but tells the two ways of getting nothing apart:
+    {} when TMDB doesn't know the movie, UpstreamUnavailable when TMDB
+    couldn't answer and there is no cached copy either.
+    """
+    return await flights.do(("details", movie_id, omdb), _fetch_movie_details, client, movie_id, omdb)
+
+async def _fetch_movie_details(client, movie_id, omdb: bool):
+    data = await movie_cache.get("details", movie_id)
+    if data is MISSING:
+        unavailable = None
+        try:
+            full = await tmdb_fetch(client, f"/movie/{movie_id}")
+        except UpstreamUnavailable as e:
+            full, unavailable = None, e
+        if full is not None:
+            data = {key: full[key] for key in DETAIL_FIELDS if key in full}
+            movie_cache.set("details", movie_id, data)
+        else:
+            # Upstream failed, an expired copy is better than nothing
+            data = await movie_cache.get_stale("details", movie_id)
+            if data is MISSING:
+                if unavailable is not None:
+                    raise unavailable
+                return {}
+    data = dict(data)
+
+    # Credits and OMDB only depend on the details, so fetch them side by side
+    director, imdb_rating = await asyncio.gather(
+        fetch_director(client, movie_id),
+        fetch_omdb_rating(client, movie_id, data.get("imdb_id"), fetch=omdb),
+    )
+    if director is not None:
+        data["director"] = director
+    if imdb_rating is not None:
+        data["imdbRating"] = imdb_rating
+
+    return data
+
+async def fetch_director(client, movie_id) -> Optional[str]:
+    """Fetch director from credits"""
+    director = await movie_cache.get("director", movie_id)
+    if director is not MISSING:
+        return director
+
+    credits = await tmdb_get(client, f"/movie/{movie_id}/credits")
+    if credits is None:
+        director = await movie_cache.get_stale("director", movie_id)
+        return None if director is MISSING else director
+    crew = credits.get("crew", [])
+    director = next((person["name"] for person in crew if person.get("job") == "Director"), None)
+    movie_cache.set("director", movie_id, director)
+    return director
+
+async def fetch_omdb_rating(client, movie_id, imdb_id, fetch: bool = True) -> Optional[float]:
+    """Fetch OMDB rating via IMDb ID, fetch=False only looks in the cache"""
+    if not imdb_id or not OMDB_API_KEY:
+        return None
+    rating = await movie_cache.get("imdbRating", movie_id)
+    if rating is not MISSING:
+        return rating
+
+    omdb_data = await omdb_get(client, {"i": imdb_id}) if fetch else None
+    if omdb_data is None:
+        rating = await movie_cache.get_stale("imdbRating", movie_id)
+        return None if rating is MISSING else rating
+    rating = None
+    if "imdbRating" in omdb_data and omdb_data["imdbRating"] != "N/A":
+        try:
+            rating = float(omdb_data["imdbRating"])
+        except:
+            pass
+    movie_cache.set("imdbRating", movie_id, rating)
+    return rating
+
+async def enrich_movies(client, items, limit: Optional[int] = None, omdb: bool = True) -> List[dict]:
+    """
+    Fetch details for every search result concurrently, with at most `limit`
+    movies in flight. The returned list has the same order as items.
+    """
+    semaphore = asyncio.Semaphore(limit or MAX_CONCURRENT_REQUESTS)
+
+    async def fetch(item):
+        async with semaphore:
+            return await fetch_movie_details(client, item["id"], omdb)
+
+    return await asyncio.gather(*(fetch(item) for item in items))
+
+def build_movie(item: dict, details: dict, director: Optional[str] = None) -> Movie:
+    """Build a Movie from a TMDB search/discover result and its fetched details"""
+    return Movie(
+        id=item["id"],
+        title=item["title"],
+        release_date=item.get("release_date", "Unknown"),
+        rating=details.get("imdbRating") or item.get("vote_average", 0),
+        poster_url=f"https://image.tmdb.org/t/p/w342{item['poster_path']}" if item.get("poster_path") else None,
+        runtime=details.get("runtime", 0) or 0,
+        genres=[g["name"] for g in details.get("genres", [])],
+        director=director or details.get("director"),
+    )
 
 async def search_movies_async(query: str) -> List[Movie]:
     if not query: 
         return []
     
-    async with httpx.AsyncClient() as client:
-        # 1. Search movies
-        resp = await client.get(f"{BASE_URL}/search/movie", params={"api_key": API_KEY, "query": query})
-        if resp.status_code != 200: return []
-        
-        results = resp.json().get("results", [])[:10] # Limit to 10
-        movies = []
-
-        # 2. Loop and build Movie objects
-        for item in results:
-            details = await fetch_movie_details(client, item["id"])
-            
-            movies.append(Movie(
-                id=item["id"],
-                title=item["title"],
-                release_date=item.get("release_date", "Unknown"),
-                rating=details.get("imdbRating") or item.get("vote_average", 0),
-                poster_url=f"https://image.tmdb.org/t/p/w342{item['poster_path']}" if item.get('poster_path') else None,
-                runtime=details.get("runtime", 0) or 0,
-                genres=[g["name"] for g in details.get("genres", [])],
-                director=details.get("director"),
-            ))
-        return movies
+    client = get_client()
+    # 1. Search movies
+    data = await tmdb_get(client, "/search/movie", {"query": query})
+    if data is None: return []
+    
+    results = data.get("results", [])[:10] # Limit to 10
+
+    # 2. Enrich concurrently and build Movie objects
+    all_details = await enrich_movies(client, results)
+    return [build_movie(item, details) for item, details in zip(results, all_details)]
+
+# Upstream requests made by director searches, served at /api/stats/upstream
+director_search_stats = {"queries": 0, "upstream_calls": 0, "last_query_calls": 0}
 
 async def search_movies_by_director_async(director_name: str) -> List[Movie]:
     """Search for movies by director name"""
     if not director_name:
         return []
+
+    with upstream.count_calls() as calls:
+        movies = await _search_movies_by_director(director_name)
+    record_director_search(calls)
+    return movies
+
+def record_director_search(calls: dict):
+    director_search_stats["queries"] += 1
+    director_search_stats["upstream_calls"] += sum(calls.values())
+    director_search_stats["last_query_calls"] = sum(calls.values())
+
+async def _search_movies_by_director(director_name: str) -> List[Movie]:
+    client = get_client()
+    # 1. Search for director
+    director_id = await find_person_id(client, director_name)
+    if not director_id: return []
+
+    # 2. Movies where the director is confirmed by the credits
+    hits = await find_director_movies(client, director_id, director_name)
+
+    # 3. Full details and OMDb rating only for the confirmed movies
+    all_details = await enrich_movies(client, [item for item, _ in hits])
+    return [build_movie(item, details, director) for (item, director), details in zip(hits, all_details)]
+
+async def find_person_id(client, name: str) -> Optional[int]:
+    """TMDB id of the first person matching name"""
+    person_data = await tmdb_get(client, "/search/person", {"query": name})
+    if person_data is None: return None
     
-    async with httpx.AsyncClient() as client:
-        # 1. Search for director
-        person_resp = await client.get(f"{BASE_URL}/search/person", params={"api_key": API_KEY, "query": director_name})
-        if person_resp.status_code != 200: return []
-        
-        people = person_resp.json().get("results", [])
-        if not people: return []
-        
-        # Get the first person ID
-        director_id = people[0].get("id")
-        if not director_id: return []
-        
-        # 2. Search for movies by this director
-        movies_resp = await client.get(f"{BASE_URL}/discover/movie", params={
-            "api_key": API_KEY,
+    people = person_data.get("results", [])
+    if not people: return None
+    
+    # Get the first person ID
+    return people[0].get("id")
+
+async def find_director_movies(client, director_id: int, director_name: str) -> List[tuple]:
+    """All confirmed hits of director_hits() as a list of (item, director)"""
+    return [hit async for hit in director_hits(client, director_id, director_name)]
+
+async def director_hits(client, director_id: int, director_name: str) -> AsyncIterator[tuple]:
+    """
+    Go through this person's movies page by page, checking the director with
+    the credits call only, until we have enough confirmed hits. Yields
+    (item, director) for each hit as soon as it is confirmed.
+    """
+    found = 0
+    page, total_pages = 1, 1
+    while found < DIRECTOR_SEARCH_LIMIT and page <= min(total_pages, DIRECTOR_MAX_PAGES):
+        movies_data = await tmdb_get(client, "/discover/movie", {
             "with_crew": director_id,
-            "sort_by": "popularity.desc"
+            "sort_by": "popularity.desc",
+            "page": page
         })
-        if movies_resp.status_code != 200: return []
-        
-        results = movies_resp.json().get("results", [])[:20]  
-        movies = []
-        
-        for item in results:
-            if len(movies) >= 10: 
-                break
-                
-            details = await fetch_movie_details(client, item["id"])
-            
-            # Only include if the director fetched matches the search
-            fetched_director = details.get("director")
-            if fetched_director and director_name.lower() in fetched_director.lower():
-                movies.append(Movie(
-                    id=item["id"],
-                    title=item["title"],
-                    release_date=item.get("release_date", "Unknown"),
-                    rating=details.get("imdbRating") or item.get("vote_average", 0),
-                    poster_url=f"https://image.tmdb.org/t/p/w342{item['poster_path']}" if item.get('poster_path') else None,
-                    runtime=details.get("runtime", 0) or 0,
-                    genres=[g["name"] for g in details.get("genres", [])],
-                    director=fetched_director,
-                ))
-        return movies
+        if movies_data is None: break
+        total_pages = movies_data.get("total_pages", 1)
+        page += 1
+
+        results = movies_data.get("results", [])
+        async for hit in verify_directors(client, results, director_name, DIRECTOR_SEARCH_LIMIT - found):
+            found += 1
+            yield hit
+
+async def verify_directors(client, results: List[dict], director_name: str, wanted: int) -> AsyncIterator[tuple]:
+    """
+    Check the director of every result concurrently and yield the first `wanted`
+    matches (in result order) as (item, director), each as soon as the results
+    before it are checked too. Checks still running are cancelled once those
+    first matches are known.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    verdicts = [None] * len(results)  # None = still checking, else the director ("" = no match)
+
+    async def check(index, item):
+        async with semaphore:
+            director = await fetch_director(client, item["id"])
+        matches = director and director_name.lower() in director.lower()
+        return index, director if matches else ""
+
+    tasks = [asyncio.ensure_future(check(i, item)) for i, item in enumerate(results)]
+    settled = 0  # results before this one are checked (and their hits sent)
+    sent = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, director = await next_done
+            verdicts[index] = director
+
+            # Hits are only final up to the first result that is still being checked
+            while settled < len(results) and verdicts[settled] is not None:
+                if verdicts[settled]:
+                    yield results[settled], verdicts[settled]
+                    sent += 1
+                    if sent >= wanted:
+                        return
+                settled += 1
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def normalize_query(query: str) -> str:
+    """Case and whitespace don't change the results, so they don't change cache keys either"""
+    return " ".join(query.lower().split())
 
 async def search_movies(query: str, search_type: str = "film") -> List[Movie]:
     """Unified search function that routes to title or director search"""
     if not query:
         return []
-    
+    local = catalog.lookup(search_type, query, enriched=True)
+    if local is not None:
+        return local
+    # Identical searches running at the same time share one upstream fan-out
+    key = ("search", search_type, normalize_query(query))
+    return await flights.do(key, _search_movies, query, search_type)
+
+async def _search_movies(query: str, search_type: str) -> List[Movie]:
+    if search_type == "director":
+        movies = await search_movies_by_director_async(query)
+    else:
+        movies = await search_movies_async(query)
+    # No results or missing details can also mean TMDB was down, don't remember that
+    if movies and all(has_details(m) for m in movies):
+        catalog.remember(search_type, query, movies, enriched=True)
+    else:
+        add_to_catalog(movies)
+    return movies
+
+async def search_movies_summary(query: str, search_type: str = "film") -> List[Movie]:
+    """
+    Lightweight search: only what the TMDB search call itself returns (no runtime,
+    genres or OMDb rating). Director searches still check the director with the
+    credits call, but skip details and OMDb. get_movie() fills in the rest later.
+    """
+    if not query:
+        return []
+    local = catalog.lookup(search_type, query)
+    if local is not None:
+        return local
+    key = ("summary", search_type, normalize_query(query))
+    movies = await flights.do(key, _search_movies_summary, query, search_type)
+    if movies:
+        catalog.remember(search_type, query, movies)
+    return movies
+
+async def _search_movies_summary(query: str, search_type: str) -> List[Movie]:
+    client = get_client()
+    if search_type != "director":
+        data = await tmdb_get(client, "/search/movie", {"query": query})
+        results = data.get("results", [])[:10] if data else []
+        return [build_movie(item, {}) for item in results]
+
+    director_id = await find_person_id(client, query)
+    if not director_id:
+        return []
+    hits = await find_director_movies(client, director_id, query)
+    return [build_movie(item, {}, director) for item, director in hits]
+
+async def get_movie(movie_id: int) -> Optional[Movie]:
+    """
+    One fully enriched movie (details, director, OMDb rating), served from the
+    detail cache when possible. None if TMDB doesn't know the movie, raises
+    UpstreamUnavailable if TMDB is down and the movie isn't cached.
+    """
+    details = await load_movie_details(get_client(), movie_id)
+    if not details.get("title"):
+        return None
+    movie = build_movie(details, details)
+    add_to_catalog([movie])
+    return movie
+
+async def find_movie(title: str, year: Optional[int] = None) -> Optional[Movie]:
+    """Best TMDB match for a title (and release year), with only what the search returns"""
+    params = {"query": title}
+    if year:
+        params["year"] = year
+    data = await flights.do(("find", normalize_query(title), year), tmdb_get, get_client(), "/search/movie", params)
+    results = data.get("results") if data else None
+    return build_movie(results[0], {}) if results else None
+
+# Fields that are filled in once a streamed movie has been enriched
+DETAIL_PATCH_FIELDS = ("rating", "runtime", "genres", "director")
+
+def patch_event(basic: Movie, enriched: Movie) -> Optional[dict]:
+    """{"event": "patch"} with the fields enriching a streamed movie changed, None if nothing did"""
+    full, before = enriched.model_dump(), basic.model_dump()
+    changes = {key: full[key] for key in DETAIL_PATCH_FIELDS if full[key] != before[key]}
+    return {"event": "patch", "id": basic.id, "changes": changes} if changes else None
+
+async def stream_search_movies(query: str, search_type: str = "film", summary: bool = False) -> AsyncIterator[dict]:
+    """
+    Search events for /api/search/stream. Title searches send every movie
+    from the basic TMDB search right away ({"event": "movie"}), then a
+    {"event": "patch"} with the details of each movie as soon as it is enriched.
+    Director searches send each movie once its director is confirmed, and its
+    patch once its details are loaded. With summary=True no details are
+    fetched at all. Ends with {"event": "done"}.
+    """
+    if not query:
+        yield {"event": "done"}
+        return
+
     if search_type == "director":
-        return await search_movies_by_director_async(query)
+        async for event in stream_director_search(query, summary):
+            yield event
+        return
+
+    if summary:
+        for movie in await search_movies_summary(query, search_type):
+            yield {"event": "movie", "movie": movie.model_dump()}
+        yield {"event": "done"}
+        return
+
+    local = catalog.lookup(search_type, query, enriched=True)
+    if local is not None:
+        for movie in local:
+            yield {"event": "movie", "movie": movie.model_dump()}
+        yield {"event": "done"}
+        return
+
+    client = get_client()
+    data = await tmdb_get(client, "/search/movie", {"query": query})
+    results = data.get("results", [])[:10] if data else []
+
+    basic = {}
+    enriched = {}
+    for item in results:
+        basic[item["id"]] = build_movie(item, {})
+        yield {"event": "movie", "movie": basic[item["id"]].model_dump()}
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def enrich(item):
+        async with semaphore:
+            return item, await fetch_movie_details(client, item["id"])
+
+    tasks = [asyncio.ensure_future(enrich(item)) for item in results]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item, details = await next_done
+            enriched[item["id"]] = build_movie(item, details)
+            patch = patch_event(basic[item["id"]], enriched[item["id"]])
+            if patch:
+                yield patch
+    finally:
+        # The client went away, don't keep enriching for nobody
+        for task in tasks:
+            task.cancel()
+    movies = [enriched[item["id"]] for item in results if item["id"] in enriched]
+    if results and len(movies) == len(results) and all(has_details(m) for m in movies):
+        catalog.remember(search_type, query, movies, enriched=True)
     else:
-        return await search_movies_async(query)
+        add_to_catalog(movies)
+    yield {"event": "done"}
+
+async def stream_director_search(query: str, summary: bool) -> AsyncIterator[dict]:
+    """
+    Director search events for stream_search_movies(). The search runs as a
+    task that sends each hit over a queue as soon as director_hits() confirms
+    it, and (unless summary) starts fetching its details, which come back over
+    the same queue.
+    """
+    local = catalog.lookup("director", query, enriched=not summary)
+    if local is not None:
+        for movie in local:
+            yield {"event": "movie", "movie": movie.model_dump()}
+        yield {"event": "done"}
+        return
+
+    client = get_client()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    # ("hit", item, director), ("details", item, details), None once every hit is found
+    events: asyncio.Queue = asyncio.Queue()
+    tasks = []
+    calls = {}
+
+    async def enrich(item):
+        details = {}
+        try:
+            async with semaphore:
+                details = await fetch_movie_details(client, item["id"])
+        finally:
+            events.put_nowait(("details", item, details))
+
+    async def find():
+        nonlocal calls
+        try:
+            # Started from here, the detail fetches are counted too
+            with upstream.count_calls() as calls:
+                director_id = await find_person_id(client, query)
+                if director_id:
+                    async for item, director in director_hits(client, director_id, query):
+                        events.put_nowait(("hit", item, director))
+                        if not summary:
+                            tasks.append(asyncio.ensure_future(enrich(item)))
+        finally:
+            events.put_nowait(None)
+
+    tasks.append(asyncio.ensure_future(find()))
+    hits, basic, enriched = [], {}, {}
+    finding, waiting = True, 0
+    try:
+        while finding or waiting:
+            event = await events.get()
+            if event is None:
+                finding = False
+                continue
+            kind, item, value = event
+            if kind == "hit":
+                hits.append(item)
+                basic[item["id"]] = build_movie(item, {}, value)
+                if not summary:
+                    waiting += 1
+                yield {"event": "movie", "movie": basic[item["id"]].model_dump()}
+            else:
+                waiting -= 1
+                enriched[item["id"]] = build_movie(item, value, basic[item["id"]].director)
+                patch = patch_event(basic[item["id"]], enriched[item["id"]])
+                if patch:
+                    yield patch
+        tasks[0].result()  # raises what the search raised
+    finally:
+        # The client went away, don't keep searching for nobody
+        for task in tasks:
+            task.cancel()
+
+    if summary:
+        movies = [basic[item["id"]] for item in hits]
+        if movies:
+            catalog.remember("director", query, movies)
+    else:
+        record_director_search(calls)
+        movies = [enriched[item["id"]] for item in hits]
+        # No results or missing details can also mean TMDB was down, don't remember that
+        if movies and all(has_details(m) for m in movies):
+            catalog.remember("director", query, movies, enriched=True)
+        else:
+            add_to_catalog(movies)
+    yield {"event": "done"}
 
 def calculate_wrapped_stats(favorites: List[Movie]) -> dict:
     """Calculate wrapped statistics from favorite movies"""
@@ -245,33 +759,18 @@ def calculate_wrapped_stats(favorites: List[Movie]) -> dict:
         all_genres.extend(m.genres)
     
     from collections import Counter
-    most_common = Counter(all_genres).most_common(1)
-    top_genre = most_common[0][0] if most_common else "Unknown"
+    top_genre = most_common(Counter(all_genres)) or "Unknown"
     
-    avg_rating = sum(m.rating for m in favorites) / len(favorites)
+    avg_rating = rating_total(sum(m.rating for m in favorites)) / len(favorites)
 
     decades = {}
 
     for movie in favorites:
-        release_date = movie.release_date
-        print("TITLE:", movie.title)
-        print("RELEASE_DATE:", release_date)
-
-        if not release_date:
-            continue
+        label = decade_label(movie.release_date)
+        if label:
+            decades[label] = decades.get(label, 0) + 1
 
-        try:
-            year = int(str(release_date)[:4])
-        except (ValueError, TypeError):
-            continue
-
-        decade = (year // 10) * 10
-        label = f"{decade}s"
-        decades[label] = decades.get(label, 0) + 1
-
-    print("DECADES:", decades)
-
-    top_decade = max(decades, key=decades.get) if decades else None
+    top_decade = most_common(decades)
     
     return {
         "hours": total_minutes // 60,
@@ -282,4 +781,22 @@ def calculate_wrapped_stats(favorites: List[Movie]) -> dict:
         "rated_movies": len(favorites),
         "top_decade": top_decade,
         "decade_breakdown": decades
-    }
\ No newline at end of file
+    }
+
+def wrapped_stats_from_aggregate(stats: FavoriteStats) -> dict:
+    """Same result as calculate_wrapped_stats, but read from the running totals stored with the user"""
+    if not stats.total_movies:
+        return calculate_wrapped_stats([])
+
+    genres = stats.genre_counts
+    decades = dict(stats.decade_counts)
+    return {
+        "hours": stats.total_minutes // 60,
+        "minutes": stats.total_minutes % 60,
+        "total_movies": stats.total_movies,
+        "most_common_genre": most_common(genres) or "Unknown",
+        "average_rating": round(rating_total(stats.rating_sum) / stats.total_movies, 1),
+        "rated_movies": stats.total_movies,
+        "top_decade": most_common(decades),
+        "decade_breakdown": decades
+    }
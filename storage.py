@@ -0,0 +1,800 @@
+"""
+Storage backends for users and their favorites.
+
+services.py talks to one UserStore. The default is SQLite (WAL mode,
+users looked up by username, favorites keyed by (username, movie_id)),
+so reading or updating one user does not touch the rest of the user
+base. The old users.json format is still available as JsonUserStore.
+
+The app itself uses AsyncUserStore, which runs every call that may touch
+the disk on a dedicated thread pool so the event loop never waits on it.
+
+Favorite changes go through apply_changes(), which applies a batch of
+adds/removes in one write. Writers are serialized across processes
+(a SQLite write transaction, or a lock file next to users.json) and the
+JSON file is replaced atomically, so concurrent workers can't lose each
+other's updates or leave a half-written file behind.
+
+One-shot migration from users.json:
+    python storage.py migrate [users.json] [users.db]
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+from pydantic import TypeAdapter
+from models import FavoriteMovie, FavoriteStats, Movie, User
+import metrics
+
+load_dotenv()
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+USERS_DB_FILE = os.getenv("USERS_DB_FILE", "users.db")
+JSON_DB_FILE = "users.json"
+# Threads running store calls for the event loop. Writes are serialized anyway,
+# the others keep reads going while a write commits
+STORAGE_THREADS = int(os.getenv("STORAGE_THREADS", "4"))
+
+# A favorite change: ("add", username, Movie) or ("remove", username, movie_id)
+Change = Tuple[str, str, object]
+
+class StorageError(Exception):
+    """The stored data could not be read"""
+
+@contextmanager
+def file_lock(path: str):
+    """Exclusive lock shared by every process that uses the same path"""
+    with open(path + ".lock", "a+") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def atomic_write_json(path: str, data: bytes):
+    """Write already serialized JSON to a temp file in the same folder, then rename it over path"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+class UserStore(ABC):
+    """Interface for the storage backends, a backend missing a method can't be created"""
+
+    @abstractmethod
+    def load_users(self) -> List[User]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_users(self, users: List[User]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user(self, username: str) -> Optional[User]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_user(self, user: User) -> bool:
+        """Store a new user, returns False if the username is taken"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_favorites(self, username: str, favorites: List[Movie]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def apply_changes(self, changes: Sequence[Change]) -> List[bool]:
+        """
+        Apply favorite adds/removes in order, in a single write.
+        Returns one bool per change: True if it was added/removed,
+        False if the movie was already there/missing or the user doesn't exist.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def version(self):
+        """Token that changes when another process (or connection) has changed the data"""
+        raise NotImplementedError
+
+    def peek_version(self):
+        """version() if it can be read without waiting on a lock or the disk, else None"""
+        return None
+
+    def favorites_version(self, username: str) -> Optional[int]:
+        """Version of the user's favorites (FavoriteStats.version), None if the user doesn't exist"""
+        user = self.get_user(username)
+        return user.stats.version if user else None
+
+    def favorite_rows(self) -> Iterator[tuple]:
+        """
+        Every favorite as (username, movie_id, release_date, rating, runtime, genres),
+        grouped by user in list order. Users without favorites get one row with movie_id None.
+        Used by analytics.py, so it avoids building models where it can; rows may share
+        one genres list, callers must not change it.
+        """
+        for user in self.load_users():
+            if not user.favorites:
+                yield (user.username, None, None, 0.0, 0, [])
+            for m in user.favorites:
+                yield (user.username, m.id, m.release_date, m.rating, m.runtime, m.genres)
+
+    def close(self):
+        pass
+
+# users.json is parsed and written in one go, without json.load/dump and per-user dicts
+USERS_JSON = TypeAdapter(List[User])
+
+class JsonUserStore(UserStore):
+    """All users in one JSON file, every call reads or rewrites the whole file"""
+
+    def __init__(self, path: str = JSON_DB_FILE):
+        self.path = path
+        self._seen_stat = self._stat()
+        self._external_changes = 0
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            return None
+
+    def version(self) -> int:
+        # Any file change we didn't make ourselves counts as an external change
+        stat = self._stat()
+        if stat != self._seen_stat:
+            self._seen_stat = stat
+            self._external_changes += 1
+        return self._external_changes
+
+    def load_users(self) -> List[User]:
+        if not os.path.exists(self.path):
+            return []
+        try:
+            # Timed apart, to tell file I/O from pydantic validation
+            with metrics.storage_duration.time("json", "read_file", span_name="storage.read_file"):
+                with open(self.path, "rb") as f:
+                    data = f.read()
+            with metrics.storage_duration.time("json", "validate", span_name="storage.validate"):
+                return USERS_JSON.validate_json(data)
+        except (ValueError, TypeError) as e:
+            # Don't treat a broken file as empty, the next save would wipe every user
+            raise StorageError(f"Could not read {self.path}: {e}")
+
+    def _write(self, users: List[User]):
+        """Must be called with the file lock held"""
+        self.version()  # pick up changes from other processes before our own write hides them
+        # Straight to bytes, compact (no indent) since the file is rewritten on every change
+        with metrics.storage_duration.time("json", "serialize", span_name="storage.serialize"):
+            data = USERS_JSON.dump_json(users)
+        with metrics.storage_duration.time("json", "write_file", span_name="storage.write_file"):
+            atomic_write_json(self.path, data)
+        self._seen_stat = self._stat()
+
+    def save_users(self, users: List[User]):
+        with file_lock(self.path):
+            self._write(users)
+
+    def get_user(self, username: str) -> Optional[User]:
+        for user in self.load_users():
+            if user.username == username:
+                return user
+        return None
+
+    def add_user(self, user: User) -> bool:
+        with file_lock(self.path):
+            users = self.load_users()
+            if any(u.username == user.username for u in users):
+                return False
+            users.append(user)
+            self._write(users)
+            return True
+
+    def set_favorites(self, username: str, favorites: List[Movie]):
+        with file_lock(self.path):
+            users = self.load_users()
+            for user in users:
+                if user.username == username:
+                    user.favorites = [FavoriteMovie.of(m) for m in favorites]
+                    user.stats = user.stats.replace(favorites)
+                    break
+            self._write(users)
+
+    def apply_changes(self, changes: Sequence[Change]) -> List[bool]:
+        with file_lock(self.path):
+            users = {u.username: u for u in self.load_users()}
+            by_id = {}  # username -> {movie_id: FavoriteMovie} for the users this batch touches
+            results = []
+            for action, username, value in changes:
+                user = users.get(username)
+                if user is None:
+                    results.append(False)
+                    continue
+                movies = by_id.get(username)
+                if movies is None:
+                    movies = by_id[username] = {m.id: m for m in user.favorites}
+
+                if action == "add":
+                    value = FavoriteMovie.of(value)
+                    exists = value.id in movies
+                    if not exists:
+                        movies[value.id] = value
+                        user.favorites.append(value)
+                        user.stats.add(value)
+                    results.append(not exists)
+                else:
+                    removed = movies.pop(value, None)
+                    if removed is not None:
+                        user.stats.remove(removed)
+                    results.append(removed is not None)
+            if any(results):
+                # One pass per user drops everything removed above (a removed then re-added movie is a new object)
+                for username, movies in by_id.items():
+                    user = users[username]
+                    if len(movies) != len(user.favorites):
+                        user.favorites = [m for m in user.favorites if movies.get(m.id) is m]
+                self._write(list(users.values()))
+            return results
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    stats TEXT
+);
+CREATE TABLE IF NOT EXISTS favorites (
+    username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+    movie_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    poster_url TEXT,
+    release_date TEXT,
+    rating REAL NOT NULL DEFAULT 0,
+    director TEXT,
+    runtime INTEGER NOT NULL DEFAULT 0,
+    genres TEXT NOT NULL DEFAULT '[]',
+    imdb_rating REAL,
+    PRIMARY KEY (username, movie_id)
+);
+CREATE INDEX IF NOT EXISTS favorites_by_position ON favorites (username, position);
+"""
+
+FAVORITE_COLUMNS = "movie_id, title, poster_url, release_date, rating, director, runtime, genres, imdb_rating"
+
+def movie_to_row(username: str, position: int, movie: Movie) -> tuple:
+    return (
+        username, position, movie.id, movie.title, movie.poster_url, movie.release_date,
+        movie.rating, movie.director, movie.runtime, json.dumps(movie.genres), movie.imdbRating,
+    )
+
+def row_to_favorite(row) -> FavoriteMovie:
+    return FavoriteMovie(
+        id=row[0], title=row[1], poster_url=row[2], release_date=row[3], rating=row[4],
+        director=row[5], runtime=row[6], genres=json.loads(row[7]), imdbRating=row[8],
+    )
+
+class SqliteUserStore(UserStore):
+    """Users and favorites in SQLite, reads and writes only touch one user's rows"""
+
+    def __init__(self, path: str = USERS_DB_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        # timeout: how long to wait for another process' write transaction
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(users)")]
+        if "stats" not in columns:
+            # Databases created before stats were stored with the user
+            self._conn.execute("ALTER TABLE users ADD COLUMN stats TEXT")
+            self._conn.commit()
+
+    def _favorites(self, username: str) -> List[FavoriteMovie]:
+        rows = self._conn.execute(
+            f"SELECT {FAVORITE_COLUMNS} FROM favorites WHERE username = ? ORDER BY position",
+            (username,),
+        )
+        return [row_to_favorite(row) for row in rows]
+
+    def _insert_favorites(self, username: str, favorites: List[Movie]):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO favorites (username, position, movie_id, title, poster_url, release_date, "
+            "rating, director, runtime, genres, imdb_rating) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (movie_to_row(username, position, movie) for position, movie in enumerate(favorites)),
+        )
+
+    def _user(self, username: str, password: str, stats: Optional[str]) -> User:
+        return User(
+            username=username,
+            password=password,
+            favorites=self._favorites(username),
+            stats=FavoriteStats.model_validate_json(stats) if stats else None,
+        )
+
+    def _stats(self, username: str) -> Optional[FavoriteStats]:
+        row = self._conn.execute("SELECT stats FROM users WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return None
+        if row[0]:
+            return FavoriteStats.model_validate_json(row[0])
+        return FavoriteStats.from_movies(self._favorites(username))
+
+    def favorites_version(self, username: str) -> Optional[int]:
+        # Only the stats column, the favorites themselves aren't read
+        with self._lock:
+            stats = self._stats(username)
+        return stats.version if stats else None
+
+    def _save_stats(self, username: str, stats: FavoriteStats):
+        self._conn.execute("UPDATE users SET stats = ? WHERE username = ?", (stats.model_dump_json(), username))
+
+    def load_users(self) -> List[User]:
+        with self._lock:
+            users = self._conn.execute("SELECT username, password, stats FROM users").fetchall()
+            return [self._user(*row) for row in users]
+
+    def save_users(self, users: List[User]):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM favorites")
+            self._conn.execute("DELETE FROM users")
+            for user in users:
+                self._conn.execute(
+                    "INSERT INTO users (username, password, stats) VALUES (?, ?, ?)",
+                    (user.username, user.password, user.stats.model_dump_json()),
+                )
+                self._insert_favorites(user.username, user.favorites)
+
+    def get_user(self, username: str) -> Optional[User]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT password, stats FROM users WHERE username = ?", (username,)
+            ).fetchone()
+            if row is None:
+                return None
+            return self._user(username, *row)
+
+    def add_user(self, user: User) -> bool:
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO users (username, password, stats) VALUES (?, ?, ?)",
+                (user.username, user.password, user.stats.model_dump_json()),
+            )
+            if cur.rowcount == 0:
+                return False
+            self._insert_favorites(user.username, user.favorites)
+            return True
+
+    def set_favorites(self, username: str, favorites: List[Movie]):
+        with self._lock, self._conn:
+            old_stats = self._stats(username)
+            self._conn.execute("DELETE FROM favorites WHERE username = ?", (username,))
+            self._insert_favorites(username, favorites)
+            if old_stats is not None:
+                self._save_stats(username, old_stats.replace(favorites))
+
+    def apply_changes(self, changes: Sequence[Change]) -> List[bool]:
+        results = []
+        with self._lock, self._conn:
+            # Take the write lock up front so other processes queue behind us
+            self._conn.execute("BEGIN IMMEDIATE")
+            all_stats = {}
+            next_position = {}
+            for action, username, value in changes:
+                if username not in all_stats:
+                    all_stats[username] = self._stats(username)
+                stats = all_stats[username]
+                if stats is None:
+                    results.append(False)
+                    continue
+
+                if action == "add":
+                    position = next_position.get(username)
+                    if position is None:
+                        position = self._conn.execute(
+                            "SELECT COALESCE(MAX(position) + 1, 0) FROM favorites WHERE username = ?", (username,)
+                        ).fetchone()[0]
+                    cur = self._conn.execute(
+                        "INSERT OR IGNORE INTO favorites (username, position, movie_id, title, poster_url, release_date, "
+                        "rating, director, runtime, genres, imdb_rating) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        movie_to_row(username, position, value),
+                    )
+                    changed = cur.rowcount > 0
+                    if changed:
+                        next_position[username] = position + 1
+                        stats.add(value)
+                else:
+                    row = self._conn.execute(
+                        f"SELECT {FAVORITE_COLUMNS} FROM favorites WHERE username = ? AND movie_id = ?",
+                        (username, value),
+                    ).fetchone()
+                    changed = row is not None
+                    if changed:
+                        self._conn.execute(
+                            "DELETE FROM favorites WHERE username = ? AND movie_id = ?", (username, value)
+                        )
+                        stats.remove(row_to_favorite(row))
+                results.append(changed)
+
+            for username, stats in all_stats.items():
+                if stats is not None:
+                    self._save_stats(username, stats)
+        return results
+
+    def version(self) -> int:
+        # data_version only changes when another connection commits
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def peek_version(self) -> Optional[int]:
+        # In WAL mode reading it never waits on other processes, only on our own connection
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+        finally:
+            self._lock.release()
+
+    def favorite_rows(self) -> Iterator[tuple]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT u.username, f.movie_id, f.release_date, f.rating, f.runtime, f.genres "
+                "FROM users u LEFT JOIN favorites f ON f.username = u.username "
+                "ORDER BY u.username, f.position"
+            ).fetchall()
+        # Most favorites share a handful of genre lists, so each distinct string is parsed once
+        parsed: Dict[Optional[str], list] = {None: [], "": []}
+        for username, movie_id, release_date, rating, runtime, genres in rows:
+            if genres not in parsed:
+                parsed[genres] = json.loads(genres)
+            yield (username, movie_id, release_date, rating or 0.0, runtime or 0, parsed[genres])
+
+    def user_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+class TimedUserStore(UserStore):
+    """Records how long every operation of another store takes (storage_operation_duration_seconds)"""
+
+    def __init__(self, backend: UserStore, name: str):
+        self.backend = backend
+        self.name = name
+
+    def _timed(self, operation: str):
+        return metrics.storage_duration.time(self.name, operation, span_name=f"storage.{operation}")
+
+    def load_users(self) -> List[User]:
+        with self._timed("load_users"):
+            return self.backend.load_users()
+
+    def save_users(self, users: List[User]):
+        with self._timed("save_users"):
+            self.backend.save_users(users)
+
+    def get_user(self, username: str) -> Optional[User]:
+        with self._timed("get_user"):
+            return self.backend.get_user(username)
+
+    def add_user(self, user: User) -> bool:
+        with self._timed("add_user"):
+            return self.backend.add_user(user)
+
+    def set_favorites(self, username: str, favorites: List[Movie]):
+        with self._timed("set_favorites"):
+            self.backend.set_favorites(username, favorites)
+
+    def apply_changes(self, changes: Sequence[Change]) -> List[bool]:
+        with self._timed("apply_changes"):
+            return self.backend.apply_changes(changes)
+
+    def version(self):
+        return self.backend.version()
+
+    def peek_version(self):
+        return self.backend.peek_version()
+
+    def favorites_version(self, username: str) -> Optional[int]:
+        with self._timed("favorites_version"):
+            return self.backend.favorites_version(username)
+
+    def favorite_rows(self) -> Iterator[tuple]:
+        return self.backend.favorite_rows()
+
+    def close(self):
+        self.backend.close()
+
+class CachedUserStore(UserStore):
+    """
+    Identity map in front of another store. Users are loaded once and kept
+    as live models, our own writes update them in place (write-through), and
+    everything is dropped when backend.version() shows another process wrote.
+
+    Calls run on several threads, so a user loaded from the backend is only
+    kept if none of our writes to them was running or started meanwhile: such
+    a write had nothing to update in memory and may be missing from what was
+    loaded (and our own commits don't change version()).
+    """
+
+    def __init__(self, backend: UserStore):
+        self.backend = backend
+        self._users = {}
+        self._lock = threading.Lock()
+        self._version = backend.version()
+        # username -> writes started, and how many of them are still running
+        self._generation: Dict[str, int] = {}
+        self._writing: Counter = Counter()
+        # Lookups answered from memory / that went to the backend
+        self.hits = 0
+        self.misses = 0
+
+    def _validate(self):
+        version = self.backend.version()
+        if version != self._version:
+            self._users.clear()
+            self._version = version
+
+    def load_users(self) -> List[User]:
+        return self.backend.load_users()
+
+    def save_users(self, users: List[User]):
+        self.backend.save_users(users)
+        with self._lock:
+            self._users.clear()
+
+    def _start_writes(self, usernames):
+        with self._lock:
+            for username in usernames:
+                self._generation[username] = self._generation.get(username, 0) + 1
+                self._writing[username] += 1
+
+    def _end_writes(self, usernames):
+        # Called with _lock held
+        for username in usernames:
+            self._writing[username] -= 1
+            if not self._writing[username]:
+                del self._writing[username]
+
+    def get_user(self, username: str) -> Optional[User]:
+        with self._lock:
+            self._validate()
+            user = self._users.get(username)
+            # A write running now may commit before or after our read, don't keep what we read then
+            generation = None if self._writing[username] else self._generation.get(username, 0)
+        if user is None:
+            self.misses += 1
+            user = self.backend.get_user(username)
+            if user is not None and generation is not None:
+                with self._lock:
+                    if self._generation.get(username, 0) == generation:
+                        self._users[username] = user
+        else:
+            self.hits += 1
+        return user
+
+    def add_user(self, user: User) -> bool:
+        added = self.backend.add_user(user)
+        if added:
+            with self._lock:
+                self._users[user.username] = user.model_copy(deep=True)
+        return added
+
+    def set_favorites(self, username: str, favorites: List[Movie]):
+        self._start_writes([username])
+        try:
+            self.backend.set_favorites(username, favorites)
+        except BaseException:
+            with self._lock:
+                self._end_writes([username])
+            raise
+        with self._lock:
+            self._end_writes([username])
+            user = self._users.get(username)
+            if user is not None:
+                user.favorites = [FavoriteMovie.of(m) for m in favorites]
+                user.stats = user.stats.replace(favorites)
+
+    def apply_changes(self, changes: Sequence[Change]) -> List[bool]:
+        usernames = {username for _, username, _ in changes}
+        self._start_writes(usernames)
+        try:
+            results = self.backend.apply_changes(changes)
+        except BaseException:
+            with self._lock:
+                self._end_writes(usernames)
+            raise
+        with self._lock:
+            self._end_writes(usernames)
+            # New lists/stats (copied once per user per batch), so a request reading the old ones isn't affected
+            updated = {}  # username -> (favorites by id, stats)
+            for (action, username, value), changed in zip(changes, results):
+                user = self._users.get(username)
+                if not changed or user is None:
+                    continue
+                if username not in updated:
+                    updated[username] = ({m.id: m for m in user.favorites}, user.stats.model_copy(deep=True))
+                movies, stats = updated[username]
+                if action == "add":
+                    movies[value.id] = FavoriteMovie.of(value)
+                    stats.add(value)
+                else:
+                    removed = movies.pop(value, None)
+                    if removed is None:
+                        # Cached copy is out of date, load it again next time
+                        del self._users[username]
+                        del updated[username]
+                        continue
+                    stats.remove(removed)
+
+            for username, (movies, stats) in updated.items():
+                user = self._users[username]
+                # Dicts keep insertion order: kept movies first, then the added ones
+                user.favorites = list(movies.values())
+                user.stats = stats
+        return results
+
+    def version(self):
+        return self.backend.version()
+
+    def cached_user(self, username: str) -> Optional[User]:
+        """
+        The user if they are in memory and that can be checked to be current
+        without waiting (see peek_version), else None and get_user() has to ask.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            version = self.backend.peek_version()
+            if version is None:
+                return None
+            if version != self._version:
+                self._users.clear()
+                self._version = version
+            user = self._users.get(username)
+        finally:
+            self._lock.release()
+        if user is not None:
+            self.hits += 1
+        return user
+
+    def favorites_version(self, username: str) -> Optional[int]:
+        with self._lock:
+            self._validate()
+            user = self._users.get(username)
+        if user is not None:
+            self.hits += 1
+            return user.stats.version
+        self.misses += 1
+        return self.backend.favorites_version(username)
+
+    def favorite_rows(self) -> Iterator[tuple]:
+        return self.backend.favorite_rows()
+
+    def invalidate(self):
+        with self._lock:
+            self._users.clear()
+
+    def close(self):
+        self.backend.close()
+
+class AsyncUserStore:
+    """
+    The store as the event loop sees it. Calls that may read or write the
+    disk, or wait for a write to finish, run on a dedicated thread pool (not
+    the default executor, so they don't queue behind other to_thread work).
+    Users already in the identity map are answered right away.
+    """
+
+    def __init__(self, store: CachedUserStore, threads: int = STORAGE_THREADS):
+        self.store = store
+        self.threads = threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def run(self, fn, *args):
+        """fn(*args) on a storage thread, in the caller's context so trace spans end up in its request"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="storage")
+        call = functools.partial(contextvars.copy_context().run, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    async def get_user(self, username: str) -> Optional[User]:
+        user = self.store.cached_user(username)
+        if user is not None:
+            return user
+        return await self.run(self.store.get_user, username)
+
+    async def favorites_version(self, username: str) -> Optional[int]:
+        user = self.store.cached_user(username)
+        if user is not None:
+            return user.stats.version
+        return await self.run(self.store.favorites_version, username)
+
+    async def load_users(self) -> List[User]:
+        return await self.run(self.store.load_users)
+
+    async def save_users(self, users: List[User]):
+        await self.run(self.store.save_users, users)
+
+    async def add_user(self, user: User) -> bool:
+        return await self.run(self.store.add_user, user)
+
+    async def set_favorites(self, username: str, favorites: List[Movie]):
+        await self.run(self.store.set_favorites, username, favorites)
+
+    async def apply_changes(self, changes: Sequence[Change]) -> List[bool]:
+        return await self.run(self.store.apply_changes, changes)
+
+    async def close(self):
+        """Let running calls finish and stop the threads, they are started again on the next call"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            await asyncio.to_thread(executor.shutdown)
+
+def migrate_json_to_sqlite(json_file: str = JSON_DB_FILE, db_file: str = USERS_DB_FILE) -> int:
+    """Copy every user from users.json into the SQLite database, returns the number of users copied"""
+    users = JsonUserStore(json_file).load_users()
+    store = SqliteUserStore(db_file)
+    try:
+        copied = 0
+        for user in users:
+            if store.add_user(user):
+                copied += 1
+        return copied
+    finally:
+        store.close()
+
+def create_store(backend: str = STORAGE_BACKEND) -> UserStore:
+    """Open the configured backend. A new SQLite database is seeded from users.json if it exists"""
+    if backend == "json":
+        return JsonUserStore(JSON_DB_FILE)
+    if backend != "sqlite":
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+    if not os.path.exists(USERS_DB_FILE) and os.path.exists(JSON_DB_FILE):
+        migrate_json_to_sqlite(JSON_DB_FILE, USERS_DB_FILE)
+    return SqliteUserStore(USERS_DB_FILE)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Usage: python storage.py migrate [users.json] [users.db]")
+        sys.exit(1)
+    source = sys.argv[2] if len(sys.argv) > 2 else JSON_DB_FILE
+    target = sys.argv[3] if len(sys.argv) > 3 else USERS_DB_FILE
+    print(f"Migrated {migrate_json_to_sqlite(source, target)} users from {source} to {target}")
@@ -0,0 +1,334 @@
+"""
+Shared HTTP client for all TMDB/OMDb calls.
+
+One AsyncClient is created when the app starts and closed when it stops,
+so connections (and their TLS sessions) are reused between requests.
+SingleFlight lets identical concurrent lookups share one upstream call.
+
+Every request goes through get(), which applies a token-bucket rate limit
+per upstream, retries 429/5xx/network errors with jittered exponential
+backoff (honoring Retry-After), and trips a circuit breaker after repeated
+failures so callers fail fast and fall back to cached data.
+"""
+import asyncio
+import email.utils
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional
+import httpx
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+# Pool/timeout settings, can be tuned with env variables
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+
+# Retry/backoff and circuit breaker settings
+MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.25"))
+BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "8"))
+BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.getenv("UPSTREAM_BREAKER_RESET", "30"))
+
+_client: Optional[httpx.AsyncClient] = None
+
+# Counters of the active count_calls() blocks, shared with every task started inside them
+_call_counters: ContextVar[tuple] = ContextVar("upstream_call_counters", default=())
+
+def http2_available() -> bool:
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def create_client(transport: Optional[httpx.AsyncBaseTransport] = None) -> httpx.AsyncClient:
+    """Build a client with pooled keep-alive connections. transport is used by tests/benchmarks"""
+    return httpx.AsyncClient(
+        http2=transport is None and http2_available(),
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        transport=transport,
+    )
+
+async def start_client(transport: Optional[httpx.AsyncBaseTransport] = None):
+    """Called on app startup"""
+    global _client
+    await close_client()
+    _client = create_client(transport)
+
+async def close_client():
+    """Called on app shutdown"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it if the app was not started (scripts, shell)"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client()
+    return _client
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one in-flight task instead of
+    each hitting TMDB/OMDb. Keys are tuples whose first item names the kind
+    of call, which is what the counters are grouped by.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self.calls: Dict[str, int] = {}
+        self.coalesced: Dict[str, int] = {}
+
+    async def do(self, key: tuple, fn: Callable[..., Awaitable], *args):
+        kind = key[0]
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced[kind] = self.coalesced.get(kind, 0) + 1
+        # Shield so one caller giving up doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key: tuple, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {
+            kind: {"calls": calls, "coalesced": self.coalesced.get(kind, 0)}
+            for kind, calls in self.calls.items()
+        } | {"in_flight": len(self._inflight)}
+
+flights = SingleFlight()
+
+
+class UpstreamUnavailable(Exception):
+    """The upstream is down (circuit open), out of quota, or kept failing after retries"""
+
+class TokenBucket:
+    """Allows rate requests per second on average, with bursts up to burst. rate 0 = no limit"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        # The lock makes waiters take tokens in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Hold every request back, used when the upstream sends Retry-After"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+class DailyQuota:
+    """Requests allowed per UTC day (OMDb's free plan has 1000). limit 0 = no quota"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.day = None
+
+    def take(self) -> bool:
+        if not self.limit:
+            return True
+        today = datetime.now(timezone.utc).date()
+        if today != self.day:
+            self.day, self.used = today, 0
+        if self.used >= self.limit:
+            return False
+        self.used += 1
+        return True
+
+    def exhaust(self):
+        """The upstream told us the quota is used up"""
+        self.day = datetime.now(timezone.utc).date()
+        self.used = max(self.used, self.limit)
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold failures in a row. While open every call
+    fails fast; after reset_timeout one trial call is let through
+    (half-open) and its result closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "half-open":
+            # Let this call through as the trial, the rest wait for another period
+            self.opened_at = time.monotonic()
+            return True
+        return state == "closed"
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class Upstream:
+    """Rate limit, quota, breaker and counters for one external API"""
+
+    def __init__(self, name: str, rate: float, daily_quota: int = 0):
+        self.name = name
+        self.limiter = TokenBucket(rate)
+        self.quota = DailyQuota(daily_quota)
+        self.breaker = CircuitBreaker()
+        self.counters = {"requests": 0, "retries": 0, "rate_limited": 0, "failures": 0, "rejected": 0}
+
+    def stats(self) -> dict:
+        return {"state": self.breaker.state, "quota_used": self.quota.used, **self.counters}
+
+UPSTREAMS = {
+    # TMDB allows around 40-50 requests/s per IP
+    "tmdb": Upstream("tmdb", rate=float(os.getenv("TMDB_RATE_LIMIT", "40"))),
+    "omdb": Upstream(
+        "omdb",
+        rate=float(os.getenv("OMDB_RATE_LIMIT", "10")),
+        daily_quota=int(os.getenv("OMDB_DAILY_LIMIT", "1000")),
+    ),
+}
+
+def retry_after(resp: Optional[httpx.Response]) -> Optional[float]:
+    """Seconds from a Retry-After header (either seconds or an HTTP date)"""
+    value = resp.headers.get("Retry-After") if resp is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+def backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def is_retryable(resp: Optional[httpx.Response]) -> bool:
+    return resp is None or resp.status_code == 429 or resp.status_code >= 500
+
+async def get(upstream: str, url: str, params: dict, client: Optional[httpx.AsyncClient] = None,
+              endpoint: str = "") -> httpx.Response:
+    """
+    GET url through the limiter/retry/breaker of the named upstream ("tmdb" or "omdb").
+    Returns the last response (callers still check status_code), or raises
+    UpstreamUnavailable when there is no response to return. endpoint labels the metrics.
+    """
+    up = UPSTREAMS[upstream]
+    if not up.breaker.allow():
+        up.counters["rejected"] += 1
+        raise UpstreamUnavailable(f"{upstream} circuit is open")
+
+    client = client or get_client()
+    resp = None
+    for attempt in range(MAX_RETRIES + 1):
+        if not up.quota.take():
+            up.counters["rejected"] += 1
+            raise UpstreamUnavailable(f"{upstream} daily quota used up")
+        await up.limiter.acquire()
+
+        up.counters["requests"] += 1
+        for counts in _call_counters.get():
+            counts[upstream] = counts.get(upstream, 0) + 1
+        with metrics.upstream_in_flight.track(upstream), \
+                metrics.upstream_duration.time(upstream, endpoint, span_name=f"{upstream}.{endpoint}"):
+            try:
+                resp = await client.get(url, params=params)
+            except httpx.TransportError:
+                resp = None
+        metrics.upstream_requests.inc(upstream, endpoint, str(resp.status_code) if resp is not None else "error")
+
+        if not is_retryable(resp):
+            up.breaker.record_success()
+            if upstream == "omdb" and resp.status_code == 401 and "limit" in resp.text.lower():
+                up.quota.exhaust()
+            return resp
+
+        delay = retry_after(resp)
+        if resp is not None and resp.status_code == 429:
+            up.counters["rate_limited"] += 1
+            if delay is not None:
+                up.limiter.pause(delay)
+        # Don't hold the request for a long Retry-After, fail and let callers use cached data
+        if attempt == MAX_RETRIES or (delay or 0) > BACKOFF_MAX:
+            break
+        up.counters["retries"] += 1
+        await asyncio.sleep(delay if delay is not None else backoff(attempt))
+
+    up.counters["failures"] += 1
+    up.breaker.record_failure()
+    if resp is None:
+        raise UpstreamUnavailable(f"{upstream} did not respond")
+    return resp
+
+@contextmanager
+def count_calls():
+    """Count the upstream requests made inside the block, per upstream. Blocks can be nested"""
+    counts: Dict[str, int] = {}
+    token = _call_counters.set(_call_counters.get() + (counts,))
+    try:
+        yield counts
+    finally:
+        _call_counters.reset(token)
+
+def stats() -> dict:
+    return {name: up.stats() for name, up in UPSTREAMS.items()}
@@ -0,0 +1,200 @@
+"""
+Startup warm-up, so the first users after a deploy or restart don't pay
+for the TMDB/OMDb fan-out of a cold cache.
+
+On start the movie detail cache and the genre pools are restored from a
+snapshot file (WARMUP_SNAPSHOT_FILE, off when not set). Then a background
+task loads every genre pool that is missing or stale and the details of
+TMDB's popular movies, at most WARMUP_CONCURRENCY at a time, and starts
+the genre pool refresher once it is done. /api/ready answers 503 with
+the progress until then, so a load balancer holds traffic back.
+
+Snapshots are written every WARMUP_SNAPSHOT_INTERVAL seconds and on
+shutdown. Reading and writing the file runs in a worker thread.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from cache import MovieDetailCache, movie_cache
+from models import Movie
+from pools import GenrePools, genre_pools
+from services import popular_movies
+from storage import atomic_write_json
+
+load_dotenv()
+
+WARMUP_SNAPSHOT_FILE = os.getenv("WARMUP_SNAPSHOT_FILE") or None
+# Seconds between snapshots, 0 = only on shutdown
+WARMUP_SNAPSHOT_INTERVAL = float(os.getenv("WARMUP_SNAPSHOT_INTERVAL", "600"))
+# 0 = only restore the snapshot, don't load anything from TMDB on start
+WARMUP_PREFETCH = os.getenv("WARMUP_PREFETCH", "1") != "0"
+# Genre pools / popular pages loaded at the same time
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "4"))
+# Pages of TMDB's popular movies (20 each) whose details are fetched
+WARMUP_POPULAR_PAGES = int(os.getenv("WARMUP_POPULAR_PAGES", "2"))
+# Seconds after which the app reports ready even if the warm-up isn't done (the rest keeps loading)
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "120"))
+
+def read_snapshot(path: str) -> Optional[Tuple[float, dict, Dict[str, Tuple[float, List[Movie]]]]]:
+    """(saved_at, movie cache entries, genre -> (age, pool)), None if there is no usable snapshot"""
+    try:
+        with open(path, "rb") as f:
+            data = json.loads(f.read())
+        pools = {
+            genre: (pool["age"], [Movie(**movie) for movie in pool["movies"]])
+            for genre, pool in data["genre_pools"].items()
+        }
+        return data["saved_at"], data["movie_cache"], pools
+    except FileNotFoundError:
+        return None
+    except (ValueError, TypeError, KeyError) as e:
+        # A broken snapshot only means a cold start
+        print(f"Ignoring warm-up snapshot {path}: {e}")
+        return None
+
+class Warmup:
+    def __init__(
+        self,
+        pools: GenrePools,
+        cache: MovieDetailCache,
+        snapshot_file: Optional[str] = WARMUP_SNAPSHOT_FILE,
+        snapshot_interval: float = WARMUP_SNAPSHOT_INTERVAL,
+        prefetch: bool = WARMUP_PREFETCH,
+        concurrency: int = WARMUP_CONCURRENCY,
+        popular_pages: int = WARMUP_POPULAR_PAGES,
+        timeout: float = WARMUP_TIMEOUT,
+    ):
+        self.pools = pools
+        self.cache = cache
+        self.snapshot_file = snapshot_file
+        self.snapshot_interval = snapshot_interval
+        self.prefetch = prefetch
+        self.concurrency = max(1, concurrency)
+        self.popular_pages = popular_pages
+        self.timeout = timeout
+        self.phase = "starting"
+        self.ready = False
+        self.timed_out = False
+        self.restored = {"movie_cache_entries": 0, "genre_pools": 0, "snapshot_age": None}
+        self.progress = {"genres": 0, "genres_total": 0, "popular_pages": 0, "popular_pages_total": 0, "failed": 0}
+        self.snapshots_written = 0
+        self._started_at = 0.0
+        self._ready_after: Optional[float] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        """Restore the snapshot, then load the rest in the background (called on app startup)"""
+        self._started_at = time.monotonic()
+        if self.snapshot_file:
+            self.phase = "restoring"
+            await self.restore(self.snapshot_file)
+        if self.prefetch:
+            self.phase = "prefetching"
+            self._tasks.append(asyncio.create_task(self._prefetch()))
+        else:
+            self._set_ready()
+            self.pools.start()
+        if self.snapshot_file and self.snapshot_interval:
+            self._tasks.append(asyncio.create_task(self._write_periodically()))
+
+    async def stop(self):
+        """Stop loading and write a last snapshot (called on app shutdown)"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.snapshot_file:
+            await self.write_snapshot(self.snapshot_file)
+
+    async def restore(self, path: str):
+        snapshot = await asyncio.to_thread(read_snapshot, path)
+        if snapshot is None:
+            return
+        saved_at, cache_entries, pools = snapshot
+        since = max(0.0, time.time() - saved_at)
+        self.restored["movie_cache_entries"] = self.cache.restore(cache_entries)
+        self.restored["genre_pools"] = sum(
+            self.pools.restore(genre, pool, age + since) for genre, (age, pool) in pools.items()
+        )
+        self.restored["snapshot_age"] = round(since, 1)
+
+    async def write_snapshot(self, path: str):
+        # Copied on the loop (the caches aren't thread-safe), serialized and written in a thread
+        data = {"saved_at": time.time(), "movie_cache": self.cache.snapshot(), "genre_pools": self.pools.snapshot()}
+        await asyncio.to_thread(lambda: atomic_write_json(path, json.dumps(data).encode()))
+        self.snapshots_written += 1
+
+    async def _write_periodically(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                await self.write_snapshot(self.snapshot_file)
+            except OSError as e:
+                print(f"Could not write warm-up snapshot {self.snapshot_file}: {e}")
+
+    async def _prefetch(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        genres = [genre for genre in self.pools.genres if not self.pools.is_fresh(genre)]
+        self.progress["genres_total"] = len(genres)
+        self.progress["popular_pages_total"] = self.popular_pages
+
+        async def load_genre(genre: str):
+            async with semaphore:
+                try:
+                    await self.pools.refresh(genre)
+                except Exception as e:
+                    print(f"Warm-up failed for genre {genre}: {e}")
+            self.progress["genres"] += 1
+            if not self.pools.peek(genre):
+                self.progress["failed"] += 1
+
+        async def load_popular(page: int):
+            async with semaphore:
+                try:
+                    movies = await popular_movies(page)
+                except Exception as e:
+                    print(f"Warm-up failed for popular page {page}: {e}")
+                    movies = []
+            self.progress["popular_pages"] += 1
+            if not movies:
+                self.progress["failed"] += 1
+
+        tasks = [asyncio.create_task(load_genre(genre)) for genre in genres]
+        tasks += [asyncio.create_task(load_popular(page)) for page in range(1, self.popular_pages + 1)]
+        try:
+            if tasks:
+                done, pending = await asyncio.wait(tasks, timeout=self.timeout)
+                if pending:
+                    self.timed_out = True
+                    self._set_ready()
+                    await asyncio.wait(pending)
+            self._set_ready()
+        finally:
+            for task in tasks:
+                task.cancel()
+        self.pools.start()
+
+    def _set_ready(self):
+        if not self.ready:
+            self.ready = True
+            self.phase = "ready"
+            self._ready_after = time.monotonic() - self._started_at
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "phase": self.phase,
+            "timed_out": self.timed_out,
+            "seconds": round(self._ready_after if self._ready_after is not None
+                             else time.monotonic() - self._started_at, 2),
+            "restored": self.restored,
+            "progress": self.progress,
+            "snapshot": {"file": self.snapshot_file, "written": self.snapshots_written},
+        }
+
+warmup = Warmup(genre_pools, movie_cache)